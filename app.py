@@ -1,22 +1,160 @@
 from flask import Flask, request, jsonify, send_file, render_template, Response
 from flask_cors import CORS
-import yt_dlp
+import logging
+import mimetypes
 import os
 import re
 from pathlib import Path
-import subprocess
-import tempfile
-import shutil
 import time
 import traceback
 from urllib.parse import quote
 
+from audio import AudioTarget, process_audio, stream_args, transcoder
+from cache import ResultCache, cache_key, key_digest
+from capabilities import get_capabilities
+from cookies import CookieManager
+from downloader import ExtractionSession
+from file_serving import content_disposition, serve_file
+from formats import expected_size
+from progress import DownloadTracker, downloaded_path
+from jobs import JobManager, JOB_FINISHED, JOB_FAILED, event_stream
+from job_store import StoreJobManager, open_store
+from log import RateLimitFilter, bind_requests, configure as configure_logging
+from metrics import CONTENT_TYPE, Profiler, counter, gauge, instrument_app, render as render_metrics, timed
+from singleflight import SingleFlight
+from storage import DiskSpaceError, ScratchArea, publish
+from streaming import OriginStream, PROGRESSIVE_AUDIO, PROGRESSIVE_VIDEO, pipe_through
+from strategies import (
+    StrategyScheduler, classify_error, CLIENT_FAILURES,
+    REASON_BOT, REASON_FORMAT_UNAVAILABLE, REASON_JSON_BLOCKED, REASON_SIGNATURE,
+)
+from video_ids import media_key
+from ydl_options import BROWSER_HEADERS, BROWSER_USER_AGENT, freeze, network_options, specialize
+
 app = Flask(__name__, 
             static_folder='src', 
             static_url_path='/static',
             template_folder='public')
 CORS(app)
 
+# Registro con niveles (LOG_LEVEL, LOG_FORMAT) y request_id en cada petición
+configure_logging()
+bind_requests(app)
+logger = logging.getLogger(__name__)
+# Los reintentos de estrategias se repiten en cada descarga: se resumen
+strategy_log = logging.getLogger('strategies')
+strategy_log.addFilter(RateLimitFilter())
+
+# Delegar el envío de archivos al servidor web (Apache/lighttpd) con X-Sendfile
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'False').lower() == 'true'
+
+# Pool de trabajos de descarga: límite global y por host
+JOBS_MAX_WORKERS = int(os.getenv('JOBS_MAX_WORKERS', 4))
+JOBS_PER_HOST_LIMIT = int(os.getenv('JOBS_PER_HOST_LIMIT', 2))
+JOBS_RESULT_TTL = int(os.getenv('JOBS_RESULT_TTL', 3600))
+
+
+# Caché de resultados: archivos ya descargados por (video, formato)
+CACHE_DIR = os.getenv('CACHE_DIR', 'cache')
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 10 * 1024 * 1024 * 1024))
+CACHE_TTL = int(os.getenv('CACHE_TTL', 7 * 24 * 3600))
+
+results_cache = ResultCache(CACHE_DIR, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL)
+
+# Directorios de trabajo y espacio en disco: por debajo de DISK_MIN_FREE las
+# descargas esperan en la cola; por debajo de DISK_REJECT_FREE se rechazan (507)
+DISK_MIN_FREE = int(os.getenv('DISK_MIN_FREE', 2 * 1024 * 1024 * 1024))
+DISK_REJECT_FREE = int(os.getenv('DISK_REJECT_FREE', DISK_MIN_FREE // 2))
+JOB_DISK_QUOTA = int(os.getenv('JOB_DISK_QUOTA', 2 * 1024 * 1024 * 1024))
+SCRATCH_MAX_AGE = int(os.getenv('SCRATCH_MAX_AGE', 6 * 3600))
+SCRATCH_JANITOR_INTERVAL = int(os.getenv('SCRATCH_JANITOR_INTERVAL', 300))
+
+scratch = ScratchArea(CACHE_DIR, min_free=DISK_MIN_FREE, job_quota=JOB_DISK_QUOTA, max_age=SCRATCH_MAX_AGE)
+scratch.start_janitor(SCRATCH_JANITOR_INTERVAL)
+
+# Descargas en curso por clave de caché, compartidas entre peticiones simultáneas
+inflight = SingleFlight()
+
+# Cookies de YouTube: se cargan una vez y se recargan solo si el archivo cambia
+cookie_pool = CookieManager.from_env()
+
+# Estadísticas de éxito por (cliente, formato) para ordenar los intentos
+strategy_scheduler = StrategyScheduler(
+    failure_threshold=int(os.getenv('STRATEGY_FAILURE_THRESHOLD', 3)),
+    cooldown=int(os.getenv('STRATEGY_COOLDOWN', 300))
+)
+
+# Clientes de YouTube que se prueban para extraer el video
+CLIENT_STRATEGIES = ['mweb', 'tv_embedded', 'web', 'android', 'ios']
+
+# Capacidades del sistema (ffmpeg y codificadores), detectadas una sola vez al iniciar
+CAPABILITIES = get_capabilities()
+
+# Plantillas de opciones de yt-dlp; cada petición añade outtmpl y format
+YDL_BASE_OPTS = {
+    'quiet': False,
+    'no_warnings': False,
+    'ignoreerrors': False,
+    'noplaylist': True,
+    
+    # Reintentos, tiempos de espera y paralelismo de red (configurables por entorno)
+    **network_options(),
+    
+    # User-Agent realista
+    'user_agent': BROWSER_USER_AGENT,
+    
+    # Headers completos de navegador real
+    'http_headers': BROWSER_HEADERS,
+    
+    # Configuración específica para YouTube - se probarán diferentes clientes
+    'extractor_args': {
+        'youtube': {
+            'player_client': ['mweb'],  # Empezar con mweb (móvil web) que suele funcionar mejor
+            'player_skip': ['webpage'],
+        }
+    },
+    
+    # Evitar detección adicional
+    'no_check_certificate': False,
+    'prefer_insecure': False,
+}
+
+YDL_VIDEO_TEMPLATE = freeze({**YDL_BASE_OPTS, 'merge_output_format': 'mp4'})
+
+# El audio se descarga sin convertir; audio.py decide si copiarlo, cambiar el contenedor o recodificarlo
+YDL_AUDIO_TEMPLATE = freeze(YDL_BASE_OPTS)
+
+# JOBS_BACKEND=store: los trabajos van al almacén compartido JOBS_STORE y los
+# ejecutan los procesos de worker.py, en esta máquina con el almacén SQLite (ver job_store.py)
+JOBS_BACKEND = os.getenv('JOBS_BACKEND', 'local')
+JOBS_STORE = os.getenv('JOBS_STORE', os.path.join(CACHE_DIR, '.jobs.db'))
+
+if JOBS_BACKEND == 'store':
+    jobs = StoreJobManager(open_store(JOBS_STORE), result_ttl=JOBS_RESULT_TTL)
+else:
+    jobs = JobManager(
+        max_workers=JOBS_MAX_WORKERS,
+        per_host_limit=JOBS_PER_HOST_LIMIT,
+        result_ttl=JOBS_RESULT_TTL,
+        admit=scratch.has_room
+    )
+
+# Métricas de Prometheus (/metrics) y perfiles bajo demanda: con PROFILE_DIR,
+# ?profile=1 o la cabecera X-Profile: 1 guardan un .prof de la petición
+# (en /api/download, del trabajo de descarga)
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+profiler = Profiler(PROFILE_DIR)
+instrument_app(app, profiler, job_endpoints={'download'})
+
+gauge('media_jobs_queued', 'Trabajos de descarga en cola', func=lambda: jobs.stats()['queued'])
+gauge('media_jobs_running', 'Trabajos de descarga en curso', func=lambda: jobs.stats()['running'])
+gauge('media_transcodes_running', 'Procesos de FFmpeg en curso', func=lambda: transcoder.stats()['running'])
+gauge('media_transcodes_waiting', 'Conversiones esperando turno de FFmpeg', func=lambda: transcoder.stats()['waiting'])
+gauge('media_disk_free_bytes', 'Espacio libre para descargas, descontadas las reservas', func=scratch.free_bytes)
+gauge('media_downloads_in_flight', 'Descargas distintas en vuelo', func=lambda: inflight.stats()['in_flight'])
+counter('media_cache_hits_total', 'Aciertos de la caché de resultados', func=lambda: results_cache.stats()['hits'])
+counter('media_cache_misses_total', 'Fallos de la caché de resultados', func=lambda: results_cache.stats()['misses'])
+
 def sanitize_filename(filename):
     """Limpia el nombre del archivo para que sea seguro para el sistema de archivos"""
     filename = re.sub(r'[<>:"/\\|?*]', '', filename)
@@ -25,150 +163,93 @@ def sanitize_filename(filename):
     return filename
 
 
-def download_video(url, format_id=None):
-    """Descarga el video o audio según el formato especificado (simple y confiable)"""
-    temp_dir = None
-    try:
-        temp_dir = tempfile.mkdtemp()
+def cached_result(key, count=True):
+    """Devuelve el resultado guardado en la caché para la clave, si existe"""
+    cached = results_cache.get(key, count=count)
+    if not cached:
+        return None
+    return {
+        'file_path': cached['path'],
+        'filename': cached['filename'],
+        'title': cached['title']
+    }
 
-        # Verifica FFmpeg
-        try:
-            subprocess.run(
-                ['ffmpeg', '-version'],
-                capture_output=True,
-                check=True,
-                timeout=5
-            )
-            ffmpeg_available = True
-        except:
-            ffmpeg_available = False
-
-        # Determina si es audio o video
-        if format_id and ('audio' in format_id.lower() and 'video' not in format_id.lower()):
-            is_audio = True
-            ydl_format = 'bestaudio/best'
-        else:
-            is_audio = False
-            # Usar formatos más simples que no requieran PO tokens
-            ydl_format = 'best[ext=mp4]/best[height<=720]/best[height<=480]/best'
 
-        # User-Agent actualizado y realista
-        user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        
-        # Extraer visitor_data de las cookies si existen
-        visitor_data = None
-        cookies_file_path = None
-        
-        # Primero intentar leer cookies desde variable de entorno
-        cookies_from_env = os.getenv('YOUTUBE_COOKIES')
-        if cookies_from_env:
-            try:
-                # Crear archivo temporal con las cookies de la variable de entorno
-                cookies_file_path = os.path.join(temp_dir, 'cookies_temp.txt')
-                with open(cookies_file_path, 'w', encoding='utf-8') as f:
-                    f.write(cookies_from_env)
-                print("Cookies cargadas desde variable de entorno YOUTUBE_COOKIES")
-            except Exception as e:
-                print(f"Error al crear archivo temporal de cookies: {e}")
-                cookies_file_path = None
-        
-        # Si no hay cookies en variable de entorno, usar archivo local
-        if not cookies_file_path and os.path.exists('cookies.txt'):
-            cookies_file_path = 'cookies.txt'
-            print("Cookies cargadas desde archivo cookies.txt")
-        
-        # Extraer visitor_data de las cookies
-        if cookies_file_path:
-            try:
-                with open(cookies_file_path, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        if 'VISITOR_INFO1_LIVE' in line and not line.strip().startswith('#'):
-                            parts = line.strip().split('\t')
-                            if len(parts) >= 7:
-                                visitor_data = parts[6]  # El valor de la cookie
-                                print(f"Visitor data extraído: {visitor_data[:20]}...")
-                                break
-            except Exception as e:
-                print(f"Error al extraer visitor_data: {e}")
-                pass
+def download_video(url, format_id=None, audio=None, progress=None):
+    """
+    Descarga el video o audio según el formato especificado (simple y confiable).
+    audio es el AudioTarget del audio (por defecto, mp3 VBR si hay ffmpeg).
+    progress(phase, **datos) recibe el avance (ver Job.report_progress).
+    Las peticiones simultáneas del mismo video y formato comparten una sola descarga.
+    """
+    # Determina si es audio o video
+    if format_id and ('audio' in format_id.lower() and 'video' not in format_id.lower()):
+        is_audio = True
+        audio = audio or AudioTarget.from_request()
+        ydl_format = f'{audio.format_spec()}/best'
+    else:
+        is_audio = False
+        audio = None
+        # Usar formatos más simples que no requieran PO tokens
+        ydl_format = 'best[ext=mp4]/best[height<=720]/best[height<=480]/best'
+
+    # Si ya se descargó este video en este formato, servirlo desde la caché
+    key = cache_key(media_key(url), 'mp3' if is_audio else 'video', audio.key if audio else 'best')
+    result = cached_result(key)
+    if result:
+        logger.debug('Resultado servido desde caché: %s', result['filename'])
+        return result
+
+    result, shared = inflight.do(key, fetch_video, url, key, is_audio, ydl_format, audio, progress)
+    if shared:
+        logger.debug('Descarga compartida con otra petición en curso: %s', result['filename'])
+    return dict(result)
+
+
+def fetch_video(url, key, is_audio, ydl_format, audio=None, progress=None):
+    """Ejecuta la descarga con yt-dlp y guarda el resultado en la caché"""
+    # Otra petición pudo completar esta descarga justo antes de entrar aquí
+    result = cached_result(key, count=False)
+    if result:
+        return result
+
+    work = scratch.create()
+
+    def reserve_space(info):
+        # Cuota por trabajo y espacio libre, con el formato ya elegido y antes de escribir nada
+        size = expected_size(info)
+        if size:
+            work.reserve(size, copies=2 if info.get('requested_formats') or is_audio else 1)
+
+    try:
+
+        # Cookies compartidas en memoria (rotando entre las cuentas configuradas)
+        with timed('cookies'):
+            cookies = cookie_pool.acquire()
+        visitor_data = cookies.visitor_data if cookies else None
         
-        ydl_opts = {
-            'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
-            'quiet': False,
-            'no_warnings': False,
-            'ignoreerrors': False,
-            'noplaylist': True,
-            'socket_timeout': 30,
-            'retries': 10,
-            'fragment_retries': 10,
-            'format': ydl_format,
-            
-            # User-Agent realista
-            'user_agent': user_agent,
-            
-            # Headers completos de navegador real
-            'http_headers': {
-                'User-Agent': user_agent,
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
-                'Accept-Language': 'es-ES,es;q=0.9,en-US;q=0.8,en;q=0.7',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'DNT': '1',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-                'Sec-Fetch-Dest': 'document',
-                'Sec-Fetch-Mode': 'navigate',
-                'Sec-Fetch-Site': 'none',
-                'Sec-Fetch-User': '?1',
-                'Cache-Control': 'max-age=0',
-            },
-            
-            # Configuración específica para YouTube - se probarán diferentes clientes
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['mweb'],  # Empezar con mweb (móvil web) que suele funcionar mejor
-                    'player_skip': ['webpage'],
-                }
-            },
-            
-            # Evitar detección adicional
-            'no_check_certificate': False,
-            'prefer_insecure': False,
-        }
+        template = YDL_AUDIO_TEMPLATE if is_audio else YDL_VIDEO_TEMPLATE
+        tracker = DownloadTracker(on_progress=progress)
+        ydl_opts = specialize(
+            template,
+            outtmpl=os.path.join(work.path, '%(title)s.%(ext)s'),
+            format=ydl_format,
+            **tracker.hook_options()
+        )
         
         # Agregar visitor_data si se encontró en las cookies
         if visitor_data:
             ydl_opts['extractor_args']['youtube']['visitor_data'] = visitor_data
-            print(f"✅ Visitor data configurado: {visitor_data[:30]}...")
-        else:
-            print("⚠️ No se encontró visitor_data en las cookies")
         
-        # Agregar cookies si existe el archivo (de variable de entorno o local)
-        if cookies_file_path and os.path.exists(cookies_file_path):
-            ydl_opts['cookiefile'] = cookies_file_path
-            # Verificar que el archivo tenga contenido
-            try:
-                with open(cookies_file_path, 'r', encoding='utf-8') as f:
-                    cookie_lines = [l for l in f if l.strip() and not l.strip().startswith('#')]
-                    print(f"✅ Cookies configuradas: {len(cookie_lines)} cookies encontradas en {cookies_file_path}")
-            except Exception as e:
-                print(f"⚠️ Error al verificar cookies: {e}")
-        else:
-            print("⚠️ No se encontró archivo de cookies")
-
-        if is_audio:
-            if ffmpeg_available:
-                ydl_opts['postprocessors'] = [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }]
+        if cookies:
+            logger.debug('Cookies configuradas: %d cookies de %s', cookies.count, cookies.name,
+                         extra={'visitor_data': bool(visitor_data)})
         else:
-            ydl_opts['merge_output_format'] = 'mp4'
+            logger.debug('No se encontró archivo de cookies')
 
-        print(f"Descargando {('audio' if is_audio else 'video')} con formato: {ydl_format}")
+        logger.info('Descargando %s con formato: %s', 'audio' if is_audio else 'video', ydl_format)
         
         # Estrategia: probar diferentes clientes y formatos
-        client_strategies = ['mweb', 'tv_embedded', 'web', 'android', 'ios']
         format_strategies = [ydl_format]
         if not is_audio:
             format_strategies.extend([
@@ -184,64 +265,63 @@ def download_video(url, format_id=None):
         last_error = None
         success = False
         json_blocked_count = 0  # Contador de errores de JSON bloqueado
+        failed_clients = set()  # Clientes descartados para esta petición
         
-        # Probar diferentes clientes
-        for client in client_strategies:
-            if success:
-                break
-                
-            ydl_opts['extractor_args']['youtube']['player_client'] = [client]
-            if visitor_data:
-                ydl_opts['extractor_args']['youtube']['visitor_data'] = visitor_data
-            
-            client_json_blocked = False
+        if progress:
+            progress('extracting')
+        
+        # Probar las combinaciones cliente × formato empezando por la que mejor funciona.
+        # La información del video se extrae una vez por cliente y se reutiliza entre formatos.
+        with ExtractionSession(url, ydl_opts, cookies, before_download=reserve_space) as session:
+            for client, fmt_strategy in strategy_scheduler.order(CLIENT_STRATEGIES, format_strategies):
+                if client in failed_clients or session.extraction_failed(client):
+                    continue
             
-            # Probar diferentes formatos con este cliente
-            for fmt_strategy in format_strategies:
+                started = time.monotonic()
+                tracker.reset()
                 try:
-                    ydl_opts['format'] = fmt_strategy
-                    print(f"Intentando con cliente '{client}' y formato: {fmt_strategy}")
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        info = ydl.extract_info(url, download=True)
-                        title = sanitize_filename(info.get('title', 'video'))
-                        success = True
-                        break  # Si funciona, salir del loop
+                    strategy_log.debug("Intentando con cliente '%s' y formato: %s", client, fmt_strategy)
+                    info = session.download(fmt_strategy, client)
+                    title = sanitize_filename(info.get('title', 'video'))
+                    strategy_scheduler.record(client, fmt_strategy, True, time.monotonic() - started)
+                    success = True
+                    break  # Si funciona, salir del loop
+                except DiskSpaceError as e:
+                    # No es culpa del formato ni del cliente: probar el siguiente (puede ser más pequeño)
+                    last_error = e
+                    logger.warning('%s', e)
+                    work.clear()
                 except Exception as e:
                     last_error = e
-                    error_msg = str(e).lower()
-                    error_str = str(e)
-                    
+                    reason = classify_error(e)
+                    # Si falló la extracción, el formato no llegó a probarse
+                    tried = None if session.extraction_failed(client) else fmt_strategy
+                    strategy_scheduler.record(client, tried, False, time.monotonic() - started, reason)
+                
                     # Detectar si YouTube está bloqueando JSON completamente
-                    if 'failed to parse json' in error_msg or 'failed to extract any player response' in error_msg:
+                    if reason == REASON_JSON_BLOCKED:
                         json_blocked_count += 1
-                        client_json_blocked = True
-                        print(f"⚠️ YouTube está bloqueando respuestas JSON con cliente '{client}'")
+                        strategy_log.warning("YouTube está bloqueando respuestas JSON con cliente '%s'", client)
                         # Si varios clientes tienen este problema, es un bloqueo general
                         if json_blocked_count >= 2:
-                            print("⚠️ YouTube parece estar bloqueando completamente las descargas desde esta IP")
-                            time.sleep(2)  # Delay antes de probar otro cliente
-                        break  # Cambiar de cliente inmediatamente
+                            strategy_log.warning('YouTube parece estar bloqueando completamente las descargas desde esta IP')
                     # Si es un error de formato no disponible, intentar el siguiente formato
-                    elif 'format is not available' in error_msg or 'requested format' in error_msg:
-                        print(f"Formato {fmt_strategy} no disponible, probando siguiente...")
-                        continue
+                    elif reason == REASON_FORMAT_UNAVAILABLE:
+                        strategy_log.info('Formato %s no disponible, probando siguiente...', fmt_strategy)
                     # Si hay problemas con firmas, probar otro cliente
-                    elif 'signature' in error_msg or 'challenge' in error_msg or 'sabr' in error_msg:
-                        print(f"Cliente '{client}' tiene problemas con firmas, probando otro cliente...")
-                        break
+                    elif reason == REASON_SIGNATURE:
+                        strategy_log.info("Cliente '%s' tiene problemas con firmas, probando otro cliente...", client)
                     # Si es un error de bot detection
-                    elif 'bot' in error_msg or 'confirm that you are not a bot' in error_msg:
-                        print(f"⚠️ YouTube detectó bot con cliente '{client}'")
+                    elif reason == REASON_BOT:
+                        strategy_log.warning("YouTube detectó bot con cliente '%s'", client)
                         json_blocked_count += 1
-                        break
                     else:
                         # Si es otro tipo de error, continuar con siguiente formato
-                        print(f"Error con formato {fmt_strategy}: {error_str[:100]}")
-                        continue
-            
-            # Si este cliente fue bloqueado, agregar delay antes del siguiente
-            if client_json_blocked:
-                time.sleep(1)
+                        strategy_log.info('Error con formato %s: %.100s', fmt_strategy, e)
+                
+                    # Cambiar de cliente inmediatamente si el fallo es del cliente
+                    if reason in CLIENT_FAILURES:
+                        failed_clients.add(client)
         
         if not success:
             # Si todos los formatos y clientes fallaron
@@ -252,42 +332,46 @@ def download_video(url, format_id=None):
             else:
                 raise Exception("No se pudo descargar con ningún formato o cliente disponible. YouTube puede estar bloqueando las descargas.")
 
-        # Buscar archivo descargado
-        files = [
-            f for f in os.listdir(temp_dir)
-            if os.path.isfile(os.path.join(temp_dir, f)) and not f.endswith('.part')
-        ]
-
-        if not files:
+        # Archivo final reportado por yt-dlp (requested_downloads / hooks)
+        downloaded_file = downloaded_path(info, tracker)
+        if not downloaded_file:
             raise Exception("No se encontró ningún archivo descargado.")
 
-        downloaded_file = max(
-            (os.path.join(temp_dir, f) for f in files),
-            key=lambda p: os.path.getsize(p)
-        )
-
         file_size = os.path.getsize(downloaded_file)
         if file_size < 10240:
             raise Exception(f"Archivo muy pequeño ({file_size} bytes). Descarga fallida o incompleta.")
 
         if is_audio:
-            final_ext = '.mp3' if ffmpeg_available else os.path.splitext(downloaded_file)[1].lower()
+            # Copiar, cambiar el contenedor o recodificar según el destino
+            with timed('postprocess'):
+                downloaded_file, final_ext, action = process_audio(
+                    downloaded_file, audio, info.get('acodec'),
+                    progress=progress, duration=info.get('duration')
+                )
+            logger.debug('Audio %s: %s → %s', audio.key, action, final_ext)
         else:
             final_ext = '.mp4'
 
         final_filename = f"{title}{final_ext}"
 
+        # Guardar el resultado en la caché (rename atómico); el directorio de trabajo se borra al salir
+        with timed('publish'):
+            cached_path, _ = publish(downloaded_file, CACHE_DIR, f"{key_digest(key)}{final_ext}")
+        results_cache.put(key, cached_path, filename=final_filename, title=title, url=url)
+
         return {
-            'file_path': downloaded_file,
+            'file_path': cached_path,
             'filename': final_filename,
-            'title': title,
-            'temp_dir': temp_dir
+            'title': title
         }
 
-    except Exception as e:
-        if temp_dir and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir, ignore_errors=True)
-        raise e
+    finally:
+        work.close()
+
+
+def file_response(file_path, filename):
+    """Respuesta que envía un archivo de la caché como descarga (Range, ETag, 304)"""
+    return serve_file(file_path, sanitize_filename(filename), root=CACHE_DIR)
 
 
 @app.route('/')
@@ -297,7 +381,7 @@ def index():
 
 @app.route('/api/download', methods=['POST'])
 def download():
-    temp_dir = None
+    """Encola la descarga y devuelve el id del trabajo inmediatamente"""
     try:
         if not request.is_json:
             return jsonify({'error': 'Content-Type debe ser application/json'}), 415
@@ -314,55 +398,199 @@ def download():
         
         format_id = 'bestaudio/best' if format_type == 'mp3' else None
         
-        result = download_video(url, format_id)
-        file_path = result['file_path']
-        filename = result['filename']
-        temp_dir = result['temp_dir']
-
-        # 🔥 CORRECCIÓN: nombre normal sin encoding raro
-        download_name = sanitize_filename(filename)
-        content_disposition = f'attachment; filename="{download_name}"'
-
-        def generate_file():
+        audio = None
+        if format_type == 'mp3':
             try:
-                with open(file_path, 'rb') as f:
-                    while True:
-                        chunk = f.read(8192)
-                        if not chunk:
-                            break
-                        yield chunk
-            finally:
-                try:
-                    if temp_dir and os.path.exists(temp_dir):
-                        shutil.rmtree(temp_dir, ignore_errors=True)
-                except:
-                    pass
+                audio = AudioTarget.from_request(
+                    data.get('audio_codec'), data.get('audio_quality'), data.get('accept')
+                )
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
         
-        response = Response(
-            generate_file(),
-            mimetype='application/octet-stream',
-            headers={
-                'Content-Disposition': content_disposition,
-                'Content-Type': 'application/octet-stream'
-            }
-        )
+        if not scratch.has_room(DISK_REJECT_FREE):
+            return jsonify({'error': 'No hay espacio en disco para nuevas descargas. Intenta más tarde.'}), 507
         
-        return response
+        func = profiler.wrap(download_video, 'download_job') if profiler.wants(request) else download_video
+        job = jobs.submit(url, func, url, format_id, audio,
+                          keep_traceback=logger.isEnabledFor(logging.DEBUG), report_progress=True)
+        return jsonify({
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': f"/api/jobs/{job.id}",
+            'events_url': f"/api/jobs/{job.id}/events",
+            'result_url': f"/api/jobs/{job.id}/result"
+        }), 202
         
     except Exception as e:
-        if temp_dir and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir, ignore_errors=True)
-        
-        error_trace = traceback.format_exc()
-        print(f"Error en /api/download: {str(e)}")
-        print(error_trace)
-
+        logger.exception('Error en /api/download')
+        # La traza en la respuesta solo con LOG_LEVEL=DEBUG
+        error_trace = traceback.format_exc() if logger.isEnabledFor(logging.DEBUG) else None
         return jsonify({
             'error': str(e),
             'details': error_trace
         }), 500
 
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Progreso del trabajo en vivo (Server-Sent Events) hasta que termina"""
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    response = Response(event_stream(job), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Evitar que nginx acumule los eventos en su búfer
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Envía el archivo descargado de un trabajo terminado"""
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    if job.status == JOB_FAILED:
+        return jsonify({'error': job.error, 'details': job.details}), 500
+    if job.status != JOB_FINISHED:
+        return jsonify(job.to_dict()), 202
+
+    file_path = job.result['file_path']
+    if not os.path.exists(file_path):
+        return jsonify({'error': 'El resultado de la descarga ya no está disponible'}), 410
+
+    return file_response(file_path, job.result['filename'])
+
+
+@app.route('/api/stream', methods=['GET', 'POST'])
+def stream():
+    """
+    Envía el video al cliente a medida que llega del origen, sin esperar a que
+    termine la descarga. Solo para formatos progresivos (un único archivo HTTP).
+    El audio se convierte al vuelo (audio_codec, audio_quality, accept) con un
+    turno del pool de FFmpeg; si no queda ninguno, responde 503.
+    """
+    data = request.get_json(silent=True) or request.args
+    url = data.get('url')
+    format_type = data.get('format', 'video')
+    
+    if not url:
+        return jsonify({'error': 'URL no proporcionada'}), 400
+    
+    is_audio = format_type == 'mp3'
+    audio = None
+    if is_audio:
+        try:
+            audio = AudioTarget.from_request(
+                data.get('audio_codec'), data.get('audio_quality'), data.get('accept')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    # Si ya está en caché (misma clave que download_video), enviar el archivo directamente
+    result = cached_result(cache_key(media_key(url), 'mp3' if is_audio else 'video', audio.key if audio else 'best'))
+    if result:
+        return file_response(result['file_path'], result['filename'])
+    
+    with timed('cookies'):
+        cookies = cookie_pool.acquire()
+    ydl_opts = specialize(YDL_VIDEO_TEMPLATE)
+    if cookies and cookies.visitor_data:
+        ydl_opts['extractor_args']['youtube']['visitor_data'] = cookies.visitor_data
+    
+    format_spec = PROGRESSIVE_AUDIO if is_audio else PROGRESSIVE_VIDEO
+    session = ExtractionSession(url, ydl_opts, cookies)
+    fmt = None
+    last_error = None
+    for client, _ in strategy_scheduler.order(CLIENT_STRATEGIES, [format_spec]):
+        started = time.monotonic()
+        try:
+            fmt = session.select(format_spec, client)
+            origin = OriginStream(session.ydl(client), fmt)
+            strategy_scheduler.record(client, format_spec, True, time.monotonic() - started)
+            break
+        except Exception as e:
+            fmt = None
+            last_error = e
+            tried = None if session.extraction_failed(client) else format_spec
+            strategy_scheduler.record(client, tried, False, time.monotonic() - started, classify_error(e))
+    
+    if not fmt:
+        session.close()
+        return jsonify({
+            'error': 'No hay un formato que se pueda enviar en streaming para este video. Usa /api/download.',
+            'details': str(last_error) if last_error else None
+        }), 422
+    
+    title = sanitize_filename(fmt.get('title', 'video'))
+    ffmpeg_args, ext = None, fmt.get('ext', 'mp4')
+    if audio:
+        ffmpeg_args, ext = stream_args(audio, ext, fmt.get('acodec'))
+    # Sin esperar turno: la petición ocuparía un hilo sin enviar nada
+    if ffmpeg_args and not transcoder.try_acquire():
+        origin.close()
+        session.close()
+        return jsonify({
+            'error': 'Todas las conversiones de audio están ocupadas. Intenta más tarde o usa /api/download.'
+        }), 503
+    
+    headers = {}
+    if ffmpeg_args:
+        body = pipe_through(origin, transcoder.command(ffmpeg_args))
+    else:
+        body = iter(origin)
+        if origin.size:
+            headers['Content-Length'] = str(origin.size)
+    filename = f"{title}.{ext}"
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    headers['Content-Disposition'] = content_disposition(filename)
+    
+    response = Response(body, mimetype=mimetype, headers=headers, direct_passthrough=True)
+    response.call_on_close(session.close)
+    if ffmpeg_args:
+        response.call_on_close(transcoder.release)
+    return response
+
+
+@app.route('/api/jobs', methods=['GET'])
+def jobs_stats():
+    stats = jobs.stats()
+    stats['transcoder'] = transcoder.stats()
+    stats['disk'] = scratch.stats()
+    return jsonify(stats)
+
+
+@app.route('/api/capabilities', methods=['GET'])
+def capabilities():
+    return jsonify(CAPABILITIES)
+
+
+@app.route('/api/strategies', methods=['GET'])
+def strategies_stats():
+    return jsonify(strategy_scheduler.stats())
+
+
+@app.route('/api/cache', methods=['GET'])
+def cache_stats():
+    stats = results_cache.stats()
+    stats['in_flight'] = inflight.stats()
+    return jsonify(stats)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
+
 if __name__ == '__main__':
     import os
     import socket
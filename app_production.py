@@ -2,17 +2,36 @@
 Versión de producción de la aplicación Flask
 Usa variables de entorno para configuración
 """
-from flask import Flask, request, jsonify, send_file, render_template
+from flask import Flask, request, jsonify, render_template, Response
 from flask_cors import CORS
 import yt_dlp
+import logging
 import os
 import re
 from pathlib import Path
-import subprocess
-import tempfile
-import shutil
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from audio import AudioTarget, process_audio, transcoder
+from cache import ResultCache, cache_key
+from downloader import ExtractionSession
+from file_serving import content_disposition, resolve, serve_file
+from formats import analyze_formats, expected_size
+from info_cache import InfoCache
+from playlists import NotAPlaylist, PlaylistManager, flat_entries, playlist_id, stream_zip
+from progress import DownloadTracker, downloaded_path
+from capabilities import get_capabilities
+from library import DEFAULT_PAGE_SIZE, InvalidQuery, Library
+from jobs import JobManager, JOB_FINISHED, JOB_FAILED, event_stream
+from job_store import StoreJobManager, open_store
+from log import bind_requests, configure as configure_logging
+from metrics import CONTENT_TYPE, Profiler, counter, gauge, instrument_app, render as render_metrics, timed
+from singleflight import SingleFlight
+from storage import DiskSpaceError, ScratchArea, publish
+from strategies import StrategyScheduler, classify_error, REASON_DRM
+from video_ids import media_key
+from ydl_options import freeze, network_options, specialize
 
 # Configuración desde variables de entorno
 FLASK_ENV = os.getenv('FLASK_ENV', 'production')
@@ -23,6 +42,14 @@ PORT = int(os.getenv('PORT', 5000))
 app = Flask(__name__, static_folder='static', static_url_path='/static')
 CORS(app)
 
+# Registro con niveles (LOG_LEVEL, LOG_FORMAT) y request_id en cada petición
+configure_logging()
+bind_requests(app)
+logger = logging.getLogger(__name__)
+
+# Delegar el envío de archivos al servidor web (Apache/lighttpd) con X-Sendfile
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'False').lower() == 'true'
+
 # Directorio para guardar los archivos descargados
 DOWNLOAD_DIR = Path(os.getenv('DOWNLOAD_DIR', 'downloads'))
 DOWNLOAD_DIR.mkdir(exist_ok=True)
@@ -30,6 +57,131 @@ DOWNLOAD_DIR.mkdir(exist_ok=True)
 # Límite de tamaño de archivo (por defecto 2GB)
 MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', 2 * 1024 * 1024 * 1024))
 
+# Directorios de trabajo y espacio en disco: por debajo de DISK_MIN_FREE las
+# descargas esperan en la cola; por debajo de DISK_REJECT_FREE se rechazan (507)
+DISK_MIN_FREE = int(os.getenv('DISK_MIN_FREE', 2 * 1024 * 1024 * 1024))
+DISK_REJECT_FREE = int(os.getenv('DISK_REJECT_FREE', DISK_MIN_FREE // 2))
+JOB_DISK_QUOTA = int(os.getenv('JOB_DISK_QUOTA', MAX_FILE_SIZE))
+SCRATCH_MAX_AGE = int(os.getenv('SCRATCH_MAX_AGE', 6 * 3600))
+SCRATCH_JANITOR_INTERVAL = int(os.getenv('SCRATCH_JANITOR_INTERVAL', 300))
+
+scratch = ScratchArea(DOWNLOAD_DIR, min_free=DISK_MIN_FREE, job_quota=JOB_DISK_QUOTA, max_age=SCRATCH_MAX_AGE)
+scratch.start_janitor(SCRATCH_JANITOR_INTERVAL)
+
+# Caché de resultados: los archivos publicados en DOWNLOAD_DIR se reutilizan por (video, formato)
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 20 * 1024 * 1024 * 1024))
+CACHE_TTL = int(os.getenv('CACHE_TTL', 7 * 24 * 3600))
+
+# Índice de metadatos de los archivos publicados (para /api/list)
+LIBRARY_DB = os.getenv('LIBRARY_DB', str(DOWNLOAD_DIR / '.library.db'))
+
+library = Library(LIBRARY_DB)
+library.backfill(DOWNLOAD_DIR)
+
+def forget_file(entry):
+    """Quita del índice los archivos que la caché expulsa"""
+    library.remove(os.path.basename(entry['path']))
+
+results_cache = ResultCache(DOWNLOAD_DIR, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL, on_remove=forget_file)
+
+# Descargas en curso por clave de caché, compartidas entre peticiones simultáneas
+inflight = SingleFlight()
+
+# Capacidades del sistema (ffmpeg y codificadores), detectadas una sola vez al iniciar
+CAPABILITIES = get_capabilities()
+
+# Plantillas de opciones de yt-dlp; cada petición añade outtmpl y format
+YDL_BASE_OPTS = {
+    'quiet': not DEBUG,
+    'no_warnings': not DEBUG,
+    'ignoreerrors': False,
+    'extract_flat': False,
+    'prefer_insecure': False,
+    'noplaylist': True,
+    # Reintentos, tiempos de espera y paralelismo de red (configurables por entorno)
+    **network_options(),
+    'extractor_args': {
+        'youtube': {
+            'player_client': ['android', 'web'],
+        }
+    },
+}
+
+YDL_CLIENT = ','.join(YDL_BASE_OPTS['extractor_args']['youtube']['player_client'])
+
+YDL_VIDEO_TEMPLATE = freeze(YDL_BASE_OPTS)
+
+# El audio se descarga sin convertir; audio.py decide si copiarlo, cambiar el contenedor o recodificarlo
+YDL_AUDIO_TEMPLATE = YDL_VIDEO_TEMPLATE
+
+# Estadísticas de éxito por formato para ordenar los intentos
+strategy_scheduler = StrategyScheduler(
+    failure_threshold=int(os.getenv('STRATEGY_FAILURE_THRESHOLD', 3)),
+    cooldown=int(os.getenv('STRATEGY_COOLDOWN', 300))
+)
+
+# Caché de /api/info por video: memoria (LRU) + SQLite, con caducidad
+INFO_CACHE_DB = os.getenv('INFO_CACHE_DB', str(DOWNLOAD_DIR / '.info_cache.db'))
+INFO_CACHE_TTL = int(os.getenv('INFO_CACHE_TTL', 6 * 3600))
+INFO_CACHE_SIZE = int(os.getenv('INFO_CACHE_SIZE', 1024))
+
+# Campos de cada formato que se incluyen en la información del video
+INFO_FORMAT_FIELDS = (
+    'format_id', 'ext', 'protocol', 'width', 'height', 'fps',
+    'vcodec', 'acodec', 'tbr', 'filesize', 'filesize_approx', 'format_note',
+)
+
+info_cache = InfoCache(INFO_CACHE_DB, ttl=INFO_CACHE_TTL, max_entries=INFO_CACHE_SIZE)
+info_inflight = SingleFlight()
+
+# /api/info/batch: extracciones simultáneas como máximo y URLs por petición
+INFO_BATCH_WORKERS = int(os.getenv('INFO_BATCH_WORKERS', 4))
+INFO_BATCH_MAX = int(os.getenv('INFO_BATCH_MAX', 50))
+
+info_pool = ThreadPoolExecutor(max_workers=INFO_BATCH_WORKERS, thread_name_prefix='info')
+
+# Pool de trabajos de descarga: límite global y por host
+JOBS_MAX_WORKERS = int(os.getenv('JOBS_MAX_WORKERS', 4))
+JOBS_PER_HOST_LIMIT = int(os.getenv('JOBS_PER_HOST_LIMIT', 2))
+JOBS_RESULT_TTL = int(os.getenv('JOBS_RESULT_TTL', 3600))
+
+# JOBS_BACKEND=store: los trabajos van al almacén compartido JOBS_STORE y los
+# ejecutan los procesos de worker.py, en esta máquina con el almacén SQLite (ver job_store.py)
+JOBS_BACKEND = os.getenv('JOBS_BACKEND', 'local')
+JOBS_STORE = os.getenv('JOBS_STORE', str(DOWNLOAD_DIR / '.jobs.db'))
+
+if JOBS_BACKEND == 'store':
+    jobs = StoreJobManager(open_store(JOBS_STORE), result_ttl=JOBS_RESULT_TTL)
+else:
+    jobs = JobManager(
+        max_workers=JOBS_MAX_WORKERS,
+        per_host_limit=JOBS_PER_HOST_LIMIT,
+        result_ttl=JOBS_RESULT_TTL,
+        admit=scratch.has_room
+    )
+
+# Métricas de Prometheus (/metrics) y perfiles bajo demanda: con PROFILE_DIR,
+# ?profile=1 o la cabecera X-Profile: 1 guardan un .prof de la petición
+# (en /api/download, del trabajo de descarga)
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+profiler = Profiler(PROFILE_DIR)
+instrument_app(app, profiler, job_endpoints={'download'})
+
+gauge('media_jobs_queued', 'Trabajos de descarga en cola', func=lambda: jobs.stats()['queued'])
+gauge('media_jobs_running', 'Trabajos de descarga en curso', func=lambda: jobs.stats()['running'])
+gauge('media_transcodes_running', 'Procesos de FFmpeg en curso', func=lambda: transcoder.stats()['running'])
+gauge('media_transcodes_waiting', 'Conversiones esperando turno de FFmpeg', func=lambda: transcoder.stats()['waiting'])
+gauge('media_disk_free_bytes', 'Espacio libre para descargas, descontadas las reservas', func=scratch.free_bytes)
+gauge('media_downloads_in_flight', 'Descargas distintas en vuelo', func=lambda: inflight.stats()['in_flight'])
+counter('media_cache_hits_total', 'Aciertos de la caché de resultados', func=lambda: results_cache.stats()['hits'])
+counter('media_cache_misses_total', 'Fallos de la caché de resultados', func=lambda: results_cache.stats()['misses'])
+
+def disk_full_response():
+    """Respuesta 507 si el espacio libre está por debajo de DISK_REJECT_FREE, si no None"""
+    if scratch.has_room(DISK_REJECT_FREE):
+        return None
+    return jsonify({'error': 'No hay espacio en disco para nuevas descargas. Intenta más tarde.'}), 507
+
 def sanitize_filename(filename):
     """Limpia el nombre del archivo para que sea válido"""
     filename = re.sub(r'[<>:"/\\|?*]', '', filename)
@@ -37,8 +189,39 @@ def sanitize_filename(filename):
         filename = filename[:200]
     return filename
 
+def normalize_info(info):
+    """Campos de la información del video que se devuelven y se guardan en caché"""
+    formats = info.get('formats', [])
+    # Resumen de formatos (DRM, mejor audio, mp4 progresivo...) calculado una vez
+    summary = analyze_formats(info)
+    
+    return {
+        'title': info.get('title', 'Video'),
+        'duration': info.get('duration', 0),
+        'thumbnail': info.get('thumbnail', ''),
+        'uploader': info.get('uploader', 'Desconocido'),
+        'has_drm': summary['has_drm'],
+        'summary': summary,
+        'formats': [
+            {field: fmt.get(field) for field in INFO_FORMAT_FIELDS}
+            for fmt in formats
+        ],
+    }
+
 def get_video_info(url):
-    """Obtiene información del video sin descargarlo"""
+    """
+    Obtiene información del video sin descargarlo.
+    Se guarda en caché por video; las consultas simultáneas del mismo video
+    comparten una sola extracción.
+    """
+    key = media_key(url)
+    info = info_cache.get(key)
+    if info is None:
+        info, _ = info_inflight.do(key, fetch_video_info, url, key)
+    return dict(info)
+
+def fetch_video_info(url, key):
+    """Extrae la información con yt-dlp y la guarda en la caché"""
     ydl_opts = {
         'quiet': True,
         'no_warnings': True,
@@ -47,41 +230,79 @@ def get_video_info(url):
     
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            has_drm = False
-            formats = info.get('formats', [])
-            for fmt in formats:
-                if fmt.get('has_drm') or fmt.get('drm') or 'drm' in str(fmt).lower():
-                    has_drm = True
-                    break
-            
-            return {
-                'title': info.get('title', 'Video'),
-                'duration': info.get('duration', 0),
-                'thumbnail': info.get('thumbnail', ''),
-                'uploader': info.get('uploader', 'Desconocido'),
-                'has_drm': has_drm,
-            }
+            info = normalize_info(ydl.extract_info(url, download=False))
     except Exception as e:
         error_msg = str(e).lower()
         if 'drm' in error_msg or 'protected' in error_msg or 'encrypted' in error_msg:
             raise Exception("Este video está protegido por DRM y no se puede descargar. Intenta con otro video.")
         raise Exception(f"Error al obtener información del video: {str(e)}")
+    
+    info_cache.put(key, info)
+    return info
+
+def batch_video_info(urls):
+    """Resuelve varias URLs en paralelo (con el pool acotado de info_pool), en orden"""
+    def lookup(url):
+        try:
+            return {'url': url, 'info': get_video_info(url)}
+        except Exception as e:
+            return {'url': url, 'error': str(e)}
+    
+    return list(info_pool.map(lookup, urls))
 
-def download_video(url, format_type='video'):
-    """Descarga el video o audio según el formato especificado"""
-    temp_dir = None
+def cached_result(key, count=True):
+    """Devuelve el resultado guardado en la caché para la clave, si existe"""
+    cached = results_cache.get(key, count=count)
+    if not cached:
+        return None
+    return {
+        'filename': cached['filename'],
+        'path': cached['path'],
+        'title': cached['title']
+    }
+
+def download_video(url, format_type='video', audio=None, progress=None):
+    """
+    Descarga el video o audio según el formato especificado.
+    audio es el AudioTarget del formato 'mp3' (por defecto, mp3 VBR si hay ffmpeg).
+    progress(phase, **datos) recibe el avance (ver Job.report_progress).
+    Las peticiones simultáneas del mismo video y formato comparten una sola descarga.
+    """
+    if format_type == 'mp3' and audio is None:
+        audio = AudioTarget.from_request()
+    key = cache_key(media_key(url), format_type, audio.key if audio else 'best')
+    result = cached_result(key)
+    if result:
+        return result
+    
+    result, _ = inflight.do(key, fetch_video, url, key, format_type, audio, progress)
+    return dict(result)
+
+def fetch_video(url, key, format_type, audio=None, progress=None):
+    """Ejecuta la descarga con yt-dlp y publica el resultado en DOWNLOAD_DIR"""
+    # Otra petición pudo completar esta descarga justo antes de entrar aquí
+    result = cached_result(key, count=False)
+    if result:
+        return result
+    
+    work = scratch.create()
+    
+    def reserve_space(info):
+        # Cuota por trabajo y espacio libre, con el formato ya elegido y antes de escribir nada
+        size = expected_size(info)
+        if size:
+            work.reserve(size, copies=2 if info.get('requested_formats') or format_type == 'mp3' else 1)
+    
     try:
-        temp_dir = tempfile.mkdtemp()
-        
         if format_type == 'mp3':
-            format_strategies = [
+            # Primero el audio que evita recodificar para el destino pedido
+            format_strategies = list(dict.fromkeys([
+                audio.format_spec(),
                 'bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio',
                 'bestaudio/best',
                 'worstaudio/worst',
                 'audio',
-            ]
+            ]))
         else:
             format_strategies = [
                 'best[ext=mp4]/best',
@@ -92,118 +313,51 @@ def download_video(url, format_type='video'):
                 'best',
             ]
         
-        base_opts = {
-            'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
-            'quiet': not DEBUG,
-            'no_warnings': not DEBUG,
-            'ignoreerrors': False,
-            'extract_flat': False,
-            'prefer_insecure': False,
-            'noplaylist': True,
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android', 'web'],
-                }
-            },
-        }
+        template = YDL_AUDIO_TEMPLATE if format_type == 'mp3' else YDL_VIDEO_TEMPLATE
+        # Los formatos que superan MAX_FILE_SIZE se descartan antes de elegir y la
+        # descarga se corta en cuanto lo supera, sin esperar a tener el archivo entero
+        tracker = DownloadTracker(on_progress=progress, max_bytes=MAX_FILE_SIZE)
+        ydl_opts = specialize(
+            template,
+            outtmpl=os.path.join(work.path, '%(title)s.%(ext)s'),
+            **tracker.hook_options()
+        )
         
-        if format_type == 'mp3':
-            try:
-                subprocess.run(['ffmpeg', '-version'], 
-                            capture_output=True, 
-                            check=True, 
-                            timeout=5)
-                ffmpeg_available = True
-            except:
-                ffmpeg_available = False
-            
-            if ffmpeg_available:
-                base_opts['postprocessors'] = [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }]
+        if progress:
+            progress('extracting')
         
         last_error = None
-        for format_strategy in format_strategies:
-            try:
-                ydl_opts = base_opts.copy()
-                ydl_opts['format'] = format_strategy
-                
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=True)
+        # La información del video se extrae una sola vez; cada formato se elige sobre ella
+        with ExtractionSession(url, ydl_opts, before_download=reserve_space,
+                               max_filesize=MAX_FILE_SIZE) as session:
+            # Probar primero los formatos que mejor están funcionando
+            for client, format_strategy in strategy_scheduler.order([YDL_CLIENT], format_strategies):
+                if session.extraction_failed():
+                    break
+                started = time.monotonic()
+                tracker.reset()
+                try:
+                    info = session.download(format_strategy)
                     title = sanitize_filename(info.get('title', 'video'))
-                    
+                
                     formats = info.get('formats', [])
                     has_video_audio = False
                     for fmt in formats:
                         vcodec = fmt.get('vcodec', 'none')
-                        acodec = fmt.get('acodec', 'none')
+                        # acodec ausente significa desconocido (p. ej. extractor genérico), no "sin audio"
+                        acodec = fmt.get('acodec')
                         if vcodec != 'none' or (acodec != 'none' and format_type == 'mp3'):
                             has_video_audio = True
                             break
-                    
+                
                     if not has_video_audio and formats:
                         raise Exception("Solo hay imágenes disponibles para este video.")
-                    
-                    downloaded_file = None
-                    max_attempts = 30
-                    attempt = 0
-                    
-                    while attempt < max_attempts:
-                        time.sleep(1)
-                        attempt += 1
-                        
-                        files = [f for f in os.listdir(temp_dir) if os.path.isfile(os.path.join(temp_dir, f))]
-                        
-                        if not files:
-                            if attempt < max_attempts:
-                                continue
-                            raise Exception("No se encontró ningún archivo descargado")
-                        
-                        max_size = 0
-                        candidate_file = None
-                        for f in files:
-                            file_path = os.path.join(temp_dir, f)
-                            if f.endswith('.part') or f.endswith('.mhtml'):
-                                continue
-                            if any(f.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif']):
-                                continue
-                            try:
-                                file_size = os.path.getsize(file_path)
-                                if file_size > max_size and file_size > 10240:
-                                    max_size = file_size
-                                    candidate_file = file_path
-                            except OSError:
-                                continue
-                        
-                        if candidate_file:
-                            current_size = os.path.getsize(candidate_file)
-                            time.sleep(0.5)
-                            new_size = os.path.getsize(candidate_file)
-                            
-                            if current_size == new_size and current_size > 10240:
-                                downloaded_file = candidate_file
-                                break
-                    
-                    if not downloaded_file:
-                        files = [f for f in os.listdir(temp_dir) 
-                                if os.path.isfile(os.path.join(temp_dir, f)) and not f.endswith('.part')]
-                        if files:
-                            max_size = 0
-                            for f in files:
-                                file_path = os.path.join(temp_dir, f)
-                                try:
-                                    file_size = os.path.getsize(file_path)
-                                    if file_size > max_size:
-                                        max_size = file_size
-                                        downloaded_file = file_path
-                                except OSError:
-                                    continue
-                    
+                
+                    # Archivo final reportado por yt-dlp (requested_downloads / hooks)
+                    downloaded_file = downloaded_path(info, tracker)
                     if not downloaded_file:
                         raise Exception("No se pudo encontrar el archivo descargado.")
-                    
+                
                     file_size = os.path.getsize(downloaded_file)
                     if file_size == 0:
                         raise Exception("El archivo descargado está vacío.")
@@ -211,52 +365,53 @@ def download_video(url, format_type='video'):
                         raise Exception(f"El archivo descargado es muy pequeño ({file_size} bytes).")
                     if file_size > MAX_FILE_SIZE:
                         raise Exception(f"El archivo es demasiado grande ({file_size} bytes).")
-                    
+                
                     if format_type == 'mp3':
-                        if not ffmpeg_available:
-                            file_ext = os.path.splitext(downloaded_file)[1].lower()
-                            if file_ext in ['.m4a', '.webm', '.opus', '.ogg', '.aac']:
-                                final_ext = file_ext
-                            else:
-                                final_ext = '.m4a'
-                        else:
-                            final_ext = '.mp3'
+                        # Copiar, cambiar el contenedor o recodificar según el destino
+                        with timed('postprocess'):
+                            downloaded_file, final_ext, _ = process_audio(
+                                downloaded_file, audio, info.get('acodec'),
+                                progress=progress, duration=info.get('duration')
+                            )
                     else:
                         final_ext = '.mp4'
-                    
-                    final_filename = f"{title}{final_ext}"
-                    final_path = DOWNLOAD_DIR / final_filename
-                    
-                    counter = 1
-                    while final_path.exists():
-                        final_filename = f"{title}_{counter}{final_ext}"
-                        final_path = DOWNLOAD_DIR / final_filename
-                        counter += 1
-                    
-                    shutil.copy2(downloaded_file, final_path)
-                    
-                    if os.path.getsize(final_path) == 0:
-                        raise Exception("Error al copiar el archivo.")
-                    
-                    shutil.rmtree(temp_dir, ignore_errors=True)
-                    
+                
+                    # Mismo sistema de archivos que DOWNLOAD_DIR: rename atómico, sin copia
+                    with timed('publish'):
+                        final_path, final_filename = publish(downloaded_file, DOWNLOAD_DIR, f"{title}{final_ext}")
+                
+                    library.add(
+                        final_filename,
+                        os.path.getsize(final_path),
+                        title=title,
+                        url=url,
+                        video_key=media_key(url),
+                        format=final_ext.lstrip('.'),
+                        duration=info.get('duration')
+                    )
+                    results_cache.put(key, final_path, filename=final_filename, title=title, url=url)
+                    strategy_scheduler.record(client, format_strategy, True, time.monotonic() - started)
+                
                     return {
                         'filename': final_filename,
-                        'path': str(final_path),
+                        'path': final_path,
                         'title': title
                     }
-            except Exception as e:
-                last_error = e
-                error_msg = str(e).lower()
-                if 'drm' in error_msg or 'protected' in error_msg or 'encrypted' in error_msg:
-                    raise Exception("Este video está protegido por DRM y no se puede descargar.")
-                if temp_dir and os.path.exists(temp_dir):
-                    for f in os.listdir(temp_dir):
-                        try:
-                            os.remove(os.path.join(temp_dir, f))
-                        except:
-                            pass
-                continue
+                except DiskSpaceError as e:
+                    # No es culpa del formato: probar el siguiente (puede ser más pequeño)
+                    last_error = e
+                    work.clear()
+                    continue
+                except Exception as e:
+                    last_error = e
+                    reason = classify_error(e)
+                    if reason == REASON_DRM:
+                        raise Exception("Este video está protegido por DRM y no se puede descargar.")
+                    # Si falló la extracción, el formato no llegó a probarse
+                    tried = None if session.extraction_failed() else format_strategy
+                    strategy_scheduler.record(client, tried, False, time.monotonic() - started, reason)
+                    work.clear()
+                    continue
         
         if last_error:
             error_msg = str(last_error).lower()
@@ -267,12 +422,46 @@ def download_video(url, format_type='video'):
             raise Exception("No se pudo descargar el archivo.")
             
     except Exception as e:
-        if temp_dir and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir, ignore_errors=True)
         error_msg = str(e).lower()
         if 'drm' in error_msg or 'protected' in error_msg or 'encrypted' in error_msg:
             raise Exception("Este video está protegido por DRM y no se puede descargar.")
         raise e
+    finally:
+        work.close()
+
+# Listas de reproducción: cada entrada es un trabajo más del pool de descargas
+PLAYLIST_MAX_ITEMS = int(os.getenv('PLAYLIST_MAX_ITEMS', 200))
+
+if JOBS_BACKEND == 'store':
+    # Las entradas se reparten aquí (con el límite por sitio), pero cada una solo
+    # espera a que un worker haga su descarga
+    playlist_jobs = JobManager(
+        max_workers=JOBS_MAX_WORKERS,
+        per_host_limit=JOBS_PER_HOST_LIMIT,
+        result_ttl=JOBS_RESULT_TTL
+    )
+
+    def playlist_download(url, format_type):
+        return jobs.call(url, download_video, url, format_type)
+else:
+    playlist_jobs = jobs
+    playlist_download = download_video
+
+playlists = PlaylistManager(
+    DOWNLOAD_DIR,
+    playlist_jobs,
+    download=playlist_download,
+    exists=lambda filename: resolve(DOWNLOAD_DIR, filename) is not None
+)
+
+def playlist_response(run):
+    data = run.to_dict()
+    for item in data['items']:
+        if item['filename']:
+            item['download_url'] = f"/api/file/{item['filename']}"
+    data['status_url'] = f"/api/playlist/{run.id}"
+    data['zip_url'] = f"/api/playlist/{run.id}/zip"
+    return data
 
 @app.route('/')
 def index():
@@ -297,12 +486,30 @@ def get_info():
         info = get_video_info(url)
         return jsonify(info)
     except Exception as e:
+        logger.exception('Error en /api/info')
         error_trace = traceback.format_exc() if DEBUG else None
         return jsonify({
             'error': str(e),
             'details': error_trace
         }), 500
 
+@app.route('/api/info/batch', methods=['POST'])
+def get_info_batch():
+    """Información de varios videos: {"urls": [...]} → {"results": [{url, info | error}]}"""
+    if not request.is_json:
+        return jsonify({
+            'error': 'Content-Type debe ser application/json'
+        }), 415
+    
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls')
+    if not isinstance(urls, list) or not urls or not all(isinstance(u, str) and u for u in urls):
+        return jsonify({'error': 'Se esperaba una lista de URLs en "urls"'}), 400
+    if len(urls) > INFO_BATCH_MAX:
+        return jsonify({'error': f'Máximo {INFO_BATCH_MAX} URLs por petición'}), 400
+    
+    return jsonify({'results': batch_video_info(urls)})
+
 @app.route('/api/download', methods=['POST'])
 def download():
     try:
@@ -324,48 +531,206 @@ def download():
         if format_type not in ['video', 'mp3']:
             return jsonify({'error': 'Formato inválido. Use "video" o "mp3"'}), 400
         
-        result = download_video(url, format_type)
+        audio = None
+        if format_type == 'mp3':
+            try:
+                audio = AudioTarget.from_request(
+                    data.get('audio_codec'), data.get('audio_quality'), data.get('accept')
+                )
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        
+        disk_full = disk_full_response()
+        if disk_full:
+            return disk_full
+        
+        func = profiler.wrap(download_video, 'download_job') if profiler.wants(request) else download_video
+        job = jobs.submit(url, func, url, format_type, audio,
+                          keep_traceback=DEBUG, report_progress=True)
+        return jsonify({
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': f"/api/jobs/{job.id}",
+            'events_url': f"/api/jobs/{job.id}/events",
+            'result_url': f"/api/jobs/{job.id}/result"
+        }), 202
+    except Exception as e:
+        logger.exception('Error en /api/download')
+        error_trace = traceback.format_exc() if DEBUG else None
         return jsonify({
-            'success': True,
-            'filename': result['filename'],
-            'title': result['title'],
-            'download_url': f"/api/file/{result['filename']}"
-        })
+            'error': str(e),
+            'details': error_trace
+        }), 500
+
+@app.route('/api/playlist', methods=['POST'])
+def download_playlist():
+    """
+    Descarga todas las entradas de una lista o canal en paralelo.
+    Si la lista ya se pidió antes, solo se descargan las entradas que faltan.
+    """
+    try:
+        if not request.is_json:
+            return jsonify({
+                'error': 'Content-Type debe ser application/json'
+            }), 415
+        
+        data = request.get_json(silent=True) or {}
+        url = data.get('url')
+        format_type = data.get('format', 'video')
+        
+        if not url:
+            return jsonify({'error': 'URL no proporcionada'}), 400
+        
+        if format_type not in ['video', 'mp3']:
+            return jsonify({'error': 'Formato inválido. Use "video" o "mp3"'}), 400
+        
+        disk_full = disk_full_response()
+        if disk_full:
+            return disk_full
+        
+        try:
+            info, entries = flat_entries(url, YDL_BASE_OPTS, max_items=PLAYLIST_MAX_ITEMS)
+        except NotAPlaylist as e:
+            return jsonify({'error': str(e)}), 400
+        if not entries:
+            return jsonify({'error': 'La lista no tiene videos'}), 400
+        
+        run, queued = playlists.start(
+            playlist_id(info, format_type), url, format_type, info.get('title'), entries
+        )
+        data = playlist_response(run)
+        data['queued'] = queued
+        return jsonify(data), 202
     except Exception as e:
+        logger.exception('Error en /api/playlist')
         error_trace = traceback.format_exc() if DEBUG else None
         return jsonify({
             'error': str(e),
             'details': error_trace
         }), 500
 
+@app.route('/api/playlist/<run_id>', methods=['GET'])
+def playlist_status(run_id):
+    run = playlists.get(run_id)
+    if not run:
+        return jsonify({'error': 'Lista no encontrada'}), 404
+    return jsonify(playlist_response(run))
+
+@app.route('/api/playlist/<run_id>/zip', methods=['GET'])
+def playlist_zip(run_id):
+    """Zip con los archivos terminados de la lista, generado mientras se envía"""
+    run = playlists.get(run_id)
+    if not run:
+        return jsonify({'error': 'Lista no encontrada'}), 404
+    
+    files = [(resolve(DOWNLOAD_DIR, name), name) for name in playlists.finished_files(run)]
+    files = [(path, name) for path, name in files if path]
+    if not files:
+        return jsonify({'error': 'La lista todavía no tiene archivos terminados'}), 409
+    
+    zip_name = sanitize_filename(run.title or run_id) + '.zip'
+    response = Response(stream_zip(files), mimetype='application/zip')
+    response.headers['Content-Disposition'] = content_disposition(zip_name)
+    return response
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Progreso del trabajo en vivo (Server-Sent Events) hasta que termina"""
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    response = Response(event_stream(job), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Evitar que nginx acumule los eventos en su búfer
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Devuelve los datos del archivo publicado por un trabajo terminado"""
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    if job.status == JOB_FAILED:
+        return jsonify({'error': job.error, 'details': job.details}), 500
+    if job.status != JOB_FINISHED:
+        return jsonify(job.to_dict()), 202
+    return jsonify({
+        'success': True,
+        'filename': job.result['filename'],
+        'title': job.result['title'],
+        'download_url': f"/api/file/{job.result['filename']}"
+    })
+
+@app.route('/api/jobs', methods=['GET'])
+def jobs_stats():
+    stats = jobs.stats()
+    stats['transcoder'] = transcoder.stats()
+    stats['disk'] = scratch.stats()
+    return jsonify(stats)
+
+@app.route('/api/capabilities', methods=['GET'])
+def capabilities():
+    return jsonify(CAPABILITIES)
+
+@app.route('/api/strategies', methods=['GET'])
+def strategies_stats():
+    return jsonify(strategy_scheduler.stats())
+
+@app.route('/api/cache', methods=['GET'])
+def cache_stats():
+    stats = results_cache.stats()
+    stats['in_flight'] = inflight.stats()
+    stats['info'] = info_cache.stats()
+    return jsonify(stats)
+
 @app.route('/api/file/<filename>')
 def download_file(filename):
-    file_path = DOWNLOAD_DIR / filename
-    if file_path.exists():
-        return send_file(file_path, as_attachment=True)
+    """Envía un archivo publicado (Range, ETag/Last-Modified y 304)"""
+    file_path = resolve(DOWNLOAD_DIR, filename)
+    if file_path:
+        return serve_file(file_path, filename, root=DOWNLOAD_DIR)
     return jsonify({'error': 'Archivo no encontrado'}), 404
 
 @app.route('/api/list', methods=['GET'])
 def list_files():
-    files = []
-    for file_path in DOWNLOAD_DIR.iterdir():
-        if file_path.is_file():
-            files.append({
-                'filename': file_path.name,
-                'size': file_path.stat().st_size,
-                'download_url': f"/api/file/{file_path.name}"
-            })
-    return jsonify(files)
+    """
+    Lista los archivos publicados desde el índice, por páginas.
+    Parámetros: limit, cursor (next_cursor de la página anterior),
+    sort (created_at, size, title, filename), order (asc, desc), q (título) y format.
+    """
+    try:
+        items, next_cursor = library.page(
+            limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+            cursor=request.args.get('cursor'),
+            sort=request.args.get('sort', 'created_at'),
+            order=request.args.get('order', 'desc'),
+            q=request.args.get('q'),
+            format=request.args.get('format')
+        )
+    except InvalidQuery as e:
+        return jsonify({'error': str(e)}), 400
+    
+    for item in items:
+        item['download_url'] = f"/api/file/{item['filename']}"
+    return jsonify({'items': items, 'next_cursor': next_cursor})
 
 @app.route('/health', methods=['GET'])
 def health():
     """Endpoint de health check para monitoreo"""
     return jsonify({'status': 'healthy'}), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
 if __name__ == '__main__':
     app.run(debug=DEBUG, host=HOST, port=PORT)
-
-
-
-
-
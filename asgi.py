@@ -0,0 +1,299 @@
+"""
+Modo de servicio ASGI para muchas transferencias largas simultáneas
+Con WSGI cada descarga en curso ocupa un hilo (o un proceso) mientras el
+cliente recibe el archivo. Aquí lo que solo espera se atiende en el bucle de
+eventos:
+- envío de archivos (/api/file/<nombre> en producción, /api/jobs/<id>/result
+  en app.py) con Range, ETag/Last-Modified y 304 igual que send_file; el disco
+  se lee por partes en un pool de hilos
+- estado de los trabajos (/api/jobs/<id>) y progreso en vivo (/api/jobs/<id>/events);
+  con JOBS_BACKEND=store las consultas al almacén también van al pool de hilos
+El resto de rutas se ejecuta en la aplicación Flask (WsgiToAsgi), cada
+petición en su hilo, y yt-dlp/FFmpeg siguen en el pool de trabajos, así que
+el bucle nunca se bloquea.
+
+Uso: uvicorn asgi:app --host 0.0.0.0 --port 5000
+ASGI_APP elige la aplicación (app_production por defecto, o app). Con
+X_ACCEL_REDIRECT o USE_X_SENDFILE los archivos ya los envía el servidor web
+y esas rutas pasan a Flask.
+"""
+import asyncio
+import importlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.utils import send_file
+
+from file_serving import X_ACCEL_REDIRECT, resolve, send_options
+from jobs import JOB_FINISHED, JobManager, async_event_stream
+from log import bind, new_request_id
+from metrics import HTTP_BYTES, HTTP_REQUESTS, HTTP_SECONDS
+
+ASGI_APP = os.getenv('ASGI_APP', 'app_production')
+
+# Tamaño de cada lectura del disco e hilos que las hacen
+ASGI_CHUNK_SIZE = int(os.getenv('ASGI_CHUNK_SIZE', 256 * 1024))
+ASGI_IO_THREADS = int(os.getenv('ASGI_IO_THREADS', 16))
+
+# Peticiones que Flask atiende a la vez (una por hilo); las demás esperan turno
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 64))
+
+# Rutas atendidas en el bucle de eventos: (patrón, endpoint de Flask equivalente)
+ROUTES = [
+    (re.compile(r'/api/jobs/(?P<job_id>[^/]+)'), 'job_status'),
+    (re.compile(r'/api/jobs/(?P<job_id>[^/]+)/events'), 'job_events'),
+    (re.compile(r'/api/jobs/(?P<job_id>[^/]+)/result'), 'job_result'),
+    (re.compile(r'/api/file/(?P<filename>[^/]+)'), 'download_file'),
+]
+
+
+def _environ(scope):
+    """Entorno WSGI mínimo (método y cabeceras) para las respuestas condicionales de werkzeug"""
+    environ = {'REQUEST_METHOD': scope['method']}
+    for name, value in scope['headers']:
+        environ['HTTP_' + name.decode('latin-1').upper().replace('-', '_')] = value.decode('latin-1')
+    return environ
+
+
+def _encode_headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+def _open_file(path, download_name, environ):
+    """
+    Abre el archivo y calcula estado y cabeceras con el send_file de werkzeug
+    (en modo X-Sendfile no lee nada). Devuelve (archivo o None, respuesta, inicio, bytes).
+    """
+    file = open(path, 'rb')
+    try:
+        response = send_file(path, environ, use_x_sendfile=True, **send_options(download_name))
+    except RequestedRangeNotSatisfiable as e:
+        file.close()
+        return None, e.get_response(environ), 0, 0
+    except BaseException:
+        file.close()
+        raise
+    response.headers.pop('X-Sendfile', None)
+    if environ['REQUEST_METHOD'] != 'HEAD':
+        if response.status_code == 206:
+            return file, response, response.content_range.start, response.content_length
+        if response.status_code == 200:
+            return file, response, 0, response.content_length
+    file.close()
+    return None, response, 0, 0
+
+
+def _read(file, offset, size):
+    file.seek(offset)
+    return file.read(size)
+
+
+async def _wait_disconnect(receive, disconnected):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+            return
+
+
+class AsgiApp:
+    def __init__(self, web):
+        self.web = web
+        self.wsgi = WsgiToAsgi(web.app)
+        self.io_pool = ThreadPoolExecutor(max_workers=ASGI_IO_THREADS, thread_name_prefix='asgi-io')
+        # Sin servidor web delante que envíe los archivos
+        self.serve_files = not (X_ACCEL_REDIRECT or web.app.config.get('USE_X_SENDFILE'))
+        self.file_root = getattr(web, 'DOWNLOAD_DIR', None) if 'download_file' in web.app.view_functions else None
+        # Los trabajos en memoria se leen sin bloquear; los del almacén compartido, no
+        self.jobs_in_memory = isinstance(web.jobs, JobManager)
+        self._wsgi_slots = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        if scope['method'] in ('GET', 'HEAD'):
+            for pattern, endpoint in ROUTES:
+                match = pattern.fullmatch(scope['path'])
+                if match and await self._native(endpoint, scope, receive, send, **match.groupdict()):
+                    return
+        await self._call_wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.io_pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _call_wsgi(self, scope, receive, send):
+        if self._wsgi_slots is None:
+            self._wsgi_slots = asyncio.Semaphore(ASGI_WSGI_THREADS)
+        async with self._wsgi_slots:
+            # Un contexto por petición: sin él, asgiref ejecuta todas en un único hilo
+            async with ThreadSensitiveContext():
+                await self.wsgi(scope, receive, send)
+
+    async def _native(self, endpoint, scope, receive, send, **params):
+        """
+        Ejecuta la ruta nativa endpoint con las mismas métricas que instrument_app
+        y el mismo X-Request-ID que bind_requests.
+        Devuelve False si la ruta prefiere que responda Flask (sin haber enviado nada).
+        """
+        started = time.perf_counter()
+        status = None
+        origin = any(name == b'origin' for name, _ in scope['headers'])
+        incoming = next((value for name, value in scope['headers'] if name == b'x-request-id'), b'')
+        rid = new_request_id(incoming.decode('latin-1'))
+
+        async def tracked_send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                headers = [*message['headers'], (b'x-request-id', rid.encode())]
+                if origin:
+                    # Lo mismo que añade flask-cors con su configuración por defecto
+                    headers.append((b'access-control-allow-origin', b'*'))
+                message['headers'] = headers
+            elif message.get('body'):
+                HTTP_BYTES.inc(len(message['body']), endpoint=endpoint)
+            await send(message)
+
+        try:
+            with bind(request_id=rid):
+                handled = await getattr(self, endpoint)(scope, receive, tracked_send, **params)
+        finally:
+            if status is not None:
+                HTTP_REQUESTS.inc(endpoint=endpoint, method=scope['method'], status=status)
+                HTTP_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        return handled is not False
+
+    async def _read_jobs(self, func):
+        """Ejecuta func (lecturas de trabajos) en el pool de hilos si consulta el almacén"""
+        if self.jobs_in_memory:
+            return func()
+        return await asyncio.get_running_loop().run_in_executor(self.io_pool, func)
+
+    async def _json(self, send, data, status=200):
+        body = (json.dumps(data, sort_keys=True, separators=(',', ':')) + '\n').encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': _encode_headers([('Content-Type', 'application/json'), ('Content-Length', str(len(body)))]),
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def job_status(self, scope, receive, send, job_id):
+        def read():
+            job = self.web.jobs.get(job_id)
+            return job.to_dict() if job else None
+
+        data = await self._read_jobs(read)
+        if not data:
+            return await self._json(send, {'error': 'Trabajo no encontrado'}, 404)
+        await self._json(send, data)
+
+    async def job_events(self, scope, receive, send, job_id):
+        job = await self._read_jobs(lambda: self.web.jobs.get(job_id))
+        if not job:
+            return await self._json(send, {'error': 'Trabajo no encontrado'}, 404)
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': _encode_headers([
+                ('Content-Type', 'text/event-stream; charset=utf-8'),
+                ('Cache-Control', 'no-cache'),
+                ('X-Accel-Buffering', 'no'),
+            ]),
+        })
+        disconnected = asyncio.Event()
+        watcher = asyncio.ensure_future(_wait_disconnect(receive, disconnected))
+        try:
+            events = async_event_stream(job, run=self._read_jobs)
+            async for event in events:
+                if disconnected.is_set():
+                    break
+                await send({'type': 'http.response.body', 'body': event.encode(), 'more_body': True})
+            await events.aclose()
+            await send({'type': 'http.response.body'})
+        finally:
+            watcher.cancel()
+
+    async def job_result(self, scope, receive, send, job_id):
+        # Solo el archivo de un trabajo terminado de app.py (el resultado trae file_path);
+        # el resto de casos, y los resultados en JSON de producción, los responde Flask
+        if not self.serve_files:
+            return False
+
+        def read():
+            job = self.web.jobs.get(job_id)
+            return job.result if job and job.status == JOB_FINISHED else None
+
+        result = await self._read_jobs(read)
+        if not (result and 'file_path' in result):
+            return False
+        download_name = self.web.sanitize_filename(result['filename'])
+        return await self._send_file(scope, receive, send, result['file_path'], download_name)
+
+    async def download_file(self, scope, receive, send, filename):
+        if not (self.serve_files and self.file_root):
+            return False
+        path = resolve(self.file_root, filename)
+        if not path:
+            return False
+        return await self._send_file(scope, receive, send, path, filename)
+
+    async def _send_file(self, scope, receive, send, path, download_name):
+        loop = asyncio.get_running_loop()
+        try:
+            file, response, offset, remaining = await loop.run_in_executor(
+                self.io_pool, _open_file, path, download_name, _environ(scope)
+            )
+        except FileNotFoundError:
+            # Expulsado de la caché entre medias: Flask responde 404/410
+            return False
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': _encode_headers(response.headers.items()),
+        })
+        if file is None:
+            await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else response.get_data()})
+            return
+
+        disconnected = asyncio.Event()
+        watcher = asyncio.ensure_future(_wait_disconnect(receive, disconnected))
+        try:
+            while remaining > 0 and not disconnected.is_set():
+                chunk = await loop.run_in_executor(
+                    self.io_pool, _read, file, offset, min(ASGI_CHUNK_SIZE, remaining)
+                )
+                if not chunk:
+                    # El archivo se acortó: se corta la conexión sin completar el cuerpo
+                    return
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+        finally:
+            watcher.cancel()
+            file.close()
+
+
+app = AsgiApp(importlib.import_module(ASGI_APP))
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv('HOST', '0.0.0.0'), port=int(os.getenv('PORT', 5000)))
@@ -0,0 +1,300 @@
+"""
+Pipeline de audio
+yt-dlp descarga el mejor audio disponible sin convertirlo y aquí se decide qué
+hacer con él:
+- copy: el cliente acepta el contenedor original, o ya tiene el códec pedido
+- remux: mismo códec en otro contenedor (webm → opus), sin recodificar
+- encode: recodificar al destino pedido (mp3 VBR, aac u opus)
+Las llamadas a ffmpeg pasan por un pool acotado, con prioridad baja (nice) y
+un número limitado de hilos, para no acaparar la CPU del servidor.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from capabilities import ffmpeg_available, get_capabilities
+from metrics import timed
+
+# Transcodificaciones simultáneas, prioridad (nice) e hilos de cada ffmpeg
+AUDIO_WORKERS = max(1, int(os.getenv('AUDIO_WORKERS', max(1, (os.cpu_count() or 2) // 2))))
+AUDIO_NICE = int(os.getenv('AUDIO_NICE', 10))
+AUDIO_THREADS = max(1, int(os.getenv('AUDIO_THREADS', 1)))
+
+# Salida de ffmpeg a una tubería (streaming) por extensión de destino: muxer y
+# extensión enviada. El AAC va en ADTS, porque m4a necesita volver atrás en el archivo
+PIPE_FORMATS = {
+    'mp3': (['-f', 'mp3'], 'mp3'),
+    'opus': (['-f', 'opus'], 'opus'),
+    'm4a': (['-f', 'adts'], 'aac'),
+}
+
+# Códecs de destino: codificador de ffmpeg, extensión y calidad por defecto
+CODECS = {
+    'mp3': {'encoder': 'libmp3lame', 'ext': 'mp3', 'default': 'v2'},
+    'aac': {'encoder': 'aac', 'ext': 'm4a', 'default': '192k'},
+    'opus': {'encoder': 'libopus', 'ext': 'opus', 'default': '128k'},
+}
+
+# Calidades VBR de LAME (-q:a): v0 ≈ 245 kbps, v2 ≈ 190 kbps, v4 ≈ 165 kbps
+MP3_VBR = {'v0': '0', 'v2': '2', 'v4': '4'}
+BITRATES = ('64k', '96k', '128k', '160k', '192k', '256k', '320k')
+
+# Familia de códec según el acodec que informa yt-dlp
+SOURCE_CODECS = (('mp4a', 'aac'), ('aac', 'aac'), ('opus', 'opus'), ('mp3', 'mp3'))
+
+# Contenedor de salida cuando solo hay que cambiar el contenedor
+REMUX_EXT = {'aac': 'm4a', 'opus': 'opus', 'mp3': 'mp3'}
+
+ORIGINAL = 'original'
+
+
+def codec_family(acodec):
+    acodec = (acodec or '').lower()
+    for prefix, family in SOURCE_CODECS:
+        if acodec.startswith(prefix):
+            return family
+    return None
+
+
+def available_codecs():
+    """Códecs de destino que el ffmpeg instalado puede codificar"""
+    targets = get_capabilities()['audio_targets']
+    return [codec for codec in CODECS if targets.get(codec)]
+
+
+class AudioTarget:
+    """
+    Destino de audio pedido por el cliente: códec, calidad y contenedores que
+    acepta tal cual (accept). codec='original' nunca convierte.
+    """
+
+    def __init__(self, codec, quality=None, accept=()):
+        self.codec = codec
+        self.quality = quality
+        self.accept = tuple(sorted({ext.lower().lstrip('.') for ext in accept}))
+
+    @classmethod
+    def from_request(cls, codec=None, quality=None, accept=None):
+        """Valida los parámetros de la petición; lanza ValueError si no son válidos"""
+        if accept is None:
+            accept = ()
+        elif isinstance(accept, str):
+            accept = [ext for ext in accept.split(',') if ext.strip()]
+        elif not isinstance(accept, (list, tuple)) or not all(isinstance(ext, str) for ext in accept):
+            raise ValueError('accept debe ser una lista de extensiones')
+        accept = [ext.strip() for ext in accept]
+
+        if not codec:
+            # Sin ffmpeg no hay conversión posible: se entrega el audio original
+            codec = 'mp3' if 'mp3' in available_codecs() else ORIGINAL
+        codec = codec.lower()
+        if codec == ORIGINAL:
+            return cls(ORIGINAL, accept=accept)
+        if codec not in CODECS:
+            raise ValueError(f"Códec de audio inválido. Use uno de: {', '.join([*CODECS, ORIGINAL])}")
+        if codec not in available_codecs():
+            raise ValueError(f"El códec {codec} no está disponible en este servidor")
+
+        quality = (quality or CODECS[codec]['default']).lower()
+        valid = (*MP3_VBR, *BITRATES) if codec == 'mp3' else BITRATES
+        if quality not in valid:
+            raise ValueError(f"Calidad inválida para {codec}. Use una de: {', '.join(valid)}")
+        return cls(codec, quality, accept)
+
+    @property
+    def key(self):
+        """Identificador para la clave de caché"""
+        if self.codec == ORIGINAL:
+            return ORIGINAL
+        key = f'{self.codec}-{self.quality}'
+        if self.accept:
+            key += '+' + ','.join(self.accept)
+        return key
+
+    def format_spec(self):
+        """Formato de yt-dlp preferido para evitar recodificar"""
+        if self.codec == 'aac' or 'm4a' in self.accept:
+            return 'bestaudio[ext=m4a]/bestaudio'
+        if self.codec == 'opus' or 'opus' in self.accept or 'webm' in self.accept:
+            return 'bestaudio[acodec=opus]/bestaudio'
+        return 'bestaudio'
+
+    def plan(self, source_ext, acodec):
+        """('copy' | 'remux' | 'encode', extensión final)"""
+        source_ext = source_ext.lower().lstrip('.')
+        if self.codec == ORIGINAL or source_ext in self.accept:
+            return 'copy', source_ext
+        family = codec_family(acodec)
+        if family == self.codec:
+            target_ext = REMUX_EXT[family]
+            if source_ext == target_ext:
+                return 'copy', source_ext
+            if ffmpeg_available():
+                return 'remux', target_ext
+        if not ffmpeg_available():
+            return 'copy', source_ext
+        return 'encode', CODECS[self.codec]['ext']
+
+    def encoder_args(self):
+        encoder = CODECS[self.codec]['encoder']
+        if self.codec == 'mp3' and self.quality in MP3_VBR:
+            return ['-c:a', encoder, '-q:a', MP3_VBR[self.quality]]
+        return ['-c:a', encoder, '-b:a', self.quality]
+
+
+class TranscodePool:
+    """
+    Limita las ejecuciones simultáneas de ffmpeg (cada una es un proceso propio;
+    los hilos que esperan turno no consumen CPU)
+    """
+
+    def __init__(self, workers=AUDIO_WORKERS, nice=AUDIO_NICE, threads=AUDIO_THREADS):
+        self.workers = workers
+        self.nice = nice
+        self.threads = threads
+        self._slots = threading.BoundedSemaphore(workers)
+        self._lock = threading.Lock()
+        self._running = 0
+        self._waiting = 0
+        self._nice_path = shutil.which('nice')
+
+    def command(self, args, progress=False):
+        """Línea de ffmpeg con args y la prioridad (nice) del pool"""
+        # -nostdin solo desactiva el teclado: pipe:0 sigue sirviendo de entrada
+        command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-y']
+        if progress:
+            command += ['-progress', 'pipe:1', '-nostats']
+        command += args
+        if self.nice and self._nice_path:
+            command = [self._nice_path, '-n', str(self.nice), *command]
+        return command
+
+    def try_acquire(self):
+        """
+        Toma un turno sin esperar, para un ffmpeg que se ejecuta fuera de run()
+        (streaming); devuelve False si están todos ocupados. Se libera con release().
+        """
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self._running += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self._running -= 1
+        self._slots.release()
+
+    def run(self, args, on_progress=None, duration=None):
+        """
+        Ejecuta ffmpeg con args. on_progress('transcoding', ...) recibe el avance
+        que ffmpeg escribe con -progress (segundos procesados, velocidad)
+        """
+        command = self.command(args, progress=bool(on_progress))
+
+        with self._lock:
+            self._waiting += 1
+        with self._slots:
+            with self._lock:
+                self._waiting -= 1
+                self._running += 1
+            try:
+                with timed('transcode'), tempfile.TemporaryFile(mode='w+') as stderr:
+                    process = subprocess.Popen(
+                        command,
+                        stdout=subprocess.PIPE if on_progress else subprocess.DEVNULL,
+                        stderr=stderr,
+                        text=True
+                    )
+                    if on_progress:
+                        _read_progress(process.stdout, on_progress, duration)
+                    returncode = process.wait()
+                    stderr.seek(0)
+                    message = stderr.read().strip().splitlines()
+            finally:
+                with self._lock:
+                    self._running -= 1
+        if returncode != 0:
+            raise Exception(f"Error al convertir el audio: {message[-1] if message else returncode}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'nice': self.nice,
+                'threads': self.threads,
+                'running': self._running,
+                'waiting': self._waiting,
+            }
+
+
+def _number(value, scale=1):
+    try:
+        return float(value) / scale
+    except (TypeError, ValueError):
+        return None
+
+
+def _read_progress(stream, on_progress, duration):
+    """Lee los bloques clave=valor de 'ffmpeg -progress' hasta que el proceso termina"""
+    block = {}
+    for line in stream:
+        key, _, value = line.strip().partition('=')
+        if key != 'progress':
+            block[key] = value
+            continue
+        on_progress(
+            'transcoding',
+            out_time=_number(block.get('out_time_us'), scale=1_000_000),
+            duration=duration,
+            speed=_number(block.get('speed', '').rstrip('x')),
+        )
+        block = {}
+
+
+transcoder = TranscodePool()
+
+
+def stream_args(target, source_ext, acodec):
+    """
+    Argumentos de ffmpeg (pipe:0 → pipe:1) para aplicar target a un flujo de
+    audio, y extensión de lo que se envía. Sin conversión: (None, source_ext).
+    """
+    action, ext = target.plan(source_ext, acodec)
+    if action == 'copy':
+        return None, ext
+    if action == 'remux':
+        codec_args = ['-c:a', 'copy']
+    else:
+        codec_args = [*target.encoder_args(), '-threads', str(transcoder.threads)]
+    muxer, ext = PIPE_FORMATS[ext]
+    return ['-i', 'pipe:0', '-vn', *codec_args, *muxer, 'pipe:1'], ext
+
+
+def process_audio(path, target, acodec=None, progress=None, duration=None):
+    """
+    Aplica el destino al audio descargado en path.
+    progress(phase, **datos) recibe el avance de ffmpeg; duration (segundos) permite calcularlo.
+    Devuelve (ruta final, extensión con punto, acción realizada).
+    """
+    stem, source_ext = os.path.splitext(path)
+    action, ext = target.plan(source_ext, acodec)
+    if action == 'copy':
+        return path, f'.{ext}', action
+
+    output = f'{stem}.{ext}'
+    if output == path:
+        output = f'{stem}.out.{ext}'
+    if action == 'remux':
+        codec_args = ['-c:a', 'copy']
+    else:
+        codec_args = [*target.encoder_args(), '-threads', str(transcoder.threads)]
+    transcoder.run(
+        ['-i', path, '-vn', '-map_metadata', '0', *codec_args, output],
+        on_progress=progress,
+        duration=duration
+    )
+    os.remove(path)
+    return output, f'.{ext}', action
@@ -0,0 +1,779 @@
+"""
+Benchmark reproducible de las rutas de descarga y envío de archivos, sin internet
+
+Levanta en el mismo proceso:
+- un origen HTTP local con medios sintéticos: video progresivo, video DASH en
+  fragmentos y audio (audio AAC real, generado con FFmpeg, si está instalado)
+- un extractor de yt-dlp para ese origen (URLs /watch/<tipo>-<bytes>-<n>)
+- la aplicación (app_production por defecto) en un servidor WSGI con hilos
+y ejecuta escenarios de carga con varios usuarios simultáneos: información del
+video, descargas en frío y desde la caché, mp3, DASH, archivos grandes y envío
+de archivos ya publicados. Por escenario informa peticiones por segundo,
+latencia p50/p95/p99, tiempo hasta el primer byte, memoria (RSS), CPU y E/S de
+disco, y guarda el resultado en JSON.
+
+Uso:
+    python benchmark.py
+    python benchmark.py --users 8 --scenarios video-cold,video-hot
+    python benchmark.py --compare bench-anterior.json   # sale con 1 si hay regresiones
+
+El origen, los clientes y la aplicación comparten proceso: RSS, CPU y E/S
+incluyen los tres, así que sirven para comparar ejecuciones entre sí, no como
+valores absolutos del servidor. Las variables de entorno de la aplicación
+(JOBS_MAX_WORKERS, YDL_CONCURRENT_FRAGMENTS...) se respetan y se guardan con
+el resultado.
+"""
+import argparse
+import contextlib
+import hashlib
+import http.client
+import importlib
+import itertools
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, urlparse
+
+import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor
+from yt_dlp.utils import parse_bytes
+
+# Bloque pseudoaleatorio (determinista) con el que se generan los medios sintéticos
+BLOCK = b''.join(hashlib.sha256(i.to_bytes(4, 'big')).digest() for i in range(2048))
+CHUNK_SIZE = 64 * 1024
+
+# Duración declarada de cada video y número de fragmentos DASH
+DURATION = 60
+DASH_SEGMENTS = 20
+
+POLL_INTERVAL = 0.05
+JOB_TIMEOUT = 600
+SAMPLE_INTERVAL = 0.05
+
+# Variables de entorno que afectan al rendimiento y se guardan con el resultado
+TUNING_ENV = (
+    'JOBS_MAX_WORKERS', 'JOBS_PER_HOST_LIMIT', 'YDL_CONCURRENT_FRAGMENTS',
+    'YDL_HTTP_CHUNK_SIZE', 'AUDIO_WORKERS', 'AUDIO_THREADS', 'INFO_BATCH_WORKERS',
+)
+
+# Métricas comparadas con --compare: (ruta en el resultado, True si más alto es mejor)
+COMPARED = (
+    ('throughput_rps', True),
+    ('bytes_per_s', True),
+    ('latency.p50', False),
+    ('latency.p95', False),
+    ('latency.p99', False),
+    ('ttfb.p50', False),
+    ('ttfb.p95', False),
+    ('rss_peak', False),
+)
+
+
+# --- Origen local -----------------------------------------------------------
+
+def parse_video_id(video_id):
+    """'<tipo>-<bytes>-<n>' → (tipo, bytes); tipo es prog (progresivo) o dash (fragmentos)"""
+    kind, size, _ = video_id.split('-')
+    return kind, int(size)
+
+
+def synthetic(offset, length):
+    """length bytes del medio sintético a partir de offset"""
+    start = offset % len(BLOCK)
+    data = BLOCK[start:start + length]
+    while len(data) < length:
+        data += BLOCK[:length - len(data)]
+    return data
+
+
+def segment_size(size, index):
+    base = size // DASH_SEGMENTS
+    return base + (size % DASH_SEGMENTS if index == DASH_SEGMENTS - 1 else 0)
+
+
+class _OriginHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve()
+
+    def _serve(self, send_body=True):
+        origin = self.server.origin
+        resource = origin.resolve(urlparse(self.path).path)
+        if not resource:
+            self.send_error(404)
+            return
+        size, content_type, source = resource
+
+        start, end = 0, size - 1
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), end)
+            if start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+        self.send_response(206 if match else 200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if match:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        if not send_body:
+            return
+
+        offset = start
+        try:
+            while offset <= end:
+                chunk = source(offset, min(CHUNK_SIZE, end - offset + 1))
+                self.wfile.write(chunk)
+                offset += len(chunk)
+                if origin.rate:
+                    time.sleep(len(chunk) / origin.rate)
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente cortó la descarga (p. ej. por tamaño máximo)
+            pass
+
+
+class Origin:
+    """
+    Servidor HTTP local con los medios del benchmark (admite Range).
+    rate: bytes/s por conexión (0 sin límite). audio_path: audio real que se
+    sirve como pista de audio; si no hay, también es sintético.
+    """
+
+    def __init__(self, rate=0, audio_path=None):
+        self.rate = rate
+        self.audio = None
+        if audio_path:
+            with open(audio_path, 'rb') as f:
+                self.audio = f.read()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _OriginHandler)
+        self.server.daemon_threads = True
+        self.server.origin = self
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, name='bench-origin', daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def resolve(self, path):
+        """(tamaño, content-type, fuente(offset, length)) del recurso, o None"""
+        match = re.fullmatch(r'/media/((?:prog|dash)-\d+-\d+)(?:\.(mp4|m4a)|/seg-(\d+)\.m4s)', path)
+        if not match:
+            return None
+        _, size = parse_video_id(match.group(1))
+        ext, segment = match.group(2), match.group(3)
+        if ext == 'm4a':
+            if self.audio:
+                return len(self.audio), 'audio/mp4', lambda offset, length: self.audio[offset:offset + length]
+            return max(CHUNK_SIZE, size // 10), 'audio/mp4', synthetic
+        if ext == 'mp4':
+            return size, 'video/mp4', synthetic
+        if int(segment) >= DASH_SEGMENTS:
+            return None
+        return segment_size(size, int(segment)), 'video/iso.segment', synthetic
+
+
+def make_audio(workdir):
+    """Audio AAC real de DURATION segundos, para que la conversión a MP3 trabaje de verdad"""
+    if not shutil.which('ffmpeg'):
+        return None
+    path = os.path.join(workdir, 'audio.m4a')
+    subprocess.run(
+        ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin',
+         '-f', 'lavfi', '-i', f'sine=frequency=440:duration={DURATION}',
+         '-c:a', 'aac', '-b:a', '128k', path],
+        check=True
+    )
+    return path
+
+
+class BenchIE(InfoExtractor):
+    """Extractor de yt-dlp para el origen local"""
+    IE_NAME = 'bench'
+    _VALID_URL = r'https?://127\.0\.0\.1:\d+/watch/(?P<id>(?:prog|dash)-\d+-\d+)'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        base = url[:url.index('/watch/')]
+        kind, size = parse_video_id(video_id)
+        media = f'{base}/media/{video_id}'
+
+        # Sin filesize: el tamaño del audio se estima por bitrate × duración
+        formats = [{
+            'format_id': 'audio',
+            'url': f'{media}.m4a',
+            'ext': 'm4a',
+            'protocol': 'http',
+            'vcodec': 'none',
+            'acodec': 'mp4a.40.2',
+            'abr': 128,
+        }]
+        if kind == 'prog':
+            formats.append({
+                'format_id': 'progressive',
+                'url': f'{media}.mp4',
+                'ext': 'mp4',
+                'protocol': 'http',
+                'vcodec': 'avc1.4d401f',
+                'acodec': 'mp4a.40.2',
+                'width': 1280,
+                'height': 720,
+                'filesize': size,
+            })
+        else:
+            formats.append({
+                'format_id': 'dash',
+                'url': f'{media}/manifest.mpd',
+                'manifest_url': f'{media}/manifest.mpd',
+                'ext': 'mp4',
+                'protocol': 'http_dash_segments',
+                'vcodec': 'avc1.640028',
+                'acodec': 'mp4a.40.2',
+                'width': 1920,
+                'height': 1080,
+                'filesize_approx': size,
+                'fragment_base_url': f'{media}/',
+                'fragments': [
+                    {'path': f'seg-{i}.m4s', 'duration': DURATION / DASH_SEGMENTS}
+                    for i in range(DASH_SEGMENTS)
+                ],
+            })
+        return {
+            'id': video_id,
+            'title': f'Bench {video_id}',
+            'duration': DURATION,
+            'formats': formats,
+        }
+
+
+def install_extractor():
+    """Registra BenchIE antes que los de yt-dlp (el genérico aceptaría cualquier URL)"""
+    original = yt_dlp.YoutubeDL.add_default_info_extractors
+    if getattr(original, 'bench', False):
+        return
+
+    def add_default_info_extractors(self):
+        self.add_info_extractor(BenchIE())
+        original(self)
+
+    add_default_info_extractors.bench = True
+    yt_dlp.YoutubeDL.add_default_info_extractors = add_default_info_extractors
+
+
+# --- Cliente -----------------------------------------------------------------
+
+class Client:
+    """Cliente HTTP que mide el tiempo hasta el primer byte de cada respuesta"""
+
+    def __init__(self, base_url):
+        parsed = urlparse(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port
+
+    def request(self, method, path, payload=None, keep_body=True):
+        """
+        Devuelve (status, cuerpo, ttfb, bytes). El cuerpo se decodifica si es
+        JSON; con keep_body=False solo se cuentan los bytes.
+        """
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=JOB_TIMEOUT)
+        try:
+            headers = {}
+            body = None
+            if payload is not None:
+                body = json.dumps(payload)
+                headers['Content-Type'] = 'application/json'
+            started = time.perf_counter()
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            ttfb = time.perf_counter() - started
+            chunks = []
+            received = 0
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if keep_body:
+                    chunks.append(chunk)
+            data = None
+            if keep_body and 'json' in (response.getheader('Content-Type') or ''):
+                data = json.loads(b''.join(chunks))
+            return response.status, data, ttfb, received
+        finally:
+            conn.close()
+
+
+def _failure(started, error):
+    return {'ok': False, 'latency': time.perf_counter() - started, 'error': str(error)[:200]}
+
+
+class Target:
+    """Operaciones del benchmark sobre la aplicación (app_production o app)"""
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self.has_info = name == 'app_production'
+
+    def info(self, url):
+        started = time.perf_counter()
+        status, data, ttfb, received = self.client.request('POST', '/api/info', {'url': url})
+        if status != 200:
+            return _failure(started, (data or {}).get('error', status))
+        return {'ok': True, 'latency': time.perf_counter() - started, 'ttfb': ttfb, 'bytes': received}
+
+    def download(self, url, format_type='video'):
+        """Encola la descarga, espera a que termine y baja el archivo"""
+        started = time.perf_counter()
+        status, job, _, _ = self.client.request('POST', '/api/download', {'url': url, 'format': format_type})
+        if status != 202:
+            return _failure(started, (job or {}).get('error', status))
+
+        deadline = started + JOB_TIMEOUT
+        while True:
+            _, state, _, _ = self.client.request('GET', job['status_url'])
+            if state['status'] in ('finished', 'failed'):
+                break
+            if time.perf_counter() > deadline:
+                return _failure(started, 'timeout')
+            time.sleep(POLL_INTERVAL)
+        if state['status'] == 'failed':
+            return _failure(started, state.get('error'))
+
+        sample = self.serve(job)
+        if not sample['ok']:
+            return _failure(started, sample['error'])
+        sample.update(
+            latency=time.perf_counter() - started,
+            queue_wait=state['started_at'] - state['created_at'],
+            run_time=state['finished_at'] - state['started_at'],
+            job=job,
+        )
+        return sample
+
+    def serve(self, job):
+        """Descarga el archivo de un trabajo terminado (en producción, vía /api/file)"""
+        started = time.perf_counter()
+        path = job['result_url']
+        if self.name == 'app_production':
+            status, result, _, _ = self.client.request('GET', path)
+            if status != 200:
+                return _failure(started, (result or {}).get('error', status))
+            path = f"/api/file/{quote(result['filename'])}"
+        status, data, ttfb, received = self.client.request('GET', path, keep_body=False)
+        if status != 200:
+            return _failure(started, status)
+        return {'ok': True, 'latency': time.perf_counter() - started, 'ttfb': ttfb, 'bytes': received}
+
+
+# --- Escenarios ----------------------------------------------------------------
+
+class Scenario:
+    """
+    action: info, download o serve. hot=True repite la misma URL después de una
+    petición de calentamiento (caché caliente); si no, cada petición usa un video nuevo.
+    """
+
+    def __init__(self, name, action, kind='prog', format_type='video', hot=False, large=False):
+        self.name = name
+        self.action = action
+        self.kind = kind
+        self.format_type = format_type
+        self.hot = hot
+        self.large = large
+
+    def tasks(self, bench):
+        size = bench.large_size if self.large else bench.size
+        count = bench.users if self.large else bench.users * bench.requests
+        target = bench.target
+
+        if self.action == 'info':
+            if self.hot:
+                url = bench.video_url(self.kind, size)
+                target.info(url)
+                urls = [url] * count
+            else:
+                urls = [bench.video_url(self.kind, size) for _ in range(count)]
+            return [lambda url=url: target.info(url) for url in urls]
+
+        if self.action == 'serve':
+            warmup = target.download(bench.video_url(self.kind, size), self.format_type)
+            if not warmup['ok']:
+                raise RuntimeError(f"Calentamiento fallido: {warmup['error']}")
+            return [lambda: target.serve(warmup['job'])] * count
+
+        if self.hot:
+            url = bench.video_url(self.kind, size)
+            warmup = target.download(url, self.format_type)
+            if not warmup['ok']:
+                raise RuntimeError(f"Calentamiento fallido: {warmup['error']}")
+            urls = [url] * count
+        else:
+            urls = [bench.video_url(self.kind, size) for _ in range(count)]
+        return [lambda url=url: target.download(url, self.format_type) for url in urls]
+
+
+SCENARIOS = [
+    Scenario('info-cold', 'info'),
+    Scenario('info-hot', 'info', hot=True),
+    Scenario('video-cold', 'download'),
+    Scenario('video-hot', 'download', hot=True),
+    Scenario('dash-cold', 'download', kind='dash'),
+    Scenario('mp3-cold', 'download', format_type='mp3'),
+    Scenario('large-cold', 'download', large=True),
+    Scenario('serve-file', 'serve'),
+]
+
+
+# --- Medición --------------------------------------------------------------------
+
+def _read_proc(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def current_rss():
+    """RSS del proceso en bytes (Linux), o None"""
+    status = _read_proc('/proc/self/status')
+    match = re.search(r'^VmRSS:\s+(\d+) kB', status or '', re.M)
+    return int(match.group(1)) * 1024 if match else None
+
+
+def disk_io():
+    """Bytes leídos y escritos en disco por el proceso (Linux), o None"""
+    io = _read_proc('/proc/self/io')
+    if not io:
+        return None
+    fields = dict(line.split(': ') for line in io.strip().splitlines())
+    return int(fields['read_bytes']), int(fields['write_bytes'])
+
+
+class ResourceMonitor:
+    """RSS (muestreado), CPU y E/S de disco del proceso mientras dura el bloque with"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name='bench-monitor', daemon=True)
+
+    def _sample(self):
+        while True:
+            rss = current_rss()
+            if rss is not None:
+                self.samples.append(rss)
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._io = disk_io()
+        self._cpu = os.times()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        cpu = os.times()
+        io = disk_io()
+        self.result = {
+            'rss_peak': max(self.samples) if self.samples else None,
+            'rss_mean': int(sum(self.samples) / len(self.samples)) if self.samples else None,
+            'cpu_user': round(cpu.user - self._cpu.user, 3),
+            'cpu_system': round(cpu.system - self._cpu.system, 3),
+            # FFmpeg y otros procesos hijos
+            'cpu_children': round(cpu.children_user + cpu.children_system
+                                  - self._cpu.children_user - self._cpu.children_system, 3),
+            'io_read_bytes': io[0] - self._io[0] if io and self._io else None,
+            'io_write_bytes': io[1] - self._io[1] if io and self._io else None,
+        }
+
+
+def percentile(values, p):
+    """Percentil p (0-100) con interpolación lineal; values debe estar ordenado"""
+    if len(values) == 1:
+        return values[0]
+    rank = (len(values) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def distribution(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        'mean': round(sum(values) / len(values), 6),
+        'p50': round(percentile(values, 50), 6),
+        'p95': round(percentile(values, 95), 6),
+        'p99': round(percentile(values, 99), 6),
+        'max': round(values[-1], 6),
+    }
+
+
+def summarize(samples, wall_time, resources):
+    ok = [s for s in samples if s['ok']]
+    received = sum(s.get('bytes', 0) for s in ok)
+    result = {
+        'requests': len(samples),
+        'errors': len(samples) - len(ok),
+        'wall_time': round(wall_time, 4),
+        'throughput_rps': round(len(ok) / wall_time, 4) if wall_time else None,
+        'bytes_per_s': round(received / wall_time) if wall_time else None,
+        'latency': distribution([s['latency'] for s in ok]),
+        'ttfb': distribution([s['ttfb'] for s in ok if 'ttfb' in s]),
+        'queue_wait': distribution([s['queue_wait'] for s in ok if 'queue_wait' in s]),
+        'run_time': distribution([s['run_time'] for s in ok if 'run_time' in s]),
+    }
+    errors = sorted({s['error'] for s in samples if not s['ok']})
+    if errors:
+        result['error_samples'] = errors[:5]
+    result.update(resources)
+    return result
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """Silencia la salida de yt-dlp y de la aplicación mientras se mide"""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            yield
+
+
+class Bench:
+    """Origen, aplicación y parámetros de una ejecución del benchmark"""
+
+    def __init__(self, target, origin, users, requests, size, large_size):
+        self.target = target
+        self.origin = origin
+        self.users = users
+        self.requests = requests
+        self.size = size
+        self.large_size = large_size
+        self._ids = itertools.count()
+
+    def video_url(self, kind, size):
+        """URL de un video que aún no se ha pedido"""
+        return f'{self.origin.url}/watch/{kind}-{size}-{next(self._ids)}'
+
+    def run(self, scenario):
+        if scenario.action == 'info' and not self.target.has_info:
+            return {'skipped': f'{self.target.name} no tiene /api/info'}
+        try:
+            tasks = scenario.tasks(self)
+        except RuntimeError as e:
+            return {'skipped': str(e)}
+        with ResourceMonitor() as monitor:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.users, thread_name_prefix='bench-user') as pool:
+                samples = list(pool.map(lambda task: task(), tasks))
+            wall_time = time.perf_counter() - started
+        return summarize(samples, wall_time, monitor.result)
+
+
+# --- Comparación -------------------------------------------------------------------
+
+def _lookup(data, path):
+    for part in path.split('.'):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+def compare(baseline, current, threshold):
+    """
+    Compara las métricas de COMPARED por escenario.
+    Devuelve [(escenario, métrica, antes, ahora, cambio relativo, es regresión)].
+    """
+    rows = []
+    for name, result in current['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base or 'skipped' in base or 'skipped' in result:
+            continue
+        for metric, higher_is_better in COMPARED:
+            old, new = _lookup(base, metric), _lookup(result, metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            rows.append((name, metric, old, new, change, worse > threshold))
+    return rows
+
+
+def print_comparison(rows, threshold):
+    print(f"\nComparación (regresión si empeora más de {threshold:.0%}):")
+    for name, metric, old, new, change, regression in rows:
+        flag = '  REGRESIÓN' if regression else ''
+        print(f'  {name:<12} {metric:<16} {old:>14.6g} → {new:<14.6g} {change:+8.1%}{flag}')
+
+
+# --- Ejecución -----------------------------------------------------------------------
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _format_line(name, result):
+    if 'skipped' in result:
+        return f"  {name:<12} omitido: {result['skipped']}"
+    latency = result['latency'] or {}
+    ttfb = result['ttfb'] or {}
+    rss = result['rss_peak']
+    return (
+        f"  {name:<12} {result['throughput_rps'] or 0:8.2f} req/s"
+        f"  p50 {latency.get('p50', 0) * 1000:8.1f} ms  p95 {latency.get('p95', 0) * 1000:8.1f} ms"
+        f"  p99 {latency.get('p99', 0) * 1000:8.1f} ms  ttfb p50 {ttfb.get('p50', 0) * 1000:7.1f} ms"
+        f"  {(result['bytes_per_s'] or 0) / 1024 / 1024:7.1f} MiB/s"
+        f"  rss {rss / 1024 / 1024 if rss else 0:6.0f} MiB"
+        f"  errores {result['errors']}"
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark offline de descargas y envío de archivos')
+    parser.add_argument('--app', choices=('app_production', 'app'), default='app_production',
+                        help='Aplicación a medir')
+    parser.add_argument('--users', type=int, default=4, help='Usuarios simultáneos')
+    parser.add_argument('--requests', type=int, default=3, help='Peticiones por usuario y escenario')
+    parser.add_argument('--size', type=parse_bytes, default=parse_bytes('8M'),
+                        help='Tamaño de los videos (ej. 8M)')
+    parser.add_argument('--large-size', type=parse_bytes, default=parse_bytes('256M'),
+                        help='Tamaño de los videos del escenario large-cold')
+    parser.add_argument('--origin-rate', type=parse_bytes, default=0,
+                        help='Velocidad máxima del origen por conexión (ej. 5M; 0 sin límite)')
+    parser.add_argument('--scenarios', default=','.join(s.name for s in SCENARIOS),
+                        help='Escenarios separados por comas')
+    parser.add_argument('--output', help='Archivo JSON del resultado (por defecto bench-<fecha>.json)')
+    parser.add_argument('--compare', help='Resultado JSON anterior con el que comparar')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Empeoramiento relativo que cuenta como regresión')
+    parser.add_argument('--verbose', action='store_true', help='Mostrar la salida de yt-dlp y de la aplicación')
+    parser.add_argument('--keep', action='store_true', help='Conservar el directorio de trabajo')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = {s.name: s for s in SCENARIOS}
+    selected = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in selected if name not in scenarios]
+    if unknown:
+        print(f"Escenarios desconocidos: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    workdir = tempfile.mkdtemp(prefix='media-tools-bench-')
+    # La aplicación lee su configuración al importarse: todo va al directorio de trabajo
+    os.environ.setdefault('DOWNLOAD_DIR', os.path.join(workdir, 'downloads'))
+    os.environ.setdefault('CACHE_DIR', os.path.join(workdir, 'cache'))
+    os.environ.setdefault('DISK_MIN_FREE', '0')
+    os.environ.setdefault('DISK_REJECT_FREE', '0')
+    if not args.verbose:
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+    origin = server = None
+    try:
+        audio_path = make_audio(workdir)
+        origin = Origin(rate=args.origin_rate, audio_path=audio_path)
+        install_extractor()
+        with quiet(not args.verbose):
+            module = importlib.import_module(args.app)
+
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', 0, module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+
+        target = Target(args.app, Client(f'http://127.0.0.1:{server.server_port}'))
+        bench = Bench(target, origin, args.users, args.requests, args.size, args.large_size)
+
+        results = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'commit': _git_commit(),
+                'app': args.app,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'yt_dlp': yt_dlp.version.__version__,
+                'ffmpeg': audio_path is not None,
+                'users': args.users,
+                'requests_per_user': args.requests,
+                'size': args.size,
+                'large_size': args.large_size,
+                'origin_rate': args.origin_rate,
+                'env': {name: os.environ[name] for name in TUNING_ENV if name in os.environ},
+            },
+            'scenarios': {},
+        }
+
+        print(f"Benchmark de {args.app}: {args.users} usuarios, {args.requests} peticiones por usuario")
+        for name in selected:
+            with quiet(not args.verbose):
+                result = bench.run(scenarios[name])
+            results['scenarios'][name] = result
+            print(_format_line(name, result))
+    finally:
+        if server:
+            server.shutdown()
+        if origin:
+            origin.close()
+        if args.keep:
+            print(f'Directorio de trabajo: {workdir}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f'Resultado guardado en {output}')
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows = compare(baseline, results, args.threshold)
+        print_comparison(rows, args.threshold)
+        if any(row[-1] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
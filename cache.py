@@ -0,0 +1,174 @@
+"""
+Caché persistente de resultados de descarga
+Cada entrada se identifica por (video, formato, calidad) y apunta a un archivo en disco.
+El índice se guarda en JSON junto a los archivos; la caché se limita por tamaño
+total (expulsando lo menos usado recientemente) y por antigüedad (TTL).
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+INDEX_NAME = '.cache_index.json'
+
+# Intervalo mínimo entre escrituras del índice cuando solo cambian los accesos
+INDEX_SAVE_INTERVAL = 30
+
+
+def cache_key(video_key, format_type, quality='best'):
+    """Clave de caché: video canónico + formato pedido + calidad"""
+    return f'{video_key}|{format_type}|{quality}'
+
+
+def key_digest(key):
+    """Hash corto de la clave, útil como nombre de archivo"""
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    Índice de archivos descargados con expulsión LRU por tamaño y TTL.
+    max_bytes=0 o ttl=0 desactivan el límite correspondiente.
+    on_remove(entry) se llama cada vez que un archivo sale de la caché.
+    """
+
+    def __init__(self, root, max_bytes=0, ttl=0, on_remove=None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / INDEX_NAME
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_remove = on_remove
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._index_mtime = None
+        self._last_save = 0
+        self._load()
+
+    def get(self, key, count=True):
+        """
+        Devuelve la entrada si el archivo sigue en disco y no ha expirado.
+        count=False no suma a las estadísticas (útil para volver a comprobar una clave).
+        """
+        with self._lock:
+            self._reload_if_changed()
+            entry = self._entries.get(key)
+            if entry and not os.path.exists(entry['path']):
+                self._remove(key, evicted=False)
+                entry = None
+            if entry and self._expired(entry):
+                self._remove(key)
+                entry = None
+            if not entry:
+                if count:
+                    self.misses += 1
+                return None
+            if count:
+                self.hits += 1
+            entry['last_access'] = time.time()
+            if time.time() - self._last_save > INDEX_SAVE_INTERVAL:
+                self._save()
+            return dict(entry)
+
+    def put(self, key, path, **meta):
+        """Registra el archivo de un resultado y aplica los límites de la caché"""
+        now = time.time()
+        entry = dict(meta)
+        entry.update({
+            'path': str(path),
+            'size': os.path.getsize(path),
+            'created_at': now,
+            'last_access': now,
+        })
+        with self._lock:
+            self._reload_if_changed()
+            old = self._entries.get(key)
+            if old and old['path'] != entry['path']:
+                self._remove(key, evicted=False)
+            self._entries[key] = entry
+            self._evict(keep=key)
+            self._save()
+        return dict(entry)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'size': sum(e['size'] for e in self._entries.values()),
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+                'evictions': self.evictions,
+            }
+
+    def _expired(self, entry):
+        return bool(self.ttl) and time.time() - entry['created_at'] > self.ttl
+
+    def _evict(self, keep=None):
+        for key, entry in list(self._entries.items()):
+            if key != keep and self._expired(entry):
+                self._remove(key)
+        if not self.max_bytes:
+            return
+        total = sum(e['size'] for e in self._entries.values())
+        lru = sorted(self._entries.items(), key=lambda item: item[1]['last_access'])
+        for key, entry in lru:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= entry['size']
+            self._remove(key)
+
+    def _remove(self, key, evicted=True):
+        entry = self._entries.pop(key, None)
+        if not entry:
+            return
+        if evicted:
+            self.evictions += 1
+        try:
+            os.remove(entry['path'])
+        except OSError:
+            pass
+        if self.on_remove:
+            try:
+                self.on_remove(entry)
+            except Exception:
+                pass
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+            self._index_mtime = os.path.getmtime(self.index_path)
+        except (OSError, ValueError):
+            self._entries = {}
+            self._index_mtime = None
+
+    def _reload_if_changed(self):
+        """Recarga el índice si otro proceso lo modificó"""
+        try:
+            mtime = os.path.getmtime(self.index_path)
+        except OSError:
+            return
+        if mtime != self._index_mtime:
+            self._load()
+
+    def _save(self):
+        tmp_path = self.index_path.with_name(f'{INDEX_NAME}.{os.getpid()}.tmp')
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.index_path)
+            self._index_mtime = os.path.getmtime(self.index_path)
+            self._last_save = time.time()
+        except OSError:
+            pass
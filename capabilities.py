@@ -0,0 +1,101 @@
+"""
+Detección de capacidades del sistema al iniciar
+Comprueba una sola vez si ffmpeg/ffprobe están disponibles, su versión y los
+codificadores por software que ofrecen, en lugar de lanzar un proceso por petición
+"""
+import shutil
+import subprocess
+import threading
+
+import yt_dlp
+
+# Sufijos de codificadores que dependen de hardware específico
+HARDWARE_ENCODER_SUFFIXES = (
+    '_nvenc', '_qsv', '_vaapi', '_videotoolbox', '_amf', '_v4l2m2m', '_mediacodec', '_omx', '_mf',
+)
+
+_lock = threading.Lock()
+_capabilities = None
+
+
+def _run(args):
+    return subprocess.run(args, capture_output=True, text=True, check=True, timeout=5).stdout
+
+
+def _probe_binary(name):
+    """Versión de un binario de ffmpeg, o None si no está instalado"""
+    path = shutil.which(name)
+    if not path:
+        return {'available': False, 'path': None, 'version': None}
+    try:
+        first_line = _run([path, '-version']).splitlines()[0]
+        # "ffmpeg version 6.1.1-3ubuntu5 Copyright (c) ..."
+        parts = first_line.split()
+        version = parts[2] if len(parts) > 2 and parts[1] == 'version' else first_line
+        return {'available': True, 'path': path, 'version': version}
+    except Exception:
+        return {'available': False, 'path': path, 'version': None}
+
+
+def _probe_encoders(ffmpeg_path):
+    """Codificadores de audio y video por software que ofrece ffmpeg"""
+    encoders = {'audio': [], 'video': []}
+    try:
+        output = _run([ffmpeg_path, '-hide_banner', '-encoders'])
+    except Exception:
+        return encoders
+    listing = False
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith('------'):
+            listing = True
+            continue
+        if not listing or not line:
+            continue
+        # " A....D libmp3lame           libmp3lame MP3 (MPEG audio layer 3)"
+        flags, _, rest = line.partition(' ')
+        name = rest.split(' ', 1)[0]
+        if not name or name.endswith(HARDWARE_ENCODER_SUFFIXES):
+            continue
+        if flags.startswith('A'):
+            encoders['audio'].append(name)
+        elif flags.startswith('V'):
+            encoders['video'].append(name)
+    return encoders
+
+
+def probe():
+    """Ejecuta la detección completa (lanza procesos; usar get_capabilities())"""
+    ffmpeg = _probe_binary('ffmpeg')
+    ffprobe = _probe_binary('ffprobe')
+    encoders = _probe_encoders(ffmpeg['path']) if ffmpeg['available'] else {'audio': [], 'video': []}
+    audio = set(encoders['audio'])
+    return {
+        'yt_dlp': yt_dlp.version.__version__,
+        'ffmpeg': ffmpeg,
+        'ffprobe': ffprobe,
+        'encoders': encoders,
+        'audio_targets': {
+            'mp3': 'libmp3lame' in audio,
+            'aac': 'aac' in audio or 'libfdk_aac' in audio,
+            'opus': 'libopus' in audio,
+        },
+    }
+
+
+def get_capabilities(refresh=False):
+    """Capacidades detectadas, calculadas solo la primera vez"""
+    global _capabilities
+    with _lock:
+        if _capabilities is None or refresh:
+            _capabilities = probe()
+        return _capabilities
+
+
+def ffmpeg_available():
+    return get_capabilities()['ffmpeg']['available']
+
+
+def has_encoder(name):
+    encoders = get_capabilities()['encoders']
+    return name in encoders['audio'] or name in encoders['video']
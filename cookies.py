@@ -0,0 +1,125 @@
+"""
+Gestión de cookies de YouTube en memoria
+Los archivos de cookies (formato Netscape) se leen una sola vez y se vuelven a
+cargar solo cuando cambian en disco. Con varios archivos se reparten las
+peticiones entre las cuentas por turnos (round-robin).
+"""
+import hashlib
+import io
+import itertools
+import logging
+import os
+import threading
+import time
+
+from yt_dlp.cookies import YoutubeDLCookieJar
+
+logger = logging.getLogger(__name__)
+
+# Segundos entre comprobaciones de cambios en los archivos de cookies
+RELOAD_INTERVAL = 5
+
+
+class CookieSource:
+    """Un cookiejar cargado en memoria, desde un archivo o desde texto"""
+
+    def __init__(self, name, path=None, content=None):
+        self.name = name
+        self.path = path
+        self.content = content
+        self.jar = None
+        self.visitor_data = None
+        self.count = 0
+        self.mtime = None
+        self.error = None
+
+    def load(self):
+        """Lee y parsea las cookies; si falla se conserva el jar anterior"""
+        jar = YoutubeDLCookieJar()
+        try:
+            if self.path:
+                mtime = os.path.getmtime(self.path)
+                jar.load(self.path)
+            else:
+                mtime = None
+                jar.load(io.StringIO(self.content))
+        except Exception as e:
+            self.error = str(e)
+            logger.warning('Error al cargar cookies de %s: %s', self.name, e)
+            return False
+
+        self.jar = jar
+        self.mtime = mtime
+        self.error = None
+        self.count = len(jar)
+        self.visitor_data = next(
+            (c.value for c in jar if c.name == 'VISITOR_INFO1_LIVE'), None
+        )
+        logger.info('Cookies cargadas desde %s: %d cookies', self.name, self.count)
+        return True
+
+    def changed(self):
+        if not self.path:
+            return False
+        try:
+            return os.path.getmtime(self.path) != self.mtime
+        except OSError:
+            return False
+
+
+class CookieManager:
+    """Pool de cookiejars con recarga por mtime y rotación entre peticiones"""
+
+    def __init__(self, sources, reload_interval=RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._last_check = time.time()
+        self._sources = [source for source in sources if source.load()]
+        self._turn = itertools.count()
+
+    @classmethod
+    def from_env(cls, default_file='cookies.txt'):
+        """
+        Fuentes de cookies: variable YOUTUBE_COOKIES (contenido del archivo) y
+        COOKIES_FILES (rutas separadas por os.pathsep). Si no hay ninguna se usa
+        el archivo local cookies.txt.
+        """
+        sources = []
+        content = os.getenv('YOUTUBE_COOKIES')
+        if content:
+            digest = hashlib.sha1(content.encode('utf-8')).hexdigest()[:8]
+            sources.append(CookieSource(f'YOUTUBE_COOKIES ({digest})', content=content))
+        for path in filter(None, os.getenv('COOKIES_FILES', '').split(os.pathsep)):
+            sources.append(CookieSource(path, path=path))
+        if not sources and os.path.exists(default_file):
+            sources.append(CookieSource(default_file, path=default_file))
+        return cls(sources)
+
+    def acquire(self):
+        """Siguiente cookiejar del pool, o None si no hay cookies configuradas"""
+        if not self._sources:
+            return None
+        self._reload_changed()
+        return self._sources[next(self._turn) % len(self._sources)]
+
+    def _reload_changed(self):
+        now = time.time()
+        if now - self._last_check < self.reload_interval:
+            return
+        with self._lock:
+            if now - self._last_check < self.reload_interval:
+                return
+            self._last_check = now
+            for source in self._sources:
+                if source.changed():
+                    source.load()
+
+
+def attach_cookies(ydl, source):
+    """
+    Hace que una instancia de YoutubeDL use el cookiejar compartido en memoria.
+    YoutubeDL.cookiejar es un cached_property, así que debe fijarse antes de la
+    primera petición de red de la instancia.
+    """
+    if source is not None and source.jar is not None:
+        ydl.__dict__['cookiejar'] = source.jar
@@ -0,0 +1,167 @@
+"""
+Sesión de descarga en dos fases
+1. Extracción: se pide la información del video una sola vez por cliente de YouTube
+2. Descarga: el formato se elige localmente sobre info['formats'] y se descarga con
+   process_ie_result, así que cambiar de formato no repite la extracción
+Si la descarga pide volver a extraer (velocidad limitada por debajo de
+throttledratelimit, URLs caducadas), la sesión extrae de nuevo y continúa.
+before_download(info) se llama con el formato ya elegido, antes de escribir nada
+en disco (p. ej. para reservar espacio); si lanza una excepción no se descarga.
+Con max_filesize, los formatos que se estima que lo superan se descartan antes
+de elegir, así que la selección se queda con el mejor que cabe.
+"""
+import copy
+
+import yt_dlp
+from yt_dlp.postprocessor import PostProcessor
+from yt_dlp.utils import ReExtractInfo
+
+from cookies import attach_cookies
+from formats import estimate_size, expected_size
+from metrics import timed
+from storage import FileTooLarge
+from ydl_options import thaw
+
+
+# Veces que una descarga puede volver a extraer la información antes de fallar
+REEXTRACT_ATTEMPTS = 3
+
+
+def _needs_reextract(error):
+    if isinstance(error, ReExtractInfo):
+        return True
+    exc_info = getattr(error, 'exc_info', None)
+    return bool(exc_info) and isinstance(exc_info[1], ReExtractInfo)
+
+
+class _BeforeDownload(PostProcessor):
+    """Pre-procesador 'before_dl' de yt-dlp que llama a callback(info)"""
+
+    def __init__(self, callback):
+        super().__init__()
+        self.callback = callback
+
+    def run(self, info):
+        self.callback(info)
+        return [], info
+
+
+class ExtractionSession:
+    """
+    Mantiene un YoutubeDL y su info extraída por cliente durante una petición.
+    client=None usa los player_client que ya traen las opciones.
+    """
+
+    def __init__(self, url, opts, cookies=None, before_download=None, max_filesize=None):
+        self.url = url
+        self.opts = opts
+        self.cookies = cookies
+        self.before_download = before_download
+        self.max_filesize = max_filesize
+        self._extracted = {}
+        self._errors = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for ydl, _ in self._extracted.values():
+            ydl.close()
+        self._extracted.clear()
+
+    def extraction_failed(self, client=None):
+        """Indica si la extracción con este cliente ya falló en esta sesión"""
+        return client in self._errors
+
+    def extract(self, client=None):
+        """Fase de extracción: una sola petición al extractor por cliente"""
+        if client in self._errors:
+            raise self._errors[client]
+        if client in self._extracted:
+            return self._extracted[client][1]
+
+        opts = thaw(self.opts)
+        if client:
+            opts.setdefault('extractor_args', {}).setdefault('youtube', {})['player_client'] = [client]
+        ydl = yt_dlp.YoutubeDL(opts)
+        attach_cookies(ydl, self.cookies)
+        if self.before_download or self.max_filesize:
+            ydl.add_post_processor(_BeforeDownload(self._check_before_download), when='before_dl')
+        try:
+            with timed('extract'):
+                info = ydl.extract_info(self.url, download=False, process=False)
+        except Exception as e:
+            ydl.close()
+            self._errors[client] = e
+            raise
+        self._extracted[client] = (ydl, info)
+        return info
+
+    def ydl(self, client=None):
+        """Instancia de YoutubeDL usada para la extracción con este cliente"""
+        self.extract(client)
+        return self._extracted[client][0]
+
+    def select(self, format_spec, client=None):
+        """Elige format_spec sobre los formatos extraídos, sin descargar"""
+        ydl, info = self._use_format(format_spec, client)
+        return ydl.process_ie_result(info, download=False)
+
+    def download(self, format_spec, client=None):
+        """
+        Fase de descarga: selecciona format_spec sobre los formatos ya extraídos
+        y descarga. Si el formato no existe falla sin hacer peticiones de red.
+        Devuelve la info procesada (con 'requested_downloads').
+        """
+        for attempt in range(REEXTRACT_ATTEMPTS + 1):
+            ydl, info = self._use_format(format_spec, client)
+            if attempt == REEXTRACT_ATTEMPTS:
+                # Último intento: aceptar la velocidad que dé el origen
+                ydl.params.pop('throttledratelimit', None)
+            try:
+                with timed('download'):
+                    return ydl.process_ie_result(info, download=True)
+            except Exception as e:
+                if attempt == REEXTRACT_ATTEMPTS or not _needs_reextract(e):
+                    raise
+                # La descarga continúa desde el .part con la información nueva
+                self._forget(client)
+
+    def _check_before_download(self, info):
+        # Suma de video + audio al unir formatos, que el filtrado por formato no ve
+        size = expected_size(info)
+        if self.max_filesize and size and size > self.max_filesize:
+            raise FileTooLarge(
+                f"El archivo ocupará unos {size} bytes y supera el máximo de {self.max_filesize} bytes."
+            )
+        if self.before_download:
+            self.before_download(info)
+
+    def _fitting_formats(self, info):
+        """Formatos cuyo tamaño estimado no supera max_filesize (los de tamaño desconocido se conservan)"""
+        duration = info.get('duration')
+        fitting = [fmt for fmt in info['formats']
+                   if (estimate_size(fmt, duration) or 0) <= self.max_filesize]
+        if not fitting:
+            raise FileTooLarge(
+                f"Todos los formatos del video superan el tamaño máximo de {self.max_filesize} bytes."
+            )
+        return fitting
+
+    def _forget(self, client):
+        extracted = self._extracted.pop(client, None)
+        if extracted:
+            extracted[0].close()
+
+    def _use_format(self, format_spec, client):
+        info = self.extract(client)
+        ydl = self._extracted[client][0]
+        ydl.params['format'] = format_spec
+        ydl.format_selector = ydl.build_format_selector(format_spec)
+        info = copy.deepcopy(info)
+        if self.max_filesize and info.get('formats'):
+            info['formats'] = self._fitting_formats(info)
+        return ydl, info
@@ -0,0 +1,68 @@
+"""
+Envío de archivos descargados
+Usa send_file de Flask con respuestas condicionales: soporta Range (descargas
+reanudables y búsqueda), ETag/Last-Modified y respuestas 304. Con gunicorn el
+archivo se envía con sendfile a través de wsgi.file_wrapper.
+
+Si X_ACCEL_REDIRECT está definido (ubicación interna de nginx que apunta a la
+carpeta de archivos), la transferencia se delega por completo a nginx.
+"""
+import mimetypes
+import os
+import unicodedata
+from urllib.parse import quote
+
+from flask import Response, send_file
+from werkzeug.security import safe_join
+
+# Ej: X_ACCEL_REDIRECT=/protected/ con "location /protected/ { internal; alias /ruta/downloads/; }"
+X_ACCEL_REDIRECT = os.getenv('X_ACCEL_REDIRECT')
+
+# Segundos de caché en el navegador para los archivos servidos
+FILE_MAX_AGE = int(os.getenv('FILE_MAX_AGE', 3600))
+
+
+def resolve(root, filename):
+    """Ruta segura de filename dentro de root, o None si no existe o no es válida"""
+    if not filename or filename.startswith('.'):
+        return None
+    path = safe_join(os.fspath(root), filename)
+    if not path or not os.path.isfile(path):
+        return None
+    return path
+
+
+def content_disposition(filename):
+    """Cabecera de descarga con el nombre codificado como lo hace send_file (RFC 6266)"""
+    try:
+        filename.encode('ascii')
+        return f'attachment; filename="{filename}"'
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        return f"attachment; filename=\"{simple}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def send_options(download_name):
+    """Argumentos de send_file para enviar un archivo como descarga (también los usa asgi.py)"""
+    return {
+        'mimetype': mimetypes.guess_type(download_name)[0] or 'application/octet-stream',
+        'as_attachment': True,
+        'download_name': download_name,
+        'conditional': True,
+        'etag': True,
+        'max_age': FILE_MAX_AGE,
+    }
+
+
+def serve_file(path, download_name, root=None):
+    """Respuesta que envía el archivo como descarga"""
+    options = send_options(download_name)
+
+    if X_ACCEL_REDIRECT and root is not None:
+        relative = os.path.relpath(path, root).replace(os.sep, '/')
+        response = Response(mimetype=options['mimetype'])
+        response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT.rstrip('/') + '/' + quote(relative)
+        response.headers['Content-Disposition'] = content_disposition(download_name)
+        return response
+
+    return send_file(path, **options)
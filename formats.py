@@ -0,0 +1,129 @@
+"""
+Análisis de los formatos de un video
+Revisa solo los campos que importan (has_drm, protocol, códecs, resolución) en
+vez de convertir cada formato a texto, y resume lo que se puede descargar.
+
+yt-dlp marca has_drm en cada formato al leer los manifiestos (HLS: EXT-X-KEY
+con SAMPLE-AES/FairPlay, DASH: ContentProtection, ISM: Protection) y, al
+procesar la info, quita esos formatos y deja el aviso en '_has_drm'.
+"""
+
+HTTP_PROTOCOLS = ('http', 'https')
+
+
+def is_drm(fmt):
+    """Formato con DRM confirmado ('maybe' no cuenta)"""
+    has_drm = fmt.get('has_drm')
+    return bool(has_drm and has_drm != 'maybe') or bool(fmt.get('drm'))
+
+
+def is_audio_only(fmt):
+    return fmt.get('vcodec') == 'none' and fmt.get('acodec') != 'none'
+
+
+def has_video(fmt):
+    # vcodec None significa desconocido (p. ej. extractor genérico), no "sin video"
+    return fmt.get('vcodec') != 'none'
+
+
+def is_progressive(fmt):
+    """Video y audio en un único archivo servido por HTTP(S)"""
+    return (
+        has_video(fmt)
+        and fmt.get('acodec') != 'none'
+        and fmt.get('protocol') in HTTP_PROTOCOLS
+    )
+
+
+def _brief(fmt):
+    if not fmt:
+        return None
+    return {
+        'format_id': fmt.get('format_id'),
+        'ext': fmt.get('ext'),
+        'protocol': fmt.get('protocol'),
+        'height': fmt.get('height'),
+        'vcodec': fmt.get('vcodec'),
+        'acodec': fmt.get('acodec'),
+        'abr': fmt.get('abr'),
+        'tbr': fmt.get('tbr'),
+        'filesize': fmt.get('filesize') or fmt.get('filesize_approx'),
+    }
+
+
+def analyze_formats(info):
+    """
+    Resumen de los formatos de una info de yt-dlp:
+    DRM, mejor audio, mejor mp4 progresivo y resoluciones disponibles
+    """
+    formats = info.get('formats') or []
+
+    has_drm = bool(info.get('_has_drm'))
+    maybe_drm = False
+    best_audio = None
+    best_audio_rank = None
+    best_mp4 = None
+    best_mp4_rank = None
+    resolutions = set()
+    protocols = set()
+
+    for fmt in formats:
+        if is_drm(fmt):
+            has_drm = True
+            continue
+        if fmt.get('has_drm') == 'maybe':
+            maybe_drm = True
+        if fmt.get('protocol'):
+            protocols.add(fmt['protocol'])
+
+        if is_audio_only(fmt):
+            rank = (fmt.get('abr') or fmt.get('tbr') or 0, fmt.get('filesize') or 0)
+            if best_audio_rank is None or rank > best_audio_rank:
+                best_audio, best_audio_rank = fmt, rank
+            continue
+
+        if has_video(fmt) and fmt.get('height'):
+            resolutions.add(fmt['height'])
+
+        if is_progressive(fmt) and fmt.get('ext') == 'mp4':
+            rank = (fmt.get('height') or 0, fmt.get('tbr') or 0)
+            if best_mp4_rank is None or rank > best_mp4_rank:
+                best_mp4, best_mp4_rank = fmt, rank
+
+    return {
+        'has_drm': has_drm,
+        'maybe_drm': maybe_drm,
+        'protocols': sorted(protocols),
+        'best_audio': _brief(best_audio),
+        'best_progressive_mp4': _brief(best_mp4),
+        'resolutions': sorted(resolutions, reverse=True),
+    }
+
+
+def estimate_size(fmt, duration=None):
+    """
+    Tamaño previsto de un formato en bytes: filesize, filesize_approx o, si no
+    hay, bitrate (tbr, o vbr + abr, en kbit/s) × duración. None si no se sabe.
+    """
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return size
+    duration = fmt.get('duration') or duration
+    bitrate = fmt.get('tbr') or (fmt.get('vbr') or 0) + (fmt.get('abr') or 0)
+    if bitrate and duration:
+        return int(bitrate * 1000 / 8 * duration)
+    return None
+
+
+def expected_size(info):
+    """
+    Tamaño previsto del formato elegido (info procesada por yt-dlp); si se unen
+    video y audio, la suma de requested_formats. None si no se conoce.
+    """
+    total = 0
+    for fmt in info.get('requested_formats') or [info]:
+        size = estimate_size(fmt, info.get('duration'))
+        if not size:
+            return None
+        total += size
+    return total
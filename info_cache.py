@@ -0,0 +1,108 @@
+"""
+Caché de la información de los videos (/api/info)
+Dos niveles: un LRU en memoria y una tabla SQLite que sobrevive a reinicios y
+se comparte entre procesos. Las entradas caducan tras ttl segundos.
+Solo se guarda la información normalizada (sin URLs firmadas de los formatos).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS info (
+    key         TEXT PRIMARY KEY,
+    data        TEXT NOT NULL,
+    fetched_at  REAL NOT NULL
+);
+"""
+
+
+class InfoCache:
+    """
+    LRU en memoria (max_entries) respaldado por SQLite (path).
+    path=None usa solo la memoria.
+    """
+
+    def __init__(self, path=None, ttl=3600, max_entries=1024):
+        self.path = os.fspath(path) if path else None
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if self.path:
+            with self._connect() as conn:
+                conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _fresh(self, fetched_at):
+        return not self.ttl or time.time() - fetched_at <= self.ttl
+
+    def get(self, key):
+        """Devuelve la info guardada para key si no ha caducado"""
+        with self._lock:
+            item = self._memory.get(key)
+            if item and self._fresh(item[1]):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            self._memory.pop(key, None)
+
+        if self.path:
+            row = self._connect().execute(
+                'SELECT data, fetched_at FROM info WHERE key = ?', (key,)
+            ).fetchone()
+            if row and self._fresh(row[1]):
+                info = json.loads(row[0])
+                with self._lock:
+                    self.hits += 1
+                    self._remember(key, info, row[1])
+                return info
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, info):
+        now = time.time()
+        with self._lock:
+            self._remember(key, info, now)
+        if self.path:
+            with self._connect() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO info (key, data, fetched_at) VALUES (?, ?, ?)',
+                    (key, json.dumps(info), now)
+                )
+                if self.ttl:
+                    conn.execute('DELETE FROM info WHERE fetched_at < ?', (now - self.ttl,))
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'memory_entries': len(self._memory),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            }
+
+    def _remember(self, key, info, fetched_at):
+        self._memory[key] = (info, fetched_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
@@ -0,0 +1,452 @@
+"""
+Almacén compartido de trabajos de descarga (JOBS_BACKEND=store)
+La web encola los trabajos en el almacén y los procesos de worker.py los toman
+y los ejecutan con el mismo código:
+- cada trabajo tomado tiene un lease que el worker renueva (heartbeat); si el
+  worker muere, al vencer el lease otro worker lo reintenta, hasta max_attempts
+- el progreso y el resultado quedan en el almacén, así que cualquier nodo web
+  responde el estado y los eventos; los archivos se publican en DOWNLOAD_DIR
+  (o CACHE_DIR), que debe ser un almacenamiento compartido por todos los nodos
+SqliteJobStore es la implementación por defecto: un archivo SQLite en WAL,
+solo para procesos de una misma máquina (WAL necesita memoria compartida
+local y SQLite no admite sistemas de archivos de red). Para repartir web y
+workers entre máquinas hace falta otro backend (p. ej. un broker en red): una
+subclase de JobStore registrada con register_store para su esquema de URL, o
+indicada con JOBS_STORE_CLASS.
+"""
+import importlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+
+from jobs import JOB_FAILED, JOB_FINISHED, JOB_QUEUED, JOB_RUNNING, PROGRESS_INTERVAL, host_key
+
+logger = logging.getLogger(__name__)
+
+# Segundos que un worker retiene un trabajo sin renovar el lease, e intentos
+# (tomas por un worker) antes de darlo por fallido
+JOB_LEASE = int(os.getenv('JOB_LEASE', 60))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+
+# Clase de un almacén de otro backend ('módulo:Clase'); recibe JOBS_STORE como URL
+JOBS_STORE_CLASS = os.getenv('JOBS_STORE_CLASS')
+
+# Fábricas de almacenes por esquema de la URL de JOBS_STORE (register_store)
+STORE_BACKENDS = {}
+
+# Intervalo mínimo entre borrados de trabajos expirados desde la web
+REAP_INTERVAL = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id              TEXT PRIMARY KEY,
+    url             TEXT NOT NULL,
+    host            TEXT NOT NULL,
+    task            TEXT NOT NULL,
+    payload         BLOB NOT NULL,
+    report_progress INTEGER NOT NULL DEFAULT 0,
+    keep_traceback  INTEGER NOT NULL DEFAULT 0,
+    status          TEXT NOT NULL,
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    max_attempts    INTEGER NOT NULL,
+    worker          TEXT,
+    lease_token     TEXT,
+    lease_expires   REAL,
+    progress        TEXT NOT NULL,
+    version         INTEGER NOT NULL DEFAULT 0,
+    result          TEXT,
+    error           TEXT,
+    details         TEXT,
+    created_at      REAL NOT NULL,
+    started_at      REAL,
+    finished_at     REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_lease ON jobs (lease_token);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at);
+"""
+
+
+def task_name(func):
+    """'módulo:función' con la que un worker vuelve a importar func"""
+    module = func.__module__
+    if module == '__main__':
+        # python app_production.py: el worker importa el módulo por su nombre de archivo
+        module = os.path.splitext(os.path.basename(sys.modules['__main__'].__file__))[0]
+    return f'{module}:{func.__qualname__}'
+
+
+def resolve_task(name):
+    module, _, qualname = name.partition(':')
+    target = importlib.import_module(module)
+    for part in qualname.split('.'):
+        target = getattr(target, part)
+    return target
+
+
+def _phase(status):
+    return json.dumps({'phase': status})
+
+
+class Lease:
+    """Trabajo tomado por un worker; token identifica esta toma"""
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.token = row['lease_token']
+        self.url = row['url']
+        self.task = row['task']
+        self.args, self.kwargs = pickle.loads(row['payload'])
+        self.report_progress = bool(row['report_progress'])
+        self.keep_traceback = bool(row['keep_traceback'])
+        self.attempts = row['attempts']
+        self.created_at = row['created_at']
+        self.started_at = row['started_at']
+
+
+class JobStore(ABC):
+    """
+    Interfaz de un almacén de trabajos. Las operaciones de un worker sobre un
+    Lease devuelven False si ya no es suyo (lease vencido y tomado por otro).
+    Un backend nuevo implementa estos métodos y se registra con register_store
+    (o se elige con JOBS_STORE_CLASS); ver open_store.
+    """
+
+    @abstractmethod
+    def submit(self, url, task, args, kwargs, report_progress=False, keep_traceback=False,
+               max_attempts=JOB_MAX_ATTEMPTS):
+        """Encola el trabajo; devuelve su id"""
+
+    @abstractmethod
+    def row(self, job_id):
+        """Fila del trabajo con las columnas de SCHEMA (sirve un dict), o None"""
+
+    def get(self, job_id):
+        """StoredJob o None"""
+        row = self.row(job_id)
+        return StoredJob(self, row) if row else None
+
+    @abstractmethod
+    def claim(self, worker, lease=JOB_LEASE, per_host_limit=None):
+        """Toma el trabajo pendiente más antiguo (o uno con el lease vencido); Lease o None"""
+
+    @abstractmethod
+    def heartbeat(self, leased, lease=JOB_LEASE):
+        """Renueva el lease"""
+
+    @abstractmethod
+    def report_progress(self, leased, progress):
+        """Guarda el progreso y cambia la versión del trabajo"""
+
+    @abstractmethod
+    def finish(self, leased, result):
+        """Marca el trabajo como terminado con result (serializable en JSON)"""
+
+    @abstractmethod
+    def fail(self, leased, error, details=None):
+        """Marca el trabajo como fallido"""
+
+    @abstractmethod
+    def reap(self, result_ttl):
+        """Borra los trabajos terminados hace más de result_ttl segundos"""
+
+    @abstractmethod
+    def stats(self):
+        """queued, running, running_by_host, jobs y workers"""
+
+
+class SqliteJobStore(JobStore):
+    """Almacén en un archivo SQLite en un disco local; una conexión por hilo"""
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def submit(self, url, task, args, kwargs, report_progress=False, keep_traceback=False,
+               max_attempts=JOB_MAX_ATTEMPTS):
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO jobs (id, url, host, task, payload, report_progress, keep_traceback,
+                                  status, max_attempts, progress, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (job_id, url, host_key(url), task, pickle.dumps((args, kwargs)), int(report_progress),
+                 int(keep_traceback), JOB_QUEUED, max(1, int(max_attempts)), _phase(JOB_QUEUED), time.time())
+            )
+        return job_id
+
+    def row(self, job_id):
+        return self._connect().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+    def claim(self, worker, lease=JOB_LEASE, per_host_limit=None):
+        now = time.time()
+        token = uuid.uuid4().hex
+        with self._connect() as conn:
+            # Trabajos cuyo worker murió en todos los intentos
+            conn.execute(
+                """
+                UPDATE jobs SET status = ?, error = ?, finished_at = ?, progress = ?, version = version + 1
+                WHERE status = ? AND lease_expires < ? AND attempts >= max_attempts
+                """,
+                (JOB_FAILED, 'El worker dejó de responder en todos los intentos', now, _phase(JOB_FAILED),
+                 JOB_RUNNING, now)
+            )
+            # Una sola sentencia: SQLite la ejecuta con el bloqueo de escritura, así
+            # que dos workers nunca toman el mismo trabajo
+            conn.execute(
+                """
+                UPDATE jobs SET status = ?, attempts = attempts + 1, worker = ?, lease_token = ?,
+                    lease_expires = ?, started_at = ?, progress = ?, version = version + 1
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE (status = ? OR (status = ? AND lease_expires < ?))
+                      AND attempts < max_attempts
+                      AND host NOT IN (
+                          SELECT host FROM jobs WHERE status = ? AND lease_expires >= ?
+                          GROUP BY host HAVING COUNT(*) >= ?
+                      )
+                    ORDER BY created_at
+                    LIMIT 1
+                )
+                """,
+                (JOB_RUNNING, worker, token, now + lease, now, _phase(JOB_RUNNING),
+                 JOB_QUEUED, JOB_RUNNING, now, JOB_RUNNING, now, per_host_limit or 2 ** 31)
+            )
+        row = self._connect().execute('SELECT * FROM jobs WHERE lease_token = ?', (token,)).fetchone()
+        return Lease(row) if row else None
+
+    def _update_leased(self, leased, sql, params):
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f'UPDATE jobs SET {sql} WHERE id = ? AND lease_token = ? AND status = ?',
+                (*params, leased.id, leased.token, JOB_RUNNING)
+            )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, leased, lease=JOB_LEASE):
+        return self._update_leased(leased, 'lease_expires = ?', (time.time() + lease,))
+
+    def report_progress(self, leased, progress):
+        return self._update_leased(leased, 'progress = ?, version = version + 1', (json.dumps(progress),))
+
+    def finish(self, leased, result):
+        return self._update_leased(
+            leased,
+            'status = ?, result = ?, finished_at = ?, progress = ?, version = version + 1',
+            (JOB_FINISHED, json.dumps(result, default=str), time.time(), _phase(JOB_FINISHED))
+        )
+
+    def fail(self, leased, error, details=None):
+        return self._update_leased(
+            leased,
+            'status = ?, error = ?, details = ?, finished_at = ?, progress = ?, version = version + 1',
+            (JOB_FAILED, error, details, time.time(), _phase(JOB_FAILED))
+        )
+
+    def reap(self, result_ttl):
+        with self._connect() as conn:
+            conn.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?',
+                (JOB_FINISHED, JOB_FAILED, time.time() - result_ttl)
+            )
+
+    def stats(self):
+        now = time.time()
+        conn = self._connect()
+        counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        running = conn.execute(
+            'SELECT host, worker FROM jobs WHERE status = ? AND lease_expires >= ?', (JOB_RUNNING, now)
+        ).fetchall()
+        by_host = {}
+        for row in running:
+            by_host[row['host']] = by_host.get(row['host'], 0) + 1
+        return {
+            'backend': 'store',
+            'queued': counts.get(JOB_QUEUED, 0),
+            'running': len(running),
+            'running_by_host': by_host,
+            'jobs': sum(counts.values()),
+            'workers': len({row['worker'] for row in running}),
+        }
+
+
+def register_store(scheme, factory):
+    """factory(url) crea el almacén para las URL de JOBS_STORE con scheme://"""
+    STORE_BACKENDS[scheme] = factory
+
+
+def _open_sqlite(url):
+    return SqliteJobStore(url[len('sqlite:///'):])
+
+
+register_store('sqlite', _open_sqlite)
+
+
+def open_store(url, backend=JOBS_STORE_CLASS):
+    """
+    Almacén según JOBS_STORE: una ruta o sqlite:///ruta para SQLite, o
+    scheme://... de un backend registrado. Con backend ('módulo:Clase',
+    JOBS_STORE_CLASS) se usa esa clase, que recibe la URL al construirse.
+    """
+    if backend:
+        return resolve_task(backend)(url)
+    scheme, sep, _ = url.partition('://')
+    if not sep:
+        return SqliteJobStore(url)
+    factory = STORE_BACKENDS.get(scheme)
+    if not factory:
+        raise ValueError(f"Almacén de trabajos no soportado: {url} (ver register_store y JOBS_STORE_CLASS)")
+    return factory(url)
+
+
+class StoredJob:
+    """
+    Trabajo del almacén con la interfaz de jobs.Job que usan las rutas
+    (status, result, to_dict, wait_for_change...). Se relee del almacén como
+    mucho cada REFRESH segundos mientras no ha terminado.
+    """
+
+    REFRESH = 0.25
+
+    def __init__(self, store, row):
+        self._store = store
+        self.id = row['id']
+        self.url = row['url']
+        self._load(row)
+
+    def _load(self, row):
+        self._row = row
+        self._loaded_at = time.monotonic()
+
+    def _current(self):
+        if self._row['status'] not in (JOB_FINISHED, JOB_FAILED) \
+                and time.monotonic() - self._loaded_at >= self.REFRESH:
+            row = self._store.row(self.id)
+            if row:
+                self._load(row)
+        return self._row
+
+    @property
+    def status(self):
+        return self._current()['status']
+
+    @property
+    def is_done(self):
+        return self.status in (JOB_FINISHED, JOB_FAILED)
+
+    @property
+    def version(self):
+        return self._current()['version']
+
+    @property
+    def progress(self):
+        return json.loads(self._current()['progress'])
+
+    @property
+    def result(self):
+        result = self._current()['result']
+        return json.loads(result) if result else None
+
+    @property
+    def error(self):
+        return self._current()['error']
+
+    @property
+    def details(self):
+        return self._current()['details']
+
+    def wait_for_change(self, version, timeout):
+        """Como Job.wait_for_change, consultando el almacén"""
+        deadline = time.monotonic() + timeout
+        while True:
+            current = self.version
+            remaining = deadline - time.monotonic()
+            if current != version or remaining <= 0:
+                return current
+            time.sleep(min(PROGRESS_INTERVAL, remaining))
+
+    def to_dict(self):
+        row = self._current()
+        data = {
+            'job_id': self.id,
+            'status': row['status'],
+            'url': self.url,
+            'progress': json.loads(row['progress']),
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at'],
+            'attempts': row['attempts'],
+        }
+        if row['status'] == JOB_FAILED:
+            data['error'] = row['error']
+            if row['details']:
+                data['details'] = row['details']
+        return data
+
+
+class StoreJobManager:
+    """
+    La interfaz de JobManager (submit, get, stats) sobre un JobStore: los
+    trabajos los ejecutan los procesos de worker.py, no este proceso
+    """
+
+    def __init__(self, store, result_ttl=3600, max_attempts=JOB_MAX_ATTEMPTS):
+        self.store = store
+        self.result_ttl = result_ttl
+        self.max_attempts = max_attempts
+        self._reaped_at = 0
+
+    def submit(self, url, func, *args, keep_traceback=False, report_progress=False, **kwargs):
+        """func debe poder importarse por su nombre (ver task_name)"""
+        job_id = self.store.submit(
+            url, task_name(func), args, kwargs,
+            report_progress=report_progress, keep_traceback=keep_traceback, max_attempts=self.max_attempts
+        )
+        # Con request_id: enlaza la petición con los registros del worker, que solo llevan job_id
+        logger.info('Trabajo encolado', extra={'job_id': job_id, 'host': host_key(url)})
+        return self.store.get(job_id)
+
+    def get(self, job_id):
+        self._reap()
+        return self.store.get(job_id)
+
+    def call(self, url, func, *args, **kwargs):
+        """Encola func y espera a que un worker la ejecute; devuelve el resultado o lanza su error"""
+        job = self.submit(url, func, *args, **kwargs)
+        version = None
+        while not job.is_done:
+            version = job.wait_for_change(version, 30)
+        if job.status == JOB_FAILED:
+            raise Exception(job.error)
+        return job.result
+
+    def stats(self):
+        return self.store.stats()
+
+    def _reap(self):
+        now = time.monotonic()
+        if not self.result_ttl or now - self._reaped_at < REAP_INTERVAL:
+            return
+        self._reaped_at = now
+        self.store.reap(self.result_ttl)
@@ -0,0 +1,312 @@
+"""
+Cola de trabajos de descarga asíncrona
+Las descargas se ejecutan en un pool acotado de hilos, con un límite de
+descargas simultáneas por host, y los clientes consultan el estado por id
+o reciben el progreso en vivo con Server-Sent Events (event_stream, o
+async_event_stream en el servidor ASGI)
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from log import bind, request_id
+from metrics import JOBS_COMPLETED, PHASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_FINISHED = 'finished'
+JOB_FAILED = 'failed'
+
+# Intervalo mínimo entre avisos de progreso (los intermedios se combinan)
+PROGRESS_INTERVAL = 0.5
+# Comentario SSE periódico para que proxies y navegadores no corten la conexión
+HEARTBEAT_INTERVAL = 15
+
+
+def host_key(url):
+    """Normaliza el host de la URL para agrupar los límites por sitio"""
+    try:
+        host = (urlparse(url).hostname or '').lower()
+    except ValueError:
+        host = ''
+    for prefix in ('www.', 'm.', 'music.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    if host == 'youtu.be':
+        host = 'youtube.com'
+    return host or 'desconocido'
+
+
+class Job:
+    """Un trabajo de descarga y su estado"""
+
+    def __init__(self, url, func, args, kwargs, keep_traceback=False):
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.host = host_key(url)
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.keep_traceback = keep_traceback
+        # Petición que lo creó, para correlacionar sus registros
+        self.request_id = request_id.get()
+        self.status = JOB_QUEUED
+        self.result = None
+        self.error = None
+        self.details = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+        self.progress = {'phase': JOB_QUEUED}
+        self.version = 0
+        self._changed = threading.Condition()
+        self._notified_at = 0
+
+    @property
+    def is_done(self):
+        return self.status in (JOB_FINISHED, JOB_FAILED)
+
+    def report_progress(self, phase, **fields):
+        """
+        Actualiza el progreso (phase: extracting, downloading, transcoding...).
+        Se llama desde los hooks de yt-dlp muchas veces por segundo: solo guarda
+        el último estado y avisa a los suscriptores como mucho cada PROGRESS_INTERVAL,
+        o en seguida si cambia la fase.
+        """
+        with self._changed:
+            phase_changed = phase != self.progress.get('phase')
+            self.progress = dict(fields, phase=phase)
+            self.version += 1
+            now = time.monotonic()
+            if phase_changed or now - self._notified_at >= PROGRESS_INTERVAL:
+                self._notified_at = now
+                self._changed.notify_all()
+
+    def _notify(self):
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait_for_change(self, version, timeout):
+        """Espera hasta que haya un estado más nuevo que version; devuelve la versión actual"""
+        with self._changed:
+            if self.version == version:
+                self._changed.wait(timeout)
+            return self.version
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'url': self.url,
+            'progress': dict(self.progress),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if self.status == JOB_FAILED:
+            data['error'] = self.error
+            if self.details:
+                data['details'] = self.details
+        return data
+
+
+class JobManager:
+    """
+    Pool de descargas con límite global (max_workers) y por host (per_host_limit).
+    Los trabajos que exceden el límite de su host esperan en la cola sin ocupar
+    un hilo del pool. Los trabajos terminados se eliminan tras result_ttl segundos.
+    Si admit() devuelve False (p. ej. poco espacio en disco) no se empieza ningún
+    trabajo nuevo; se vuelve a comprobar cada admit_retry segundos.
+    """
+
+    def __init__(self, max_workers=4, per_host_limit=2, result_ttl=3600, admit=None,
+                 admit_retry=5):
+        self.max_workers = max(1, int(max_workers))
+        self.per_host_limit = max(1, int(per_host_limit))
+        self.result_ttl = result_ttl
+        self.admit = admit
+        self.admit_retry = admit_retry
+        self.blocked = False
+        self._retry_timer = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='download-job'
+        )
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._pending = deque()
+        self._running = 0
+        self._running_by_host = {}
+
+    def submit(self, url, func, *args, keep_traceback=False, report_progress=False, **kwargs):
+        """
+        Encola func(*args, **kwargs) y devuelve el Job inmediatamente.
+        Con report_progress=True, func recibe progress=job.report_progress.
+        """
+        job = Job(url, func, args, kwargs, keep_traceback=keep_traceback)
+        if report_progress:
+            job.kwargs['progress'] = job.report_progress
+        self._reap()
+        with self._lock:
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._dispatch_locked()
+        logger.info('Trabajo encolado', extra={'job_id': job.id, 'host': job.host})
+        return job
+
+    def get(self, job_id):
+        self._reap()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'per_host_limit': self.per_host_limit,
+                'running': self._running,
+                'queued': len(self._pending),
+                'running_by_host': dict(self._running_by_host),
+                'jobs': len(self._jobs),
+                'admission_blocked': self.blocked,
+            }
+
+    def dispatch(self):
+        """Vuelve a intentar lanzar los trabajos pendientes"""
+        with self._lock:
+            self._retry_timer = None
+            self._dispatch_locked()
+
+    def _dispatch_locked(self):
+        """Lanza los trabajos pendientes que caben en el pool y en su host"""
+        if not self._pending or self._running >= self.max_workers:
+            return
+        if self.admit and not self.admit():
+            self.blocked = True
+            if self._retry_timer is None:
+                self._retry_timer = threading.Timer(self.admit_retry, self.dispatch)
+                self._retry_timer.daemon = True
+                self._retry_timer.start()
+            return
+        self.blocked = False
+        waiting = deque()
+        while self._pending and self._running < self.max_workers:
+            job = self._pending.popleft()
+            if self._running_by_host.get(job.host, 0) >= self.per_host_limit:
+                waiting.append(job)
+                continue
+            self._running += 1
+            self._running_by_host[job.host] = self._running_by_host.get(job.host, 0) + 1
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+            PHASE_SECONDS.observe(job.started_at - job.created_at, phase='queue')
+            job.progress = {'phase': JOB_RUNNING}
+            job._notify()
+            self._executor.submit(self._run, job)
+        waiting.extend(self._pending)
+        self._pending = waiting
+
+    def _run(self, job):
+        try:
+            with bind(job_id=job.id, request_id=job.request_id):
+                try:
+                    job.result = job.func(*job.args, **job.kwargs)
+                    job.status = JOB_FINISHED
+                except Exception as e:
+                    job.error = str(e)
+                    if job.keep_traceback:
+                        job.details = traceback.format_exc()
+                    job.status = JOB_FAILED
+                    # La traza completa solo con LOG_LEVEL=DEBUG
+                    logger.warning('Trabajo fallido: %s', e, exc_info=logger.isEnabledFor(logging.DEBUG))
+        finally:
+            job.finished_at = time.time()
+            PHASE_SECONDS.observe(job.finished_at - job.started_at, phase='job')
+            JOBS_COMPLETED.inc(status=job.status)
+            job.func = job.args = job.kwargs = None
+            with self._lock:
+                self._running -= 1
+                remaining = self._running_by_host.get(job.host, 1) - 1
+                if remaining > 0:
+                    self._running_by_host[job.host] = remaining
+                else:
+                    self._running_by_host.pop(job.host, None)
+                self._dispatch_locked()
+            job.progress = {'phase': job.status}
+            job.done.set()
+            job._notify()
+
+    def _reap(self):
+        """Elimina los trabajos terminados cuyo resultado ya expiró"""
+        if not self.result_ttl:
+            return
+        now = time.time()
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.is_done and job.finished_at and now - job.finished_at > self.result_ttl:
+                    del self._jobs[job_id]
+
+
+def _sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+def event_stream(job, interval=PROGRESS_INTERVAL, heartbeat=HEARTBEAT_INTERVAL):
+    """
+    Eventos SSE del trabajo: 'progress' con el estado más reciente (como mucho
+    uno por interval) y un evento final 'finished' o 'failed'
+    """
+    version = None
+    while True:
+        current = job.wait_for_change(version, heartbeat)
+        if current == version:
+            yield ': keepalive\n\n'
+            continue
+        version = current
+        if job.is_done:
+            yield _sse(job.status, job.to_dict())
+            return
+        yield _sse('progress', job.to_dict())
+        time.sleep(interval)
+
+
+async def async_event_stream(job, interval=PROGRESS_INTERVAL, heartbeat=HEARTBEAT_INTERVAL, run=None):
+    """
+    Los mismos eventos que event_stream para el bucle de eventos: consulta la
+    versión del trabajo cada interval en lugar de ocupar un hilo esperando.
+    Si leer el trabajo bloquea (almacén compartido), run(func) es una corrutina
+    que ejecuta func fuera del bucle y devuelve su resultado.
+    """
+    async def read(func):
+        return await run(func) if run else func()
+
+    version = None
+    idle = 0
+    while True:
+        current = await read(lambda: job.version)
+        if current == version:
+            if idle >= heartbeat:
+                idle = 0
+                yield ': keepalive\n\n'
+            await asyncio.sleep(interval)
+            idle += interval
+            continue
+        version = current
+        idle = 0
+        done, status, data = await read(lambda: (job.is_done, job.status, job.to_dict()))
+        if done:
+            yield _sse(status, data)
+            return
+        yield _sse('progress', data)
+        await asyncio.sleep(interval)
@@ -0,0 +1,172 @@
+"""
+Índice de metadatos de los archivos publicados
+Guarda en SQLite título, origen, formato, tamaño, duración y fechas de cada
+archivo al terminar la descarga, así que listar no recorre el directorio.
+La paginación es por cursor (keyset): cada página cuesta lo mismo sin importar
+cuántos archivos haya.
+"""
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    filename    TEXT PRIMARY KEY,
+    title       TEXT NOT NULL DEFAULT '',
+    url         TEXT,
+    video_key   TEXT,
+    format      TEXT,
+    size        INTEGER NOT NULL DEFAULT 0,
+    duration    REAL,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_created_at ON files (created_at, filename);
+CREATE INDEX IF NOT EXISTS files_size ON files (size, filename);
+CREATE INDEX IF NOT EXISTS files_title ON files (title, filename);
+CREATE INDEX IF NOT EXISTS files_format ON files (format);
+"""
+
+SORT_COLUMNS = ('created_at', 'size', 'title', 'filename')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class InvalidQuery(ValueError):
+    """Parámetros de listado no válidos (orden, cursor o tamaño de página)"""
+
+
+def _encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidQuery('Cursor no válido')
+    if not isinstance(values, list) or len(values) != 2:
+        raise InvalidQuery('Cursor no válido')
+    return values
+
+
+class Library:
+    """Índice SQLite de archivos; una conexión por hilo"""
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def add(self, filename, size, title='', url=None, video_key=None, format=None,
+            duration=None, created_at=None):
+        """Registra (o actualiza) un archivo publicado"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO files (filename, title, url, video_key, format, size, duration, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (filename) DO UPDATE SET
+                    title = excluded.title, url = excluded.url, video_key = excluded.video_key,
+                    format = excluded.format, size = excluded.size, duration = excluded.duration,
+                    updated_at = excluded.updated_at
+                """,
+                (filename, title or '', url, video_key, format, size, duration, created_at or now, now)
+            )
+
+    def remove(self, filename):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM files WHERE filename = ?', (filename,))
+
+    def count(self):
+        return self._connect().execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def backfill(self, root):
+        """
+        Llena el índice con los archivos que ya hay en root (solo si está vacío),
+        para instalaciones que tenían archivos antes de existir el índice
+        """
+        if self.count():
+            return 0
+        rows = []
+        now = time.time()
+        for entry in os.scandir(root):
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            stat = entry.stat()
+            stem, ext = os.path.splitext(entry.name)
+            rows.append((entry.name, stem, ext.lstrip('.').lower() or None, stat.st_size, stat.st_mtime, now))
+        with self._connect() as conn:
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO files (filename, title, format, size, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+        return len(rows)
+
+    def page(self, limit=DEFAULT_PAGE_SIZE, cursor=None, sort='created_at', order='desc',
+             q=None, format=None):
+        """
+        Devuelve (items, next_cursor). sort es una de SORT_COLUMNS, order 'asc' o 'desc';
+        q filtra por título y format por extensión/formato.
+        """
+        if sort not in SORT_COLUMNS:
+            raise InvalidQuery(f"Orden no válido: {sort}")
+        if order not in ('asc', 'desc'):
+            raise InvalidQuery(f"Dirección no válida: {order}")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise InvalidQuery(f"limit debe estar entre 1 y {MAX_PAGE_SIZE}")
+
+        where, params = [], []
+        if q:
+            where.append("title LIKE ? ESCAPE '\\'")
+            escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params.append(f'%{escaped}%')
+        if format:
+            where.append('format = ?')
+            params.append(format.lower())
+        if cursor:
+            # Keyset: continuar después de la última fila (valor de orden, filename)
+            value, filename = _decode_cursor(cursor)
+            op = '<' if order == 'desc' else '>'
+            if sort == 'filename':
+                where.append(f'filename {op} ?')
+                params.append(filename)
+            else:
+                where.append(f'({sort} {op} ? OR ({sort} = ? AND filename {op} ?))')
+                params.extend([value, value, filename])
+
+        direction = order.upper()
+        sql = 'SELECT * FROM files'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY {sort} {direction}, filename {direction} LIMIT ?'
+        params.append(limit + 1)
+
+        rows = self._connect().execute(sql, params).fetchall()
+        items = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = items[-1]
+            next_cursor = _encode_cursor([last[sort], last['filename']])
+        return items, next_cursor
@@ -0,0 +1,224 @@
+"""
+Registro estructurado con niveles, en lugar de print()
+- configure() pone una cola acotada en el logger raíz: el hilo que registra solo
+  encola y un hilo aparte formatea y escribe en stdout, así que una consola o un
+  colector lento no frenan las peticiones. Con la cola llena el registro se
+  descarta y se cuenta en media_log_dropped_total
+- Los mensajes usan el formato diferido de logging (logger.info('... %s', x)):
+  por debajo de LOG_LEVEL no se formatea nada, y por encima se formatea en el
+  hilo escritor
+- LOG_FORMAT=json escribe una línea JSON por registro con los campos extra;
+  text (por defecto), una línea legible con los campos como clave=valor
+- request_id y job_id se añaden a cada registro: bind_requests(app) (y las rutas
+  nativas de asgi.py) toman request_id de X-Request-ID o generan uno, y
+  JobManager los fija al ejecutar el trabajo
+- RateLimitFilter resume los mensajes que se repiten (reintentos de estrategias)
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager, suppress
+from logging.handlers import QueueHandler, QueueListener
+
+from metrics import counter
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+# Mensajes repetidos: como mucho LOG_SAMPLE_BURST de cada tipo por LOG_SAMPLE_INTERVAL segundos
+LOG_SAMPLE_BURST = int(os.getenv('LOG_SAMPLE_BURST', 10))
+LOG_SAMPLE_INTERVAL = float(os.getenv('LOG_SAMPLE_INTERVAL', 60))
+
+LOG_DROPPED = counter('media_log_dropped_total', 'Registros descartados con la cola de logs llena')
+
+request_id = contextvars.ContextVar('request_id', default=None)
+job_id = contextvars.ContextVar('job_id', default=None)
+
+_CONTEXT = {'request_id': request_id, 'job_id': job_id}
+
+# Identificadores de petición aceptados desde la cabecera X-Request-ID
+_REQUEST_ID = re.compile(r'[A-Za-z0-9._:-]{1,64}')
+
+# Atributos propios de LogRecord: el resto son campos extra
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+_listener = None
+_lock = threading.Lock()
+
+
+@contextmanager
+def bind(**ids):
+    """Fija request_id y/o job_id en los registros del bloque (en este hilo)"""
+    tokens = [(_CONTEXT[name], _CONTEXT[name].set(value)) for name, value in ids.items()]
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def _fields(record):
+    return {name: value for name, value in vars(record).items()
+            if name not in _RESERVED and value is not None}
+
+
+class ContextFilter(logging.Filter):
+    """Copia request_id y job_id al registro en el hilo que lo emite"""
+
+    def filter(self, record):
+        for name, var in _CONTEXT.items():
+            if getattr(record, name, None) is None:
+                setattr(record, name, var.get())
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Deja pasar como mucho burst registros de cada tipo cada interval segundos;
+    el primero que pasa después lleva suppressed=N con los que se omitieron.
+    El tipo es el campo extra sample_key o, si no hay, el formato del mensaje.
+    ERROR y superiores pasan siempre.
+    """
+
+    def __init__(self, burst=LOG_SAMPLE_BURST, interval=LOG_SAMPLE_INTERVAL):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        key = getattr(record, 'sample_key', None) or (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            # [inicio de la ventana, registros emitidos, registros omitidos]
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                window = self._windows[key] = [now, 0, suppressed]
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+            suppressed, window[2] = window[2], 0
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler que no bloquea nunca y deja el formato al hilo escritor"""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+    def prepare(self, record):
+        # Sin formatear aquí: el mensaje, los argumentos y la excepción viajan tal cual
+        return record
+
+
+class StdoutHandler(logging.StreamHandler):
+    """Escribe en el sys.stdout de cada momento (sigue a redirect_stdout)"""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _fields(record)
+        if not fields:
+            return line
+        first, newline, rest = line.partition('\n')
+        extra = ' '.join(f'{name}={value}' for name, value in fields.items())
+        return f'{first} {extra}{newline}{rest}'
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        data.update(_fields(record))
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def configure(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """Instala la cola y el hilo escritor en el logger raíz (una vez por proceso)"""
+    global _listener
+    with _lock:
+        root = logging.getLogger()
+        root.setLevel(level)
+        if _listener:
+            return
+        output = logging.StreamHandler(stream) if stream else StdoutHandler()
+        output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+        handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        handler.addFilter(ContextFilter())
+        root.addHandler(handler)
+        _listener = QueueListener(handler.queue, output)
+        _listener.start()
+        # Vaciar la cola al salir
+        atexit.register(_listener.stop)
+
+
+def new_request_id(value=None):
+    """Devuelve value si es un X-Request-ID válido o, si no, un identificador nuevo"""
+    if value and _REQUEST_ID.fullmatch(value):
+        return value
+    return uuid.uuid4().hex[:16]
+
+
+def bind_requests(app):
+    """
+    Da un request_id a cada petición de app: el de la cabecera X-Request-ID si
+    es válido o uno nuevo. Se devuelve en la respuesta con la misma cabecera.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _bind_request_id():
+        g.request_id_token = request_id.set(new_request_id(request.headers.get('X-Request-ID')))
+
+    @app.after_request
+    def _send_request_id(response):
+        value = request_id.get()
+        if value:
+            response.headers['X-Request-ID'] = value
+        return response
+
+    @app.teardown_request
+    def _unbind_request_id(exc):
+        token = g.pop('request_id_token', None)
+        if token:
+            # El servidor puede cerrar la petición desde otro contexto
+            with suppress(ValueError):
+                request_id.reset(token)
@@ -0,0 +1,332 @@
+"""
+Métricas en el formato de texto de Prometheus, sin dependencias
+- Counter, Gauge e Histogram con etiquetas. Los valores que ya se llevan en
+  otro sitio (cola de trabajos, pool de ffmpeg, disco) se leen al exportar
+  pasando func en lugar de actualizarlos a mano
+- timed(phase) mide una fase del camino de descarga en media_phase_seconds
+- instrument_app(app) registra estado, duración (incluido el envío del cuerpo)
+  y bytes de cada respuesta
+- Profiler: con un directorio configurado, las peticiones con ?profile=1 o la
+  cabecera X-Profile: 1 se ejecutan bajo cProfile y se guarda un .prof (uno a
+  la vez por proceso: mientras hay otro en curso, no se perfila)
+Cada proceso tiene su propio registro: con varios workers de gunicorn, cada
+scrape ve solo el proceso que lo atiende.
+"""
+import bisect
+import cProfile
+import functools
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Segundos: desde operaciones de disco hasta descargas de varios minutos
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=(), func=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.func = func
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels) or set(labels) != set(self.labels):
+            raise ValueError(f"{self.name}: se esperaban las etiquetas {list(self.labels)}, no {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _items(self):
+        """(valores de etiquetas, valor); func devuelve un número o {tupla de etiquetas: número}"""
+        if self.func:
+            value = self.func()
+            if isinstance(value, dict):
+                return [(tuple(str(v) for v in key), v) for key, v in value.items()]
+            return [((), value)]
+        with self._lock:
+            return list(self._values.items())
+
+    def samples(self):
+        """(sufijo, etiquetas, valor) de cada serie"""
+        return [('', list(zip(self.labels, key)), value) for key, value in self._items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {_escape(self.help)}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            # Conteos por intervalo (no acumulados), suma y total
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _items(self):
+        with self._lock:
+            return [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+
+    def samples(self):
+        samples = []
+        for key, (counts, total, count) in self._items():
+            labels = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                samples.append(('_bucket', labels + [('le', _format_value(float(bound)))], cumulative))
+            samples.append(('_bucket', labels + [('le', '+Inf')], count))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        """Registra metric; si ya había una con el mismo nombre, la sustituye"""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                # Una métrica calculada que falla no debe tumbar el scrape entero
+                continue
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labels=(), func=None):
+    return REGISTRY.register(Counter(name, help, labels, func))
+
+
+def gauge(name, help, labels=(), func=None):
+    return REGISTRY.register(Gauge(name, help, labels, func))
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+
+def render():
+    return REGISTRY.render()
+
+
+# Métricas del camino de descarga, compartidas por los módulos que lo recorren
+PHASE_SECONDS = histogram(
+    'media_phase_seconds',
+    'Duración de cada fase: cookies, extract, strategy, download, postprocess (transcode: solo FFmpeg), publish, queue, job',
+    ['phase']
+)
+STRATEGY_ATTEMPTS = counter(
+    'media_strategy_attempts_total',
+    'Intentos cliente × formato por resultado (ok o motivo del fallo)',
+    ['client', 'result']
+)
+DOWNLOADED_BYTES = counter('media_downloaded_bytes_total', 'Bytes recibidos de los orígenes')
+JOBS_COMPLETED = counter('media_jobs_completed_total', 'Trabajos terminados por estado', ['status'])
+HTTP_REQUESTS = counter(
+    'media_http_requests_total', 'Respuestas por endpoint, método y estado', ['endpoint', 'method', 'status']
+)
+HTTP_SECONDS = histogram(
+    'media_http_request_seconds', 'Duración de las respuestas, incluido el envío del cuerpo', ['endpoint']
+)
+HTTP_BYTES = counter('media_http_response_bytes_total', 'Bytes enviados en las respuestas', ['endpoint'])
+
+
+@contextmanager
+def timed(phase):
+    """Registra la duración del bloque como la fase phase (también si falla)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASE_SECONDS.observe(time.perf_counter() - started, phase=phase)
+
+
+class Profiler:
+    """
+    Perfiles de cProfile bajo demanda. Inactivo si directory es None; si no,
+    cada perfil se guarda como <nombre>-<fecha>-<id>.prof en directory
+    (se abre con python -m pstats o snakeviz). cProfile solo ve el hilo en
+    el que se activa: wrap() perfila una función en el hilo que la ejecute.
+    Desde Python 3.12 solo puede haber un perfilador activo por proceso: si
+    ya hay uno, start() devuelve None y la petición o el trabajo se ejecuta
+    sin perfil.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._busy = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def wants(self, request):
+        """Indica si la petición pide perfil (?profile=1 o X-Profile: 1)"""
+        return self.enabled and '1' in (request.args.get('profile'), request.headers.get('X-Profile'))
+
+    def start(self):
+        """Activa un perfil; None si ya hay otro en curso"""
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Otra herramienta de perfilado ya está activa
+            self._busy.release()
+            return None
+        return profile
+
+    def stop(self, profile, name):
+        """Detiene profile y lo guarda; devuelve la ruta del archivo (None sin perfil)"""
+        if profile is None:
+            return None
+        try:
+            profile.disable()
+            path = os.path.join(
+                self.directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}.prof"
+            )
+            profile.dump_stats(path)
+        finally:
+            self._busy.release()
+        return path
+
+    def wrap(self, func, name):
+        # wraps: en JOBS_BACKEND=store el worker importa la función original (sin perfil)
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            profile = self.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.stop(profile, name)
+        return profiled
+
+
+def _counting(iterable, endpoint):
+    """Cuenta los bytes de un cuerpo enviado por partes"""
+    try:
+        for chunk in iterable:
+            HTTP_BYTES.inc(len(chunk), endpoint=endpoint)
+            yield chunk
+    finally:
+        close = getattr(iterable, 'close', None)
+        if close:
+            close()
+
+
+def instrument_app(app, profiler=None, job_endpoints=()):
+    """
+    Registra en app las métricas HTTP de cada respuesta. La duración se mide
+    al cerrar la respuesta, cuando el servidor ya envió el cuerpo completo.
+    Con profiler, perfila el manejo de las peticiones que lo piden, salvo en
+    job_endpoints: rutas que encolan un trabajo y lo perfilan con wrap().
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _start_metrics():
+        g.metrics_started = time.perf_counter()
+        if profiler and request.endpoint not in job_endpoints and profiler.wants(request):
+            g.profile = profiler.start()
+
+    @app.after_request
+    def _finish_metrics(response):
+        endpoint = request.endpoint or 'unknown'
+        profile = g.pop('profile', None)
+        if profile:
+            response.headers['X-Profile-File'] = os.path.basename(profiler.stop(profile, endpoint))
+
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        if response.content_length is not None:
+            HTTP_BYTES.inc(response.content_length, endpoint=endpoint)
+        elif response.is_streamed:
+            response.response = _counting(response.response, endpoint)
+
+        started = g.get('metrics_started', time.perf_counter())
+        response.call_on_close(
+            lambda: HTTP_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        )
+        return response
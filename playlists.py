@@ -0,0 +1,310 @@
+"""
+Descarga de listas de reproducción y canales
+1. Las entradas se enumeran con extracción plana (una sola petición, sin
+   extraer cada video)
+2. Cada entrada se encola como un trabajo en el JobManager, que limita el
+   paralelismo global y por host
+3. El estado de cada entrada se guarda en JSON, así que volver a pedir la misma
+   lista (o reiniciar el servidor) solo descarga lo que falta
+Los archivos terminados se entregan uno a uno o en un zip generado al vuelo.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+import yt_dlp
+
+from jobs import JOB_FAILED, JOB_FINISHED, JOB_QUEUED, JOB_RUNNING
+from ydl_options import thaw
+
+PLAYLIST_DIR_NAME = '.playlists'
+
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+
+class NotAPlaylist(ValueError):
+    """La URL corresponde a un solo video, no a una lista"""
+
+
+def flat_entries(url, opts, max_items=None):
+    """
+    Enumera las entradas de una lista sin extraer cada video.
+    Devuelve (info de la lista, [{'url', 'title', 'id'}]).
+    """
+    opts = thaw(opts)
+    opts.update({
+        'extract_flat': 'in_playlist',
+        'noplaylist': False,
+        'skip_download': True,
+    })
+    if max_items:
+        opts['playlistend'] = max_items
+
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        raise NotAPlaylist("La URL no corresponde a una lista de reproducción o canal")
+
+    entries = []
+    for entry in info.get('entries') or []:
+        if not entry:
+            continue
+        entry_url = entry.get('url') or entry.get('webpage_url')
+        if not entry_url:
+            continue
+        entries.append({
+            'url': entry_url,
+            'title': entry.get('title'),
+            'id': entry.get('id'),
+        })
+    return info, entries
+
+
+def playlist_id(info, format_type):
+    """Id estable de una lista + formato, para reanudarla"""
+    source = f"{info.get('extractor_key') or info.get('ie_key')}:{info.get('id') or info.get('webpage_url')}"
+    return hashlib.sha1(f'{source}|{format_type}'.encode('utf-8')).hexdigest()[:16]
+
+
+def _new_item(index, entry):
+    return {
+        'index': index,
+        'url': entry['url'],
+        'title': entry.get('title'),
+        'status': JOB_QUEUED,
+        'filename': None,
+        'error': None,
+    }
+
+
+class PlaylistRun:
+    """Estado de la descarga de una lista y de cada una de sus entradas"""
+
+    def __init__(self, id, url, format_type, title, items, created_at=None):
+        self.id = id
+        self.url = url
+        self.format_type = format_type
+        self.title = title
+        self.items = items
+        self.created_at = created_at or time.time()
+        self.updated_at = self.created_at
+        self.lock = threading.Lock()
+
+    @classmethod
+    def new(cls, id, url, format_type, title, entries):
+        items = [_new_item(index, entry) for index, entry in enumerate(entries)]
+        return cls(id, url, format_type, title, items)
+
+    @classmethod
+    def from_dict(cls, data):
+        run = cls(
+            data['id'], data['url'], data['format'], data.get('title'),
+            data['items'], created_at=data.get('created_at')
+        )
+        run.updated_at = data.get('updated_at', run.created_at)
+        return run
+
+    @property
+    def status(self):
+        statuses = {item['status'] for item in self.items}
+        if statuses & {JOB_QUEUED, JOB_RUNNING}:
+            return JOB_RUNNING
+        if JOB_FAILED in statuses:
+            return JOB_FAILED
+        return JOB_FINISHED
+
+    def counts(self):
+        counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_FINISHED: 0, JOB_FAILED: 0}
+        for item in self.items:
+            counts[item['status']] = counts.get(item['status'], 0) + 1
+        counts['total'] = len(self.items)
+        return counts
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'id': self.id,
+                'url': self.url,
+                'format': self.format_type,
+                'title': self.title,
+                'status': self.status,
+                'counts': self.counts(),
+                'created_at': self.created_at,
+                'updated_at': self.updated_at,
+                'items': [dict(item) for item in self.items],
+            }
+
+
+class PlaylistManager:
+    """
+    Reparte las entradas de las listas en el JobManager y guarda su estado en
+    root/.playlists. download(url, format_type) debe devolver un dict con
+    'filename'; exists(filename) indica si un archivo publicado sigue en disco.
+    """
+
+    def __init__(self, root, jobs, download, exists):
+        self.dir = Path(root) / PLAYLIST_DIR_NAME
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.jobs = jobs
+        self.download = download
+        self.exists = exists
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._runs = {}
+        # Entradas con un trabajo encolado o en curso en este proceso: (id, index)
+        self._active = set()
+
+    def get(self, id):
+        if not re.fullmatch(r'[0-9a-f]{16}', id or ''):
+            return None
+        with self._lock:
+            run = self._runs.get(id)
+            if run is None:
+                run = self._load(id)
+                if run:
+                    self._runs[id] = run
+            return run
+
+    def start(self, id, url, format_type, title, entries):
+        """
+        Crea o reanuda una lista: encola las entradas que no están terminadas
+        (o cuyo archivo ya no existe). Devuelve (run, entradas encoladas).
+        """
+        run = self.get(id)
+        with self._lock:
+            if run is None:
+                run = PlaylistRun.new(id, url, format_type, title, entries)
+                self._runs[id] = run
+
+            pending = []
+            with run.lock:
+                # Entradas nuevas desde la última vez (p. ej. videos recientes de un canal)
+                known = {item['url'] for item in run.items}
+                for entry in entries:
+                    if entry['url'] not in known:
+                        run.items.append(_new_item(len(run.items), entry))
+                for item in run.items:
+                    if (id, item['index']) in self._active:
+                        continue
+                    if item['status'] == JOB_FINISHED and item['filename'] and self.exists(item['filename']):
+                        continue
+                    item.update(status=JOB_QUEUED, error=None)
+                    self._active.add((id, item['index']))
+                    pending.append(item)
+        self._save(run)
+
+        for item in pending:
+            self.jobs.submit(item['url'], self._run_item, run, item['index'])
+        return run, len(pending)
+
+    def finished_files(self, run):
+        """Nombres de los archivos de las entradas terminadas que siguen en disco"""
+        with run.lock:
+            names = [item['filename'] for item in run.items
+                     if item['status'] == JOB_FINISHED and item['filename']]
+        return [name for name in names if self.exists(name)]
+
+    def _run_item(self, run, index):
+        item = run.items[index]
+        self._update(run, item, status=JOB_RUNNING)
+        try:
+            result = self.download(item['url'], run.format_type)
+        except Exception as e:
+            self._update(run, item, status=JOB_FAILED, error=str(e))
+            raise
+        else:
+            self._update(
+                run, item,
+                status=JOB_FINISHED,
+                filename=result['filename'],
+                title=result.get('title') or item['title'],
+                error=None
+            )
+            return result
+        finally:
+            with self._lock:
+                self._active.discard((run.id, index))
+
+    def _update(self, run, item, **fields):
+        with run.lock:
+            item.update(fields)
+            run.updated_at = time.time()
+        self._save(run)
+
+    def _path(self, id):
+        return self.dir / f'{id}.json'
+
+    def _load(self, id):
+        try:
+            with open(self._path(id), 'r', encoding='utf-8') as f:
+                run = PlaylistRun.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+        # Lo que estaba en curso cuando se detuvo el proceso se vuelve a encolar
+        for item in run.items:
+            if item['status'] in (JOB_QUEUED, JOB_RUNNING):
+                item['status'] = JOB_QUEUED
+        return run
+
+    def _save(self, run):
+        path = self._path(run.id)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        # Foto del estado y escritura juntas, para que una foto vieja no pise a una nueva
+        with self._save_lock:
+            data = run.to_dict()
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, path)
+            except OSError:
+                pass
+
+
+class _ZipStream:
+    """Destino de zipfile que no admite seek: acumula lo escrito hasta que se lee"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(files):
+    """
+    Genera un zip (sin compresión, ZIP_STORED) a partir de [(ruta, nombre)]
+    mientras se envía: no se crea ningún archivo temporal
+    """
+    output = _ZipStream()
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for path, name in files:
+            info = zipfile.ZipInfo.from_file(path, arcname=name)
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as src, archive.open(info, 'w') as dest:
+                while True:
+                    chunk = src.read(ZIP_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    data = output.drain()
+                    if data:
+                        yield data
+    # Directorio central del zip, escrito al cerrar el archivo
+    data = output.drain()
+    if data:
+        yield data
@@ -0,0 +1,97 @@
+"""
+Seguimiento de descargas mediante los hooks de yt-dlp
+yt-dlp avisa cuando termina cada descarga (progress_hooks) y cada
+post-procesado (postprocessor_hooks); con eso y requested_downloads se conoce
+el archivo final sin tener que revisar el directorio ni esperar con sleep.
+Los mismos hooks informan el progreso (bytes, velocidad, ETA) a on_progress,
+cuentan los bytes recibidos en las métricas y cortan la descarga en cuanto
+supera max_bytes.
+"""
+import os
+
+from metrics import DOWNLOADED_BYTES
+from storage import FileTooLarge
+
+
+class DownloadTracker:
+    """
+    Registra los archivos terminados que reportan los hooks de yt-dlp.
+    on_progress(phase, **datos) recibe el progreso de la descarga y del post-procesado.
+    max_bytes: la descarga se interrumpe (FileTooLarge) si el tamaño que anuncia
+    el servidor o los bytes recibidos lo superan.
+    """
+
+    def __init__(self, on_progress=None, max_bytes=None):
+        self.downloaded = []
+        self.final_path = None
+        self.on_progress = on_progress
+        self.max_bytes = max_bytes
+        self._received = {}
+
+    def reset(self):
+        self.downloaded = []
+        self.final_path = None
+        self._received = {}
+
+    def hook_options(self):
+        """Opciones de yt-dlp que instalan los hooks de este tracker"""
+        return {
+            'progress_hooks': [self.progress_hook],
+            'postprocessor_hooks': [self.postprocessor_hook],
+        }
+
+    def progress_hook(self, d):
+        status = d.get('status')
+        self._count_bytes(d)
+        if status == 'finished' and d.get('filename'):
+            self.downloaded.append(d['filename'])
+        elif status == 'downloading' and self.max_bytes:
+            # total_bytes es el Content-Length real; total_bytes_estimate no se usa para cortar
+            size = max(d.get('total_bytes') or 0, d.get('downloaded_bytes') or 0)
+            if size > self.max_bytes:
+                raise FileTooLarge(
+                    f"El archivo supera el tamaño máximo de {self.max_bytes} bytes; descarga interrumpida."
+                )
+        if status == 'downloading' and self.on_progress:
+            self.on_progress(
+                'downloading',
+                downloaded_bytes=d.get('downloaded_bytes'),
+                total_bytes=d.get('total_bytes') or d.get('total_bytes_estimate'),
+                speed=d.get('speed'),
+                eta=d.get('eta'),
+                fragment_index=d.get('fragment_index'),
+                fragment_count=d.get('fragment_count'),
+            )
+
+    def _count_bytes(self, d):
+        # downloaded_bytes es acumulado por archivo: se suma solo lo nuevo
+        received = d.get('downloaded_bytes')
+        if received is None or not d.get('filename'):
+            return
+        previous = self._received.get(d['filename'], 0)
+        if received > previous:
+            DOWNLOADED_BYTES.inc(received - previous)
+        self._received[d['filename']] = received
+
+    def postprocessor_hook(self, d):
+        if d.get('status') == 'started' and self.on_progress:
+            self.on_progress('processing', postprocessor=d.get('postprocessor'))
+        if d.get('status') == 'finished':
+            path = (d.get('info_dict') or {}).get('filepath')
+            if path:
+                self.final_path = path
+
+
+def downloaded_path(info, tracker=None):
+    """
+    Ruta del archivo final de una descarga: primero la que yt-dlp deja en
+    requested_downloads, y si no, la última reportada por los hooks
+    """
+    candidates = [d.get('filepath') for d in reversed(info.get('requested_downloads') or [])]
+    if tracker:
+        candidates.append(tracker.final_path)
+        candidates.extend(reversed(tracker.downloaded))
+    for path in candidates:
+        if path and os.path.isfile(path):
+            return path
+    return None
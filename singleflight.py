@@ -0,0 +1,69 @@
+"""
+Deduplicación de trabajos simultáneos (single-flight)
+Si varias peticiones piden la misma clave a la vez, solo la primera ejecuta el
+trabajo; las demás esperan y reciben el mismo resultado (o la misma excepción)
+"""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Ejecuta func(*args, **kwargs) una sola vez por clave en vuelo.
+        Devuelve (resultado, compartido), donde compartido indica que el
+        resultado viene de la ejecución de otra petición.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call:
+                call.followers += 1
+                self.shared += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return {key: call.followers for key, call in self._calls.items()}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'shared': self.shared,
+            }
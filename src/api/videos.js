@@ -5,36 +5,155 @@
 // Usamos siempre el mismo origen desde donde se carga la app (ej: http://127.0.0.1:5000)
 const API_BASE = window.location.origin;
 
+// Intervalo entre consultas del estado de un trabajo de descarga
+const JOB_POLL_INTERVAL = 2000;
+// Tiempo máximo de espera de un trabajo (15 minutos)
+const JOB_TIMEOUT = 15 * 60 * 1000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+/**
+ * Lee el mensaje de error de una respuesta JSON del backend
+ * @param {Response} response
+ * @returns {Promise<Error>}
+ */
+async function responseError(response) {
+    const errorData = await response.json().catch(() => ({}));
+    return new Error(errorData.error || `Error ${response.status}: ${response.statusText}`);
+}
+
+/**
+ * Encola la descarga en el backend y devuelve el trabajo creado
+ * @param {string} url - URL del video
+ * @param {string} format - 'video' o 'mp3'
+ * @returns {Promise<{job_id: string, status_url: string, result_url: string, events_url: string}>}
+ */
+export async function createDownloadJob(url, format = 'video') {
+    const response = await fetch(`${API_BASE}/api/download`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ url, format }),
+    });
+
+    if (!response.ok) {
+        throw await responseError(response);
+    }
+    return response.json();
+}
+
+/**
+ * Consulta el estado de un trabajo hasta que termine
+ * @param {Object} job - Trabajo devuelto por createDownloadJob
+ * @returns {Promise<Object>} Estado final del trabajo
+ */
+export async function waitForJob(job) {
+    const deadline = Date.now() + JOB_TIMEOUT;
+
+    while (Date.now() < deadline) {
+        const response = await fetch(`${API_BASE}${job.status_url}`);
+        if (!response.ok) {
+            throw await responseError(response);
+        }
+
+        const status = await response.json();
+        if (status.status === 'finished') {
+            return status;
+        }
+        if (status.status === 'failed') {
+            throw new Error(status.error || 'Error al descargar el video');
+        }
+        await sleep(JOB_POLL_INTERVAL);
+    }
+
+    const timeoutError = new Error('timeout');
+    timeoutError.name = 'AbortError';
+    throw timeoutError;
+}
+
+/**
+ * Sigue el avance de un trabajo con Server-Sent Events (events_url).
+ * Si el navegador no admite EventSource o la conexión se cae, vuelve a
+ * consultar el estado con waitForJob.
+ * @param {Object} job - Trabajo devuelto por createDownloadJob
+ * @param {Function} [onProgress] - Recibe el avance ({phase, downloaded_bytes, total_bytes, speed, eta, ...})
+ * @returns {Promise<Object>} Estado final del trabajo
+ */
+export function followJob(job, onProgress) {
+    if (!job.events_url || typeof EventSource === 'undefined') {
+        return waitForJob(job);
+    }
+
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(`${API_BASE}${job.events_url}`);
+        const timer = setTimeout(() => {
+            source.close();
+            const timeoutError = new Error('timeout');
+            timeoutError.name = 'AbortError';
+            reject(timeoutError);
+        }, JOB_TIMEOUT);
+
+        const finish = () => {
+            clearTimeout(timer);
+            source.close();
+        };
+
+        source.addEventListener('progress', (event) => {
+            const status = JSON.parse(event.data);
+            if (onProgress && status.progress) {
+                onProgress(status.progress);
+            }
+        });
+        source.addEventListener('finished', (event) => {
+            finish();
+            resolve(JSON.parse(event.data));
+        });
+        source.addEventListener('failed', (event) => {
+            finish();
+            const status = JSON.parse(event.data);
+            reject(new Error(status.error || 'Error al descargar el video'));
+        });
+        source.onerror = () => {
+            // EventSource reintenta por su cuenta; si el servidor cierra, se consulta el estado
+            if (source.readyState === EventSource.CLOSED) {
+                finish();
+                waitForJob(job).then(resolve, reject);
+            }
+        };
+    });
+}
+
 /**
  * Descarga el video o audio en la mejor calidad disponible
  * @param {string} url - URL del video
  * @param {string} format - 'video' o 'mp3'
+ * @param {Function} [onProgress] - Recibe el avance del trabajo en tiempo real
  * @returns {Promise<void>}
  */
-export async function downloadVideo(url, format = 'video') {
-    const endpoint = `${API_BASE}/api/download`;
-    console.log('downloadVideo →', endpoint, { url, format });
+export async function downloadVideo(url, format = 'video', onProgress) {
+    console.log('downloadVideo →', `${API_BASE}/api/download`, { url, format });
 
     try {
-        // Crear un AbortController con timeout muy largo (15 minutos)
-        const controller = new AbortController();
-        const timeoutId = setTimeout(() => controller.abort(), 15 * 60 * 1000); // 15 minutos
-
-        const response = await fetch(endpoint, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({ url, format }),
-            signal: controller.signal,
-        });
-
-        clearTimeout(timeoutId);
+        const job = await createDownloadJob(url, format);
+        await followJob(job, onProgress);
 
+        const response = await fetch(`${API_BASE}${job.result_url}`);
         if (!response.ok) {
-            // Si la respuesta no es OK, intentar leer el error como JSON
-            const errorData = await response.json().catch(() => ({}));
-            throw new Error(errorData.error || `Error ${response.status}: ${response.statusText}`);
+            throw await responseError(response);
+        }
+
+        // El backend de producción devuelve la URL del archivo publicado
+        const contentType = response.headers.get('content-type') || '';
+        if (contentType.includes('application/json')) {
+            const result = await response.json();
+            const link = document.createElement('a');
+            link.href = `${API_BASE}${result.download_url}`;
+            link.download = result.filename;
+            document.body.appendChild(link);
+            link.click();
+            document.body.removeChild(link);
+            return { success: true, filename: result.filename };
         }
 
         // La respuesta es un archivo binario, descargarlo directamente
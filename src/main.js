@@ -3,6 +3,7 @@
  */
 
 import { downloadVideo } from './api/videos.js';
+import { DownloadItem } from './ui/DownloadItem.js';
 
 // Estado de la aplicación
 let currentFormat = 'video';
@@ -12,6 +13,9 @@ const videoForm = document.getElementById('videoForm');
 const videoUrlInput = document.getElementById('videoUrl');
 const downloadBtn = document.getElementById('downloadBtn');
 const pasteBtn = document.getElementById('pasteBtn');
+const downloadProgress = document.getElementById('downloadProgress');
+
+const downloadItem = new DownloadItem();
 
 /**
  * Inicialización de la aplicación
@@ -61,7 +65,7 @@ async function handleDownload(e) {
         const startTime = Date.now();
         
         // Llamar al backend con el formato (video o mp3)
-        const result = await downloadVideo(url, format);
+        const result = await downloadVideo(url, format, renderProgress);
         
         const elapsedTime = Math.round((Date.now() - startTime) / 1000);
         console.log(`Descarga completada en ${elapsedTime} segundos`);
@@ -89,9 +93,20 @@ async function handleDownload(e) {
         showToast(errorMessage, 'error');
     } finally {
         setButtonLoading(downloadBtn, false);
+        if (downloadProgress) {
+            downloadProgress.innerHTML = '';
+        }
     }
 }
 
+/**
+ * Muestra el avance de la descarga en curso
+ */
+function renderProgress(progress) {
+    if (!downloadProgress) return;
+    downloadProgress.innerHTML = downloadItem.createProgressHTML(progress);
+}
+
 /**
  * Maneja el pegado de URL desde el portapapeles
  */
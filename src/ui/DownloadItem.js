@@ -55,6 +55,71 @@ export class DownloadItem {
         `;
     }
 
+    /**
+     * Formatea segundos como m:ss
+     * @param {number} seconds
+     * @returns {string}
+     */
+    formatDuration(seconds) {
+        const total = Math.max(0, Math.round(seconds));
+        const minutes = Math.floor(total / 60);
+        return `${minutes}:${String(total % 60).padStart(2, '0')}`;
+    }
+
+    /**
+     * Crea el HTML del avance de una descarga en curso
+     * @param {Object} progress - Avance recibido por SSE
+     * @param {string} progress.phase - queued, running, extracting, downloading, processing o transcoding
+     * @returns {string} HTML del avance
+     */
+    createProgressHTML(progress) {
+        const labels = {
+            queued: 'En cola',
+            running: 'Iniciando',
+            extracting: 'Obteniendo información',
+            downloading: 'Descargando',
+            processing: 'Procesando',
+            transcoding: 'Convirtiendo audio',
+        };
+        const { phase } = progress;
+
+        let percent = null;
+        const details = [];
+        if (phase === 'downloading') {
+            const total = progress.total_bytes || progress.total_bytes_estimate;
+            if (total) {
+                percent = (progress.downloaded_bytes / total) * 100;
+                details.push(`${this.formatSize(progress.downloaded_bytes)} de ${this.formatSize(total)}`);
+            } else if (progress.fragment_count) {
+                percent = (progress.fragment_index / progress.fragment_count) * 100;
+                details.push(`Fragmento ${progress.fragment_index} de ${progress.fragment_count}`);
+            } else {
+                details.push(this.formatSize(progress.downloaded_bytes));
+            }
+            if (progress.speed) details.push(`${this.formatSize(progress.speed)}/s`);
+            if (progress.eta != null) details.push(`quedan ${this.formatDuration(progress.eta)}`);
+        } else if (phase === 'transcoding' && progress.duration && progress.out_time != null) {
+            percent = (progress.out_time / progress.duration) * 100;
+            if (progress.speed) details.push(`${progress.speed}x`);
+        } else if (phase === 'processing' && progress.postprocessor) {
+            details.push(progress.postprocessor);
+        }
+
+        const hasPercent = percent !== null && Number.isFinite(percent);
+        const width = hasPercent ? Math.min(100, Math.max(0, percent)) : 0;
+
+        return `
+            <div class="progress-header">
+                <span>${this.escapeHtml(labels[phase] || phase)}</span>
+                <span>${hasPercent ? `${width.toFixed(1)}%` : ''}</span>
+            </div>
+            <div class="progress-bar${hasPercent ? '' : ' indeterminate'}">
+                <div class="progress-fill" style="${hasPercent ? `width: ${width}%` : ''}"></div>
+            </div>
+            <div class="progress-details">${this.escapeHtml(details.join(' · '))}</div>
+        `;
+    }
+
     /**
      * Escapa HTML para prevenir XSS
      * @param {string} text - Texto a escapar
@@ -0,0 +1,305 @@
+"""
+Directorios de trabajo y publicación de archivos terminados
+Los directorios temporales se crean dentro de la carpeta de destino (en el mismo
+sistema de archivos), así que publicar un archivo es un os.replace atómico en vez
+de una copia completa.
+
+ScratchArea administra esos directorios:
+- cada descarga usa uno propio (<host>-<pid>-<uuid>) que se borra al terminar
+- un hilo de limpieza borra los que dejan los procesos muertos de esta máquina
+  o las descargas interrumpidas. La carpeta puede estar compartida entre
+  varias máquinas (workers): los directorios de otro host solo se borran por
+  antigüedad
+- antes de descargar se reserva el tamaño previsto: si supera la cuota por
+  trabajo o no cabe en el espacio libre, la descarga falla sin llenar el disco
+- has_room() indica si hay espacio para empezar descargas nuevas
+"""
+import errno
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+
+WORK_DIR_NAME = '.tmp'
+
+# Prefijo de los directorios de esta máquina (<host>-<pid>-<uuid>)
+HOSTNAME = socket.gethostname().replace(os.sep, '_') or 'localhost'
+
+
+class DiskSpaceError(Exception):
+    """No hay espacio libre suficiente para la descarga"""
+
+
+class QuotaExceeded(DiskSpaceError):
+    """La descarga supera la cuota de disco por trabajo"""
+
+
+class FileTooLarge(QuotaExceeded):
+    """El archivo supera el tamaño máximo permitido"""
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        # En Windows os.kill(pid, 0) terminaría el proceso: solo cuenta max_age
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Existe pero es de otro usuario (EPERM)
+        return True
+    return True
+
+
+def _tree_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class ScratchDir:
+    """Directorio de trabajo de una descarga; se borra al salir del bloque with"""
+
+    def __init__(self, area, path):
+        self.area = area
+        self.path = path
+        self.reserved = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def reserve(self, expected_bytes, copies=1):
+        """
+        Reserva espacio para un archivo de expected_bytes (copies: copias que
+        conviven en disco, p. ej. 2 al unir video y audio). Sustituye a la
+        reserva anterior. Lanza QuotaExceeded o DiskSpaceError.
+        """
+        self.area._reserve(self, expected_bytes, expected_bytes * copies)
+
+    def used(self):
+        return _tree_size(self.path)
+
+    def clear(self):
+        """Borra el contenido entre intentos, conservando el directorio"""
+        for entry in os.scandir(self.path):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def close(self):
+        self.area._release(self)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class ScratchArea:
+    """
+    Directorios de trabajo bajo root/.tmp.
+    min_free: espacio libre (bytes) que se conserva siempre; por debajo no se
+    empiezan descargas. job_quota: tamaño máximo previsto de una descarga.
+    max_age: los directorios más antiguos se borran aunque su proceso siga vivo.
+    """
+
+    def __init__(self, root, min_free=0, job_quota=None, max_age=6 * 3600):
+        self.root = Path(root)
+        self.dir = self.root / WORK_DIR_NAME
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.min_free = min_free
+        self.job_quota = job_quota
+        self.max_age = max_age
+        self.reaped = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._reserve_lock = threading.Lock()
+        self._active = {}
+        self._janitor = None
+        self._stop = threading.Event()
+
+    def create(self):
+        """Nuevo ScratchDir para una descarga"""
+        path = os.fspath(self.dir / f'{HOSTNAME}-{os.getpid()}-{uuid.uuid4().hex}')
+        with self._lock:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            os.mkdir(path)
+            scratch = ScratchDir(self, path)
+            self._active[path] = scratch
+        return scratch
+
+    def free_bytes(self):
+        """Espacio libre menos lo reservado que las descargas en curso aún no escribieron"""
+        free = shutil.disk_usage(self.dir).free
+        with self._lock:
+            scratches = [s for s in self._active.values() if s.reserved]
+        return free - sum(max(0, s.reserved - s.used()) for s in scratches)
+
+    def has_room(self, min_free=None):
+        """Hay espacio para empezar otra descarga (por defecto, por encima de self.min_free)"""
+        return self.free_bytes() >= (self.min_free if min_free is None else min_free)
+
+    def reap(self):
+        """
+        Borra los directorios huérfanos: los de procesos de esta máquina que ya no
+        existen, los de este proceso que nadie usa y los de más de max_age segundos.
+        Los de otras máquinas (o sin host) solo se borran por antigüedad.
+        Devuelve cuántos se borraron.
+        """
+        now = time.time()
+        removed = 0
+        try:
+            entries = list(os.scandir(self.dir))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            try:
+                age = now - entry.stat(follow_symlinks=False).st_mtime
+            except OSError:
+                continue
+            parts = entry.name.rsplit('-', 2)
+            # Nombres sin host y pid (versiones anteriores) solo se borran por antigüedad
+            orphan = len(parts) == 3 and parts[0] == HOSTNAME and parts[1].isdigit() and (
+                int(parts[1]) == os.getpid() or not _pid_alive(int(parts[1]))
+            )
+            if not orphan and not (self.max_age and age > self.max_age):
+                continue
+            with self._lock:
+                if entry.path in self._active:
+                    continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
+            except OSError:
+                continue
+            removed += 1
+        with self._lock:
+            self.reaped += removed
+        return removed
+
+    def start_janitor(self, interval=300):
+        """Limpia ahora y después cada interval segundos en un hilo aparte"""
+        self.reap()
+        if self._janitor or not interval:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.reap()
+                except Exception:
+                    pass
+
+        self._janitor = threading.Thread(target=loop, name='scratch-janitor', daemon=True)
+        self._janitor.start()
+
+    def stop_janitor(self):
+        self._stop.set()
+
+    def stats(self):
+        usage = shutil.disk_usage(self.dir)
+        free = self.free_bytes()
+        with self._lock:
+            return {
+                'active': len(self._active),
+                'reserved_bytes': sum(s.reserved for s in self._active.values()),
+                'disk_total': usage.total,
+                'disk_free': usage.free,
+                'available': free,
+                'min_free': self.min_free,
+                'job_quota': self.job_quota,
+                'reaped': self.reaped,
+                'rejected': self.rejected,
+            }
+
+    def _reserve(self, scratch, expected, needed):
+        if self.job_quota and expected > self.job_quota:
+            with self._lock:
+                self.rejected += 1
+            raise QuotaExceeded(
+                f"La descarga ocupa {expected} bytes y supera la cuota de {self.job_quota} bytes por trabajo."
+            )
+        # Una reserva a la vez, para que dos descargas no cuenten el mismo espacio libre
+        with self._reserve_lock:
+            scratch.reserved = 0
+            available = self.free_bytes() - self.min_free
+            if needed > available:
+                with self._lock:
+                    self.rejected += 1
+                raise DiskSpaceError(
+                    f"No hay espacio en disco para la descarga ({needed} bytes necesarios, "
+                    f"{max(0, available)} disponibles)."
+                )
+            scratch.reserved = needed
+
+    def _release(self, scratch):
+        with self._lock:
+            self._active.pop(scratch.path, None)
+        scratch.reserved = 0
+
+
+def _reserve(dest_dir, filename):
+    """
+    Crea de forma exclusiva el archivo de destino para que dos descargas no
+    usen el mismo nombre. Si ya existe, usa un sufijo aleatorio (sin recorrer
+    nombre_1, nombre_2...).
+    """
+    stem, ext = os.path.splitext(filename)
+    for name in (filename, f"{stem}_{uuid.uuid4().hex[:8]}{ext}"):
+        path = os.path.join(dest_dir, name)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            continue
+        os.close(fd)
+        return path, name
+    raise FileExistsError(f"No se pudo reservar un nombre para {filename}")
+
+
+def publish(src, dest_dir, filename):
+    """
+    Mueve src a dest_dir/filename (o a un nombre libre) y devuelve (ruta, nombre).
+    En el mismo sistema de archivos es un rename atómico; si no, el archivo se
+    copia una sola vez a un temporal del destino y se renombra.
+    """
+    dest_dir = os.fspath(dest_dir)
+    os.makedirs(dest_dir, exist_ok=True)
+    final_path, final_name = _reserve(dest_dir, filename)
+    try:
+        try:
+            os.replace(src, final_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            partial = os.path.join(dest_dir, f".{final_name}.{uuid.uuid4().hex[:8]}.partial")
+            try:
+                shutil.copyfile(src, partial)
+                os.replace(partial, final_path)
+            finally:
+                if os.path.exists(partial):
+                    os.remove(partial)
+            os.remove(src)
+    except Exception:
+        try:
+            if os.path.getsize(final_path) == 0:
+                os.remove(final_path)
+        except OSError:
+            pass
+        raise
+    return final_path, final_name
@@ -0,0 +1,159 @@
+"""
+Selección adaptativa de estrategias de descarga (cliente de YouTube × formato)
+Registra el resultado y la latencia de cada combinación en una ventana deslizante,
+prueba primero el cliente que mejor está funcionando y omite temporalmente
+(circuit breaker) las combinaciones que fallan de forma consecutiva
+"""
+import threading
+import time
+from collections import Counter, deque
+
+from metrics import PHASE_SECONDS, STRATEGY_ATTEMPTS
+
+REASON_JSON_BLOCKED = 'json_blocked'
+REASON_FORMAT_UNAVAILABLE = 'format_unavailable'
+REASON_SIGNATURE = 'signature'
+REASON_BOT = 'bot'
+REASON_DRM = 'drm'
+REASON_UNAVAILABLE = 'unavailable'
+REASON_OTHER = 'other'
+
+# Errores que afectan al cliente completo: no tiene sentido probar más formatos con él
+CLIENT_FAILURES = (REASON_JSON_BLOCKED, REASON_SIGNATURE, REASON_BOT)
+
+# Errores que dependen del video (no existe, es privado, no tiene ese formato...) y no
+# de la salud de la combinación: no abren el circuito ni bajan la tasa de éxito
+VIDEO_FAILURES = (REASON_FORMAT_UNAVAILABLE, REASON_DRM, REASON_UNAVAILABLE)
+
+_UNAVAILABLE_MESSAGES = (
+    'video unavailable', 'is unavailable', 'private video', 'has been removed',
+    'does not exist', 'http error 404', 'http error 410', 'unsupported url',
+)
+
+
+def classify_error(error):
+    """Clasifica un error de yt-dlp en un motivo de fallo"""
+    error_msg = str(error).lower()
+    if 'failed to parse json' in error_msg or 'failed to extract any player response' in error_msg:
+        return REASON_JSON_BLOCKED
+    if 'format is not available' in error_msg or 'requested format' in error_msg:
+        return REASON_FORMAT_UNAVAILABLE
+    if 'signature' in error_msg or 'challenge' in error_msg or 'sabr' in error_msg:
+        return REASON_SIGNATURE
+    if 'bot' in error_msg or 'confirm that you are not a bot' in error_msg:
+        return REASON_BOT
+    if 'drm' in error_msg or 'protected' in error_msg or 'encrypted' in error_msg:
+        return REASON_DRM
+    if any(message in error_msg for message in _UNAVAILABLE_MESSAGES):
+        return REASON_UNAVAILABLE
+    return REASON_OTHER
+
+
+class _Stats:
+    def __init__(self, window):
+        self.results = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.open_until = 0
+        self.reasons = Counter()
+
+
+class StrategyScheduler:
+    """
+    window: número de intentos recientes considerados por combinación.
+    max_age: segundos tras los cuales un intento deja de contar.
+    failure_threshold: fallos consecutivos que abren el circuito.
+    cooldown: segundos que una combinación permanece omitida.
+    """
+
+    def __init__(self, window=50, max_age=1800, failure_threshold=3, cooldown=300):
+        self.window = window
+        self.max_age = max_age
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, client, fmt, ok, latency, reason=None):
+        """
+        Registra el resultado de un intento. Con fmt=None, un fallo de la
+        extracción: el formato no llegó a probarse y solo cuenta para el cliente.
+        """
+        now = time.time()
+        PHASE_SECONDS.observe(latency, phase='strategy')
+        STRATEGY_ATTEMPTS.inc(client=client or 'default', result='ok' if ok else reason or REASON_OTHER)
+        with self._lock:
+            stats = self._stats.setdefault((client, fmt), _Stats(self.window))
+            stats.results.append((now, ok, latency, None if ok else reason))
+            if ok:
+                stats.consecutive_failures = 0
+                stats.open_until = 0
+            else:
+                stats.consecutive_failures += 1
+                stats.reasons[reason or REASON_OTHER] += 1
+                if (fmt is not None and reason not in VIDEO_FAILURES
+                        and stats.consecutive_failures >= self.failure_threshold):
+                    stats.open_until = now + self.cooldown
+
+    def order(self, clients, formats):
+        """
+        Combinaciones (cliente, formato) en el orden en que deben probarse.
+        Los clientes se ordenan por su tasa de éxito reciente; dentro de cada
+        cliente se respeta el orden de formatos recibido, que expresa la calidad
+        preferida. Las combinaciones con el circuito abierto se omiten, salvo
+        que lo estén todas.
+        """
+        now = time.time()
+        ranked = []
+        skipped = []
+        with self._lock:
+            for index, client in enumerate(clients):
+                available = []
+                for fmt in formats:
+                    stats = self._stats.get((client, fmt))
+                    if stats and stats.open_until > now:
+                        skipped.append((client, fmt))
+                    else:
+                        available.append((client, fmt))
+                if available:
+                    score, latency = self._client_score(client, now)
+                    ranked.append((-score, latency, index, available))
+        ranked.sort(key=lambda item: item[:3])
+        if not ranked:
+            return skipped
+        return [combo for _, _, _, combos in ranked for combo in combos]
+
+    def _client_score(self, client, now):
+        """Tasa de éxito suavizada (Laplace) y latencia media de los éxitos del cliente"""
+        attempts = 0
+        successes = []
+        for (stats_client, _), stats in self._stats.items():
+            if stats_client != client:
+                continue
+            for ts, ok, latency, reason in stats.results:
+                if now - ts > self.max_age or reason in VIDEO_FAILURES:
+                    continue
+                attempts += 1
+                if ok:
+                    successes.append(latency)
+        score = (len(successes) + 1) / (attempts + 2)
+        latency = sum(successes) / len(successes) if successes else 0.0
+        return round(score, 2), latency
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            combos = []
+            for (client, fmt), stats in self._stats.items():
+                recent = [r for r in stats.results if now - r[0] <= self.max_age]
+                successes = [latency for _, ok, latency, _ in recent if ok]
+                combos.append({
+                    'client': client,
+                    'format': fmt,
+                    'attempts': len(recent),
+                    'success_rate': round(len(successes) / len(recent), 3) if recent else None,
+                    'avg_latency': round(sum(successes) / len(successes), 3) if successes else None,
+                    'consecutive_failures': stats.consecutive_failures,
+                    'circuit_open': stats.open_until > now,
+                    'failure_reasons': dict(stats.reasons),
+                })
+            return {'combinations': combos}
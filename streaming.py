@@ -0,0 +1,119 @@
+"""
+Streaming directo del origen al cliente
+Para formatos progresivos (un solo archivo servido por HTTP) los bytes se envían
+al cliente a medida que llegan, sin esperar a que termine la descarga ni usar
+disco. Si el audio hay que convertirlo, los bytes pasan por ffmpeg (stdin → stdout).
+"""
+import re
+import subprocess
+import threading
+
+from yt_dlp.networking import Request
+
+# Formatos que se pueden servir en streaming: un único archivo por HTTP(S)
+PROGRESSIVE_VIDEO = (
+    'best[protocol^=http][vcodec!=?none][acodec!=?none][ext=mp4]'
+    '/best[protocol^=http][vcodec!=?none][acodec!=?none]'
+)
+PROGRESSIVE_AUDIO = 'bestaudio[protocol^=http][ext=m4a]/bestaudio[protocol^=http]'
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _total_from_content_range(value):
+    # "bytes 0-1048575/12345678"
+    match = re.search(r'/(\d+)\s*$', value or '')
+    return int(match.group(1)) if match else None
+
+
+class OriginStream:
+    """
+    Lectura secuencial de un formato desde el origen. Si yt-dlp indica
+    http_chunk_size (YouTube limita la velocidad de las respuestas largas),
+    el archivo se pide en rangos consecutivos.
+    """
+
+    def __init__(self, ydl, fmt, chunk_size=CHUNK_SIZE):
+        self.ydl = ydl
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.range_size = (fmt.get('downloader_options') or {}).get('http_chunk_size')
+        self.size = fmt.get('filesize')
+        self._response = self._open(0)
+
+        if self._response.status == 206:
+            total = _total_from_content_range(self._response.headers.get('Content-Range'))
+            self.size = total or self.size
+        else:
+            # El servidor ignoró el rango: la respuesta es el archivo completo
+            self.range_size = None
+            length = self._response.headers.get('Content-Length')
+            if length and length.isdigit():
+                self.size = int(length)
+
+    def _open(self, start):
+        headers = dict(self.fmt.get('http_headers') or {})
+        if self.range_size:
+            headers['Range'] = f'bytes={start}-{start + self.range_size - 1}'
+        return self.ydl.urlopen(Request(self.fmt['url'], headers=headers))
+
+    def close(self):
+        """Cierra la respuesta abierta si el flujo no se llega a leer"""
+        self._response.close()
+
+    def __iter__(self):
+        position = 0
+        response = self._response
+        try:
+            while True:
+                chunk = response.read(self.chunk_size)
+                if chunk:
+                    position += len(chunk)
+                    yield chunk
+                    continue
+                response.close()
+                if not self.range_size or not self.size or position >= self.size:
+                    break
+                response = self._open(position)
+        finally:
+            response.close()
+
+
+def pipe_through(chunks, command):
+    """
+    Pasa un flujo de bytes por un proceso que lee de stdin y escribe en stdout
+    (ffmpeg de pipe:0 a pipe:1) y devuelve su salida por partes
+    """
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+
+    def feed():
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except (BrokenPipeError, OSError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        while True:
+            data = process.stdout.read(CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        feeder.join(timeout=5)
@@ -0,0 +1,49 @@
+"""
+Identificadores canónicos de video a partir de la URL
+Usa las expresiones de los extractores de yt-dlp, sin hacer peticiones de red,
+para que distintas URLs del mismo video (youtu.be, watch?v=, m.youtube...) compartan clave
+"""
+import functools
+import hashlib
+from urllib.parse import urlsplit, urlunsplit
+
+import yt_dlp
+
+
+@functools.lru_cache(maxsize=1)
+def _extractor_classes():
+    return [
+        ie for ie in yt_dlp.extractor.gen_extractor_classes()
+        if ie.ie_key() != 'Generic'
+    ]
+
+
+@functools.lru_cache(maxsize=4096)
+def canonical_video_id(url):
+    """Devuelve (extractor, id) para la URL, o None si ningún extractor la reconoce"""
+    for ie in _extractor_classes():
+        try:
+            if not ie.suitable(url):
+                continue
+        except Exception:
+            continue
+        video_id = ie.get_temp_id(url)
+        if video_id:
+            return ie.ie_key().lower(), video_id
+        return None
+    return None
+
+
+def normalize_url(url):
+    """Quita espacios, fragmento y normaliza esquema y host de la URL"""
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ''))
+
+
+def media_key(url):
+    """Clave estable del video: 'extractor:id' o un hash de la URL normalizada"""
+    canonical = canonical_video_id(url.strip())
+    if canonical:
+        return f'{canonical[0]}:{canonical[1]}'
+    digest = hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()
+    return f'url:{digest}'
@@ -0,0 +1,204 @@
+"""
+Worker de descargas para el modo escalable (JOBS_BACKEND=store)
+Toma trabajos del almacén compartido (JOBS_STORE) y los ejecuta con el código
+de la aplicación, sin servir HTTP: la extracción y la conversión se escalan
+aparte de la web (en la misma máquina con el almacén SQLite, ver job_store.py).
+
+Uso:
+    python worker.py
+    python worker.py --app app --concurrency 8 --metrics-port 9100
+
+Importa la aplicación (app_production por defecto) para que las funciones de
+los trabajos y su configuración (JOBS_STORE, DOWNLOAD_DIR, límites de disco...)
+sean las mismas que en la web. Con SIGTERM o Ctrl+C deja de tomar trabajos y
+espera a que terminen los que tiene; si el proceso muere, sus trabajos se
+reintentan en otro worker cuando vence el lease.
+"""
+import argparse
+import importlib
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from job_store import JOB_LEASE, open_store, resolve_task
+from jobs import JOB_FAILED, JOB_FINISHED, PROGRESS_INTERVAL
+from log import bind, configure as configure_logging
+from metrics import CONTENT_TYPE, JOBS_COMPLETED, PHASE_SECONDS, render
+
+logger = logging.getLogger(__name__)
+
+# Espera entre consultas al almacén cuando no hay trabajo (o no hay sitio)
+POLL_INTERVAL = 1
+
+
+class ProgressReporter:
+    """
+    progress(phase, **datos) de un trabajo del almacén; como Job.report_progress,
+    escribe como mucho cada PROGRESS_INTERVAL, o en seguida si cambia la fase
+    """
+
+    def __init__(self, store, leased):
+        self.store = store
+        self.leased = leased
+        self._lock = threading.Lock()
+        self._phase = None
+        self._written_at = 0
+
+    def __call__(self, phase, **fields):
+        now = time.monotonic()
+        with self._lock:
+            if phase == self._phase and now - self._written_at < PROGRESS_INTERVAL:
+                return
+            self._phase = phase
+            self._written_at = now
+        self.store.report_progress(self.leased, dict(fields, phase=phase))
+
+
+class Worker:
+    """
+    Ejecuta hasta concurrency trabajos a la vez, sin pasar de per_host_limit por
+    sitio (contando los de todos los workers). Si admit() devuelve False (p. ej.
+    poco espacio en disco) no toma trabajos nuevos.
+    """
+
+    def __init__(self, store, concurrency=4, per_host_limit=2, lease=JOB_LEASE, admit=None,
+                 poll_interval=POLL_INTERVAL):
+        self.store = store
+        self.concurrency = max(1, int(concurrency))
+        self.per_host_limit = per_host_limit
+        self.lease = lease
+        self.admit = admit
+        self.poll_interval = poll_interval
+        self.id = f'{socket.gethostname()}-{os.getpid()}'
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._active = {}
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='worker')
+
+    def run(self):
+        threading.Thread(target=self._heartbeat, name='worker-heartbeat', daemon=True).start()
+        while not self._stop.is_set():
+            leased = None
+            if len(self._active) < self.concurrency and (not self.admit or self.admit()):
+                try:
+                    leased = self.store.claim(self.id, self.lease, self.per_host_limit)
+                except Exception as e:
+                    logger.warning('No se pudo consultar el almacén de trabajos: %s', e)
+            if leased:
+                with self._lock:
+                    self._active[leased.id] = leased
+                self._executor.submit(self._execute, leased)
+            else:
+                self._stop.wait(self.poll_interval)
+        # Los trabajos tomados terminan; el heartbeat sigue mientras tanto
+        self._executor.shutdown(wait=True)
+
+    def stop(self):
+        self._stop.set()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.lease / 3)
+            with self._lock:
+                active = list(self._active.values())
+            for leased in active:
+                try:
+                    if not self.store.heartbeat(leased, self.lease):
+                        logger.warning('El lease venció y lo tomó otro worker', extra={'job_id': leased.id})
+                except Exception as e:
+                    logger.warning('No se pudo renovar el lease: %s', e, extra={'job_id': leased.id})
+
+    def _execute(self, leased):
+        with bind(job_id=leased.id):
+            self._execute_bound(leased)
+
+    def _execute_bound(self, leased):
+        if leased.attempts == 1:
+            PHASE_SECONDS.observe(leased.started_at - leased.created_at, phase='queue')
+        started = time.time()
+        status = JOB_FAILED
+        logger.info('Trabajo tomado (intento %d)', leased.attempts)
+        try:
+            func = resolve_task(leased.task)
+            kwargs = dict(leased.kwargs)
+            if leased.report_progress:
+                kwargs['progress'] = ProgressReporter(self.store, leased)
+            result = func(*leased.args, **kwargs)
+            status = JOB_FINISHED
+            if not self.store.finish(leased, result):
+                logger.warning('Trabajo terminado, pero ya no era de este worker')
+        except Exception as e:
+            self.store.fail(leased, str(e), traceback.format_exc() if leased.keep_traceback else None)
+            logger.warning('Trabajo fallido: %s', e, exc_info=logger.isEnabledFor(logging.DEBUG))
+        finally:
+            PHASE_SECONDS.observe(time.time() - started, phase='job')
+            JOBS_COMPLETED.inc(status=status)
+            with self._lock:
+                self._active.pop(leased.id, None)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port):
+    """Métricas de Prometheus del worker (fases, trabajos) en http://0.0.0.0:port/"""
+    server = ThreadingHTTPServer(('0.0.0.0', port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='worker-metrics', daemon=True).start()
+    return server
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Worker de descargas del almacén compartido (JOBS_BACKEND=store)')
+    parser.add_argument('--app', default=os.getenv('WORKER_APP', 'app_production'),
+                        help='aplicación cuyas descargas se ejecutan: app_production o app')
+    parser.add_argument('--concurrency', type=int,
+                        help='trabajos simultáneos (por defecto JOBS_MAX_WORKERS)')
+    parser.add_argument('--metrics-port', type=int, default=int(os.getenv('WORKER_METRICS_PORT', 0)),
+                        help='puerto para /metrics (0: desactivado)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_logging()
+    module = importlib.import_module(args.app)
+    scratch = getattr(module, 'scratch', None)
+    worker = Worker(
+        open_store(module.JOBS_STORE),
+        concurrency=args.concurrency or module.JOBS_MAX_WORKERS,
+        per_host_limit=module.JOBS_PER_HOST_LIMIT,
+        admit=scratch.has_room if scratch else None
+    )
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+
+    def shutdown(signum, frame):
+        logger.info('Deteniendo el worker: esperando a que terminen los trabajos en curso...')
+        worker.stop()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    logger.info('Worker %s: %d trabajos simultáneos, almacén %s', worker.id, worker.concurrency, module.JOBS_STORE)
+    worker.run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Plantillas inmutables de opciones de yt-dlp
+Las opciones comunes se construyen una vez al importar la aplicación y cada
+petición obtiene una copia propia con specialize(), añadiendo solo lo que cambia
+"""
+import os
+from types import MappingProxyType
+
+from yt_dlp.utils import parse_bytes
+
+# User-Agent actualizado y realista
+BROWSER_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+# Headers completos de navegador real
+BROWSER_HEADERS = {
+    'User-Agent': BROWSER_USER_AGENT,
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
+    'Accept-Language': 'es-ES,es;q=0.9,en-US;q=0.8,en;q=0.7',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'DNT': '1',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-User': '?1',
+    'Cache-Control': 'max-age=0',
+}
+
+
+def _env_bytes(name, default=None):
+    """Cantidad de bytes de una variable de entorno ('10M', '512K', '1048576')"""
+    value = os.getenv(name, default)
+    if not value or value == '0':
+        return None
+    parsed = parse_bytes(value)
+    if parsed is None:
+        raise ValueError(f"{name} no es una cantidad de bytes válida: {value}")
+    return parsed
+
+
+def network_options():
+    """
+    Opciones de red de yt-dlp configurables por despliegue:
+    - YDL_CONCURRENT_FRAGMENTS: fragmentos DASH/HLS descargados en paralelo
+    - YDL_HTTP_CHUNK_SIZE: los archivos progresivos se piden en rangos de este
+      tamaño (el origen limita menos la velocidad de peticiones cortas)
+    - YDL_THROTTLED_RATE: por debajo de esta velocidad la descarga se considera
+      limitada y se vuelve a extraer la información (URLs nuevas)
+    - YDL_RATE_LIMIT: velocidad máxima por descarga
+    - YDL_SOCKET_TIMEOUT, YDL_RETRIES, YDL_FRAGMENT_RETRIES
+    Valores '0' o vacíos desactivan las opciones de bytes.
+    """
+    opts = {
+        'socket_timeout': int(os.getenv('YDL_SOCKET_TIMEOUT', 30)),
+        'retries': int(os.getenv('YDL_RETRIES', 10)),
+        'fragment_retries': int(os.getenv('YDL_FRAGMENT_RETRIES', 10)),
+        'concurrent_fragment_downloads': max(1, int(os.getenv('YDL_CONCURRENT_FRAGMENTS', 4))),
+    }
+    for option, name, default in (
+        ('http_chunk_size', 'YDL_HTTP_CHUNK_SIZE', '10M'),
+        ('throttledratelimit', 'YDL_THROTTLED_RATE', '100K'),
+        ('ratelimit', 'YDL_RATE_LIMIT', None),
+    ):
+        value = _env_bytes(name, default)
+        if value:
+            opts[option] = value
+    return opts
+
+
+def freeze(value):
+    """Convierte dicts y listas anidados en estructuras de solo lectura"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """Copia mutable de una estructura creada con freeze()"""
+    if isinstance(value, (dict, MappingProxyType)):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+
+def specialize(template, **overrides):
+    """Opciones de una petición: copia de la plantilla más los valores propios"""
+    opts = thaw(template)
+    opts.update(overrides)
+    return opts